@@ -0,0 +1,137 @@
+"""
+Local answer-key balancing for generated quizzes.
+
+Instead of asking the model to spread correct answers (it often doesn't),
+each question's A–D options are permuted locally so that:
+  - every letter is correct at least MIN_EACH times (scaled down for short quizzes)
+  - no letter is correct more than MAX_RUN times in a row
+Explicit option references in the feedback scripts and focus note
+("Correct answer: C", "option B", a script that is just "(A)") are rewritten
+to follow the options they point to. The question text and option bodies are
+never rewritten: a letter there may be subject matter ("P(A)", "Hepatitis B
+or C"). Questions whose options depend on their order or name other options
+("All of the above", "Both A and C") keep their key. Option E (Pass) never moves.
+"""
+import re
+import random
+from collections import Counter
+from typing import Dict, Any, List, Optional
+
+import metrics
+
+LETTERS = "ABCD"
+MIN_EACH = 3
+MAX_RUN = 2
+
+# Only these follow a move; question_text and the options are never rewritten
+TEXT_FIELDS = (
+    "focus_if_wrong",
+    "correct_feedback_script",
+    "incorrect_feedback_script",
+    "pass_feedback_script",
+)
+
+# "option B", "answer: C", "the answer is (D)", "choice [A]"
+_LETTER_REF = re.compile(
+    r"(?P<pre>\b(?:[Oo]ption|[Aa]nswer|[Cc]hoice)\s*(?:is\s+|was\s+)?:?\s*[\[(]?)(?P<letter>[A-D])(?![\w-])"
+)
+# a script that is nothing but the letter: "C", "(C)", "[C]."
+_WHOLE_REF = re.compile(r"^(?P<pre>\s*[\[(]?)(?P<letter>[A-D])(?=[\])]?[.!]?\s*$)")
+
+_ORDER_DEPENDENT = re.compile(r"\b(?:above|below|all of these|none of these)\b", re.IGNORECASE)
+# an option naming other options ("Both A and C", "A or B", "options B-D")
+_OPTION_WORD_REF = re.compile(r"\b(?:[Oo]ptions?|[Cc]hoices?|[Aa]nswers?)\s*:?\s*[\[(]?[A-D]\b")
+_NAMES_OPTIONS = re.compile(r"\b[A-D]\s*(?:,|and|or|&|/|-|–|to)\s*[A-D]\b|" + _OPTION_WORD_REF.pattern)
+
+
+def remap_letter_refs(text: str, mapping: Dict[str, str]) -> str:
+    """Rewrites explicit option references in a feedback/focus text (one pass)."""
+    if not text or not mapping:
+        return text
+
+    def swap(m: re.Match) -> str:
+        return m.group("pre") + mapping.get(m.group("letter"), m.group("letter"))
+
+    if _WHOLE_REF.match(text):
+        return _WHOLE_REF.sub(swap, text)
+    return _LETTER_REF.sub(swap, text)
+
+
+def is_order_dependent(question: Dict[str, Any]) -> bool:
+    """Options or a question text that refer to option positions pin the key."""
+    options = [str(question["options"].get(k, "")) for k in LETTERS]
+    return (
+        any(_ORDER_DEPENDENT.search(o) or _NAMES_OPTIONS.search(o) for o in options)
+        or bool(_OPTION_WORD_REF.search(str(question.get("question_text", ""))))
+    )
+
+
+def _target_keys(current: List[str], pinned: List[bool], min_each: int,
+                 max_run: int, rng: random.Random, attempts: int = 200) -> Optional[List[str]]:
+    """A random key sequence meeting the constraints (pinned positions fixed), or None."""
+    n = len(current)
+    for _ in range(attempts):
+        seq: List[str] = []
+        counts: Counter = Counter()
+        for i in range(n):
+            deficit = {l: max(0, min_each - counts[l]) for l in LETTERS}
+            candidates = [
+                l for l in LETTERS
+                if not (len(seq) >= max_run and all(x == l for x in seq[-max_run:]))
+            ]
+            if pinned[i]:
+                candidates = [current[i]] if current[i] in candidates else []
+            elif sum(deficit.values()) >= n - i:
+                candidates = [l for l in candidates if deficit[l]]
+            if not candidates:
+                break
+            choice = rng.choice(candidates)
+            seq.append(choice)
+            counts[choice] += 1
+        else:
+            if all(counts[l] >= min_each for l in LETTERS):
+                return seq
+    return None
+
+
+def _move_correct_answer(question: Dict[str, Any], target: str) -> bool:
+    source = question["correct_answer_key"]
+    if source == target:
+        return False
+
+    mapping = {source: target, target: source}
+    options = question["options"]
+    options[source], options[target] = options[target], options[source]
+    for field in TEXT_FIELDS:
+        if question.get(field):
+            question[field] = remap_letter_refs(question[field], mapping)
+    question["correct_answer_key"] = target
+    return True
+
+
+def balance_answer_keys(questions: List[Dict[str, Any]], rng: Optional[random.Random] = None,
+                        min_each: int = MIN_EACH, max_run: int = MAX_RUN) -> int:
+    """
+    Permutes options in place so the answer key meets the distribution rules.
+    Returns the number of questions changed.
+    """
+    rng = rng or random.Random()
+    eligible = [
+        q for q in questions
+        if q.get("correct_answer_key") in LETTERS and all(k in q.get("options", {}) for k in LETTERS)
+    ]
+    if not eligible:
+        return 0
+
+    min_each = min(min_each, len(eligible) // len(LETTERS))
+    current = [q["correct_answer_key"] for q in eligible]
+    pinned = [is_order_dependent(q) for q in eligible]
+
+    targets = _target_keys(current, pinned, min_each, max_run, rng)
+    if targets is None:
+        metrics.incr("quiz.balance.unsatisfiable")
+        return 0
+
+    changed = sum(_move_correct_answer(q, t) for q, t in zip(eligible, targets))
+    metrics.incr("quiz.balance.permuted", changed)
+    return changed
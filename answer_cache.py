@@ -0,0 +1,141 @@
+"""
+Semantic answer cache for "Chat from PDF".
+
+Per document (and persona gender), questions are normalized into word
+tokens and compared with Jaccard similarity over words and word bigrams,
+so word order counts ("mitosis and meiosis" ≠ "meiosis and mitosis").
+Two questions never match if their numbers or negations differ
+("type 1" ≠ "type 2", "is" ≠ "is not"), or if any content word differs only
+by form ("number" ≠ "numbers" scores low). Fully local, no external service.
+Chats without a document hash bypass the cache.
+"""
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, FrozenSet, NamedTuple, Optional, Tuple
+
+import metrics
+from feedback_cache import strip_name, fill_name
+
+_PUNCT = re.compile(r"[^\w\s]")
+_SPACES = re.compile(r"\s+")
+_NUMBER = re.compile(r"^\d+(?:\.\d+)?$|^(?:zero|one|two|three|four|five|six|seven|eight|nine|ten|ii|iii|iv|vi|vii|viii|ix)$")
+
+# negations are part of the meaning; "isn't" normalizes to "isn t"
+NEGATIONS = frozenset({"not", "no", "never", "without", "nor", "none", "cannot", "t", "nt"})
+# dropped before matching: filler that doesn't change what is asked
+STOPWORDS = frozenset({
+    "a", "an", "the", "is", "are", "was", "were", "be", "do", "does", "did",
+    "please", "can", "could", "you", "me", "tell", "explain", "about", "of", "in",
+})
+
+
+def normalize_question(question: str) -> str:
+    text = _PUNCT.sub(" ", question.lower())
+    return _SPACES.sub(" ", text).strip()
+
+
+class Signature(NamedTuple):
+    features: FrozenSet[str]       # content words + ordered word bigrams
+    numbers: Tuple[str, ...]       # must match exactly, in order
+    negations: FrozenSet[str]      # must match exactly
+
+
+def question_signature(norm: str) -> Signature:
+    tokens = norm.split()
+    words = [t for t in tokens if t not in STOPWORDS]
+    bigrams = {f"{a} {b}" for a, b in zip(words, words[1:])}
+    return Signature(
+        features=frozenset(words) | frozenset(bigrams),
+        numbers=tuple(t for t in tokens if _NUMBER.match(t)),
+        negations=frozenset(t for t in tokens if t in NEGATIONS),
+    )
+
+
+def similarity(a: Signature, b: Signature) -> float:
+    if a.numbers != b.numbers or a.negations != b.negations:
+        return 0.0
+    if not a.features or not b.features:
+        return 0.0
+    return len(a.features & b.features) / len(a.features | b.features)
+
+
+# (normalized question, signature, answer)
+Entry = Tuple[str, Signature, str]
+
+
+class AnswerCache:
+    def __init__(self, threshold: float = 0.85, max_docs: int = 200,
+                 max_per_doc: int = 300):
+        self.threshold = threshold
+        self.max_docs = max_docs
+        self.max_per_doc = max_per_doc
+
+        # (doc_hash, gender) → list of entries
+        self._docs: "OrderedDict[Tuple[str, str], list[Entry]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _doc_key(doc_hash: str, user_info: Dict[str, Any]) -> Tuple[str, str]:
+        return (doc_hash, (user_info.get("gender") or "female").lower())
+
+    def lookup(self, doc_hash: str, user_info: Dict[str, Any], question: str) -> Optional[str]:
+        if not doc_hash:
+            # no document identity → answers from other documents could leak in
+            metrics.incr("answer_cache.bypass")
+            return None
+        norm = normalize_question(question)
+        signature = question_signature(norm)
+
+        with self._lock:
+            entries = self._docs.get(self._doc_key(doc_hash, user_info), [])
+            best, best_score = None, 0.0
+            for cached_norm, cached_signature, answer in entries:
+                score = 1.0 if cached_norm == norm else similarity(signature, cached_signature)
+                if score > best_score:
+                    best, best_score = answer, score
+
+            if best is None or best_score < self.threshold:
+                self.misses += 1
+                metrics.incr("answer_cache.miss")
+                return None
+
+            self.hits += 1
+
+        metrics.incr("answer_cache.hit")
+        return fill_name(best, user_info)
+
+    def add(self, doc_hash: str, user_info: Dict[str, Any], question: str, answer: str):
+        norm = normalize_question(question)
+        if not doc_hash or not norm or not answer:
+            return
+
+        key = self._doc_key(doc_hash, user_info)
+        with self._lock:
+            entries = self._docs.setdefault(key, [])
+            self._docs.move_to_end(key)
+            entries.append((norm, question_signature(norm), strip_name(answer, user_info)))
+            del entries[:-self.max_per_doc]
+
+            while len(self._docs) > self.max_docs:
+                self._docs.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "docs": len(self._docs),
+                "entries": sum(len(v) for v in self._docs.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+ANSWER_CACHE = AnswerCache(
+    threshold=float(os.getenv("STUDYBUDDY_ANSWER_CACHE_THRESHOLD", "0.85")),
+)
@@ -1,11 +1,25 @@
+import uuid
 import streamlit as st
+from concurrent.futures import ThreadPoolExecutor
 from query_pdf import (
-    extract_text_from_pdf,
-    generate_quiz_data,
+    document_hash,
     generate_post_quiz_focus_advice,
     generate_daily_romantic_message,
-    generate_night_mode_message
+    generate_night_mode_message,
+    generate_feedback_batch,
+    lookup_batch_feedback,
+    build_degraded_feedback,
+    build_degraded_advice,
+    build_degraded_message,
+    with_local_fallback,
+    BATCH_FEEDBACK,
 )
+from feedback_cache import FEEDBACK_CACHE
+from message_pool import MESSAGE_POOL, pool_seed
+from quiz_pipeline import build_quiz, extract_document_text
+
+# Background worker for whole-quiz feedback generation
+_EXECUTOR = ThreadPoolExecutor(max_workers=4)
 
 # ==============================
 # SMART MATH-RENDERER
@@ -36,6 +50,9 @@ def init_state():
     if "page" not in st.session_state:
         st.session_state.page = "setup"
 
+    if "session_id" not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
+
     if "user_info" not in st.session_state:
         st.session_state.user_info = {
             "name": "",
@@ -63,6 +80,20 @@ def init_state():
     if "dynamic_feedback" not in st.session_state:
         st.session_state.dynamic_feedback = ""
 
+    if "doc_hash" not in st.session_state:
+        st.session_state.doc_hash = None
+
+    if "feedback_future" not in st.session_state:
+        st.session_state.feedback_future = None
+
+
+def get_feedback_bank():
+    """Returns the batch feedback bank if the background job has finished."""
+    future = st.session_state.feedback_future
+    if future is None or not future.done() or future.exception():
+        return None
+    return future.result()
+
 
 # ==============================
 # PAGE 1 — USER SETUP
@@ -110,11 +141,20 @@ def page_preprocess():
     st.header("📘 Generating Study Guide…")
     st.markdown("Buddy, I'm reading your file carefully… einen moment bitte!!❤️")
 
-    pdf_text = extract_text_from_pdf(st.session_state.uploaded_file)
+    pdf_bytes = st.session_state.uploaded_file.getvalue()
+    st.session_state.doc_hash = document_hash(pdf_bytes)
+    pdf_text = extract_document_text(st.session_state.doc_hash, pdf_bytes)
 
-    quiz_data = generate_quiz_data(pdf_text, st.session_state.user_info)
+    quiz_data = build_quiz(st.session_state.doc_hash, pdf_text, st.session_state.user_info)
     st.session_state.quiz_data = quiz_data
 
+    # Generate feedback for every question × choice in the background
+    if BATCH_FEEDBACK:
+        st.session_state.feedback_future = _EXECUTOR.submit(
+            generate_feedback_batch, quiz_data, dict(st.session_state.user_info)
+        )
+    MESSAGE_POOL.prewarm(st.session_state.user_info, pool_seed(quiz_data))
+
     st.success("✨ Personalized Study Guide Ready!")
 
     st.markdown("## 💖 Soft Summary")
@@ -160,7 +200,8 @@ def page_quiz():
 
     st.header(f"📖 Question {q_index + 1} / {total_q}")
 
-    render_text(f"### 💬 {question['introduction']}")
+    if question.get("introduction"):
+        render_text(f"### 💬 {question['introduction']}")
     render_text(question["question_text"])
 
     options = question["options"]
@@ -187,13 +228,28 @@ def page_quiz():
                 "selected_text": options[selected_key],
                 "correct_key": correct_key,
                 "correct_text": options[correct_key],
-                "base_correct": question["correct_feedback_script"],
-                "base_incorrect": question["incorrect_feedback_script"],
-                "base_pass": question["pass_feedback_script"],
+                "base_correct": question.get("correct_feedback_script", ""),
+                "base_incorrect": question.get("incorrect_feedback_script", ""),
+                "base_pass": question.get("pass_feedback_script", ""),
             }
 
-            # Get dynamically generated romantic/sarcastic feedback
-            feedback = generate_dynamic_feedback(payload)
+            # Pre-generated batch feedback, then shared cache, else dynamically generated
+            user = st.session_state.user_info
+            cache_key = FEEDBACK_CACHE.make_key(st.session_state.doc_hash, question, selected_key, user)
+
+            feedback = lookup_batch_feedback(get_feedback_bank(), q_index, question, selected_key)
+            if feedback is None:
+                feedback = FEEDBACK_CACHE.get(cache_key, user)
+            if feedback is None:
+                def generate():
+                    text = generate_dynamic_feedback(payload)
+                    FEEDBACK_CACHE.put(cache_key, text, user)
+                    return text
+
+                feedback = with_local_fallback(
+                    "feedback", generate,
+                    lambda: build_degraded_feedback(question, selected_key, user),
+                )
             st.session_state.dynamic_feedback = feedback
 
 
@@ -224,6 +280,8 @@ def page_results():
     total = len(st.session_state.quiz_data["questions"])
     score = st.session_state.score
     percent = (score / total) * 100
+    # Streamlit has no scheduler: the quiz is over, so fill the pools the menu below uses
+    MESSAGE_POOL.warm()
 
     st.header("🎉 Quiz Completed!")
 
@@ -244,20 +302,35 @@ def page_results():
     st.markdown("---")
     st.subheader("📚 What You Should Study More")
 
-    advice = generate_post_quiz_focus_advice(
-        user,
-        st.session_state.wrong_focus
+    advice = with_local_fallback(
+        "advice",
+        lambda: generate_post_quiz_focus_advice(user, st.session_state.wrong_focus),
+        lambda: build_degraded_advice(user, st.session_state.wrong_focus),
     )
     render_text(advice)
 
     st.markdown("---")
 
     if st.button("💌 Today's Message"):
-        msg = generate_daily_romantic_message(user, st.session_state.quiz_data)
+        msg = (
+            MESSAGE_POOL.get("daily", user, pool_seed(st.session_state.quiz_data), st.session_state.session_id)
+            or with_local_fallback(
+                "daily",
+                lambda: generate_daily_romantic_message(user, st.session_state.quiz_data),
+                lambda: build_degraded_message("daily", user),
+            )
+        )
         render_text(msg)
 
     if st.button("🌙 Night Whisper"):
-        msg = generate_night_mode_message(user, st.session_state.quiz_data)
+        msg = (
+            MESSAGE_POOL.get("night", user, pool_seed(st.session_state.quiz_data), st.session_state.session_id)
+            or with_local_fallback(
+                "night",
+                lambda: generate_night_mode_message(user, st.session_state.quiz_data),
+                lambda: build_degraded_message("night", user),
+            )
+        )
         render_text(msg)
 
     if st.button("Start New Quiz ❤️"):
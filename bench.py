@@ -0,0 +1,428 @@
+"""
+Small benchmarks for Study Buddy AI.
+
+Usage:
+    python bench.py lean-quiz                 # offline estimate
+    python bench.py lean-quiz --pdf notes.pdf # live run against Gemini
+    python bench.py import-time               # cold-start budget (exit 1 on regression)
+    python bench.py prompt-size               # prompt tokens vs baseline (exit 1 on regression)
+    python bench.py prompt-size --latency     # + verbose vs compact latency on the fake backend
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import importlib.util
+
+import llm_backend as llm
+import query_pdf
+from query_pdf import (
+    build_quiz_prompt,
+    estimate_tokens,
+    extract_text_from_pdf,
+    get_client,
+)
+
+
+# ==============================
+#  REPRESENTATIVE INPUTS
+# ==============================
+SAMPLE_USER = {
+    "name": "Ayesha",
+    "gender": "female",
+    "country": "Bangladesh",
+    "mood_before": "a bit stressed",
+}
+
+SAMPLE_PDF_TEXT = (
+    "Photosynthesis converts light energy into chemical energy. "
+    "The light-dependent reactions take place in the thylakoid membranes, "
+    "while the Calvin cycle runs in the stroma and fixes carbon dioxide. "
+) * 60
+
+_SAMPLE_INTRO = (
+    "Baby, come sit closer… I know you're tired but this one is easy for my genius, "
+    "I'll be right here holding your hand while you think 💕"
+)
+_SAMPLE_SCRIPT = (
+    "Your answer: B. Correct answer: C. Aww my love, don't be sad, you were so close and "
+    "I'm still so proud of you. The Calvin cycle happens in the stroma, not the thylakoid "
+    "membrane, because that's where RuBisCO fixes carbon dioxide into sugars. Come here, "
+    "let me hug you, we'll remember it together this time, shona (golden one) 🥺💗"
+)
+
+
+def _sample_question(i: int, lean: bool) -> dict:
+    q = {
+        "introduction": _SAMPLE_INTRO,
+        "question_text": "Where in the chloroplast does the Calvin cycle take place?",
+        "options": {
+            "A": "Thylakoid membrane",
+            "B": "Outer membrane",
+            "C": "Stroma",
+            "D": "Intermembrane space",
+            "E": "Pass",
+        },
+        "correct_answer_key": "C",
+        "focus_if_wrong": "Review the location of light-independent reactions and why the stroma hosts them.",
+        "romance_level": i,
+    }
+    if not lean:
+        q["correct_feedback_script"] = _SAMPLE_SCRIPT
+        q["incorrect_feedback_script"] = _SAMPLE_SCRIPT
+        q["pass_feedback_script"] = _SAMPLE_SCRIPT
+    return q
+
+
+def _sample_output(lean: bool) -> str:
+    return json.dumps({
+        "sweet_summary": _SAMPLE_SCRIPT * 4,
+        "study_guide": {
+            "overall_advice": _SAMPLE_SCRIPT * 2,
+            "exam_strategy": _SAMPLE_SCRIPT * 2,
+            "key_topics": ["Light reactions", "Calvin cycle", "Chloroplast structure"],
+            "topic_notes": [
+                {"topic": "Calvin cycle", "nuance_note": _SAMPLE_SCRIPT,
+                 "why_important": "It is where carbon is fixed."}
+            ] * 4,
+        },
+        "questions": [_sample_question(i, lean) for i in range(1, 18)],
+        "daily_romantic_message_seed": _SAMPLE_INTRO,
+        "night_mode_message_seed": _SAMPLE_INTRO,
+    }, ensure_ascii=False)
+
+
+# ==============================
+#  LEAN QUIZ BENCHMARK
+# ==============================
+def bench_lean_quiz(pdf_path=None, decode_rate: float = 150.0):
+    """
+    Compares lean vs verbose quiz generation:
+    - offline: estimated output tokens and time-to-quiz at `decode_rate` tok/s
+    - live (--pdf): real Gemini output tokens and wall time
+    """
+    rows = []
+
+    if pdf_path:
+        with open(pdf_path, "rb") as f:
+            pdf_text = extract_text_from_pdf(f)
+        client = get_client()
+
+        for lean in (False, True):
+            prompt = build_quiz_prompt(pdf_text, SAMPLE_USER, lean=lean)
+            start = time.perf_counter()
+            response = client.models.generate_content(model=llm.gemini_model("quiz"), contents=prompt)
+            elapsed = time.perf_counter() - start
+            usage = getattr(response, "usage_metadata", None)
+            out_tokens = getattr(usage, "candidates_token_count", None) or estimate_tokens(response.text)
+            rows.append(("lean" if lean else "verbose", estimate_tokens(prompt), out_tokens, elapsed))
+    else:
+        for lean in (False, True):
+            prompt = build_quiz_prompt(SAMPLE_PDF_TEXT, SAMPLE_USER, lean=lean)
+            out_tokens = estimate_tokens(_sample_output(lean))
+            rows.append(("lean" if lean else "verbose", estimate_tokens(prompt), out_tokens,
+                         out_tokens / decode_rate))
+
+    print(f"{'mode':<8} {'in_tok':>8} {'out_tok':>8} {'time_to_quiz_s':>15}")
+    for mode, in_tok, out_tok, secs in rows:
+        print(f"{mode:<8} {in_tok:>8} {out_tok:>8} {secs:>15.2f}")
+
+    (_, _, verbose_out, verbose_t), (_, _, lean_out, lean_t) = rows
+    print(f"\nOutput tokens saved: {verbose_out - lean_out} "
+          f"({100 * (verbose_out - lean_out) / verbose_out:.1f}%)")
+    print(f"Time-to-quiz saved:  {verbose_t - lean_t:.2f}s "
+          f"({100 * (verbose_t - lean_t) / verbose_t:.1f}%)")
+    return rows
+
+
+# ==============================
+#  COLD START (IMPORT TIME)
+# ==============================
+
+# Cumulative cold-import budget per entry module, in seconds
+IMPORT_BUDGETS = {"bot": 1.5, "app": 4.0}
+
+# Entry modules that can only be measured when their framework is installed
+ENTRY_REQUIREMENTS = {"app": "streamlit"}
+
+# Heavy modules that must only load on first use, never at startup
+LAZY_MODULES = ("google.genai", "PyPDF2", "pypdf", "huggingface_hub", "pdf2image", "PIL")
+
+
+def measure_import_time(module: str):
+    """
+    Runs `python -X importtime -c "import <module>"` in a fresh interpreter.
+    Returns (rows, error) where rows are (depth, self_s, cumulative_s, name).
+    """
+    env = dict(os.environ)
+    env.setdefault("TELEGRAM_TOKEN", "bench-dummy-token")
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, env=env,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cum_us, name = line[len("import time:"):].split("|")
+        rows.append((
+            (len(name) - len(name.lstrip()) - 1) // 2,
+            int(self_us) / 1e6,
+            int(cum_us) / 1e6,
+            name.strip(),
+        ))
+
+    error = None
+    if proc.returncode != 0:
+        error = proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "import failed"
+    return rows, error
+
+
+def entry_children(rows, module: str):
+    """
+    The modules `module` imports directly (depth-1 rows). importtime prints
+    children before their parent, so they are the depth-1 rows since the
+    previous depth-0 line.
+    """
+    children = []
+    for row in rows:
+        if row[0] == 0:
+            if row[3] == module:
+                return children
+            children = []
+        elif row[0] == 1:
+            children.append(row)
+    return []
+
+
+def bench_import_time(module: str, budget: float, top: int = 15) -> bool:
+    """
+    Prints a per-module import breakdown; returns False on a regression:
+    over budget, a LAZY_MODULES import at startup, or an import error.
+    """
+    requirement = ENTRY_REQUIREMENTS.get(module)
+    if requirement and importlib.util.find_spec(requirement) is None:
+        print(f"⏭️  Skipping '{module}': {requirement} is not installed (pip install {requirement})")
+        return True
+
+    rows, error = measure_import_time(module)
+    if error:
+        print(f"❌ import {module} failed: {error}")
+        return False
+
+    total = next((cum for depth, _, cum, name in rows if depth == 0 and name == module), 0.0)
+
+    print(f"Cold import of '{module}': {total:.3f}s (budget {budget:.3f}s)\n")
+    print(f"Imported directly by '{module}':")
+    print(f"{'cumulative_s':>12} {'self_s':>8}  module")
+    children = sorted(entry_children(rows, module), key=lambda r: r[2], reverse=True)
+    for _, self_s, cum, name in children[:top]:
+        print(f"{cum:>12.3f} {self_s:>8.3f}  {name}")
+
+    print("\nSlowest modules by self time:")
+    print(f"{'self_s':>12} {'depth':>8}  module")
+    for depth, self_s, _, name in sorted(rows, key=lambda r: r[1], reverse=True)[:top]:
+        print(f"{self_s:>12.3f} {depth:>8}  {name}")
+
+    eager = sorted({
+        name for _, _, _, name in rows
+        if any(name == m or name.startswith(m + ".") for m in LAZY_MODULES)
+    })
+
+    ok = True
+    if eager:
+        print(f"\n❌ Imported at startup but should be lazy: {', '.join(eager)}")
+        ok = False
+    if total > budget:
+        print(f"\n❌ Cold start regressed: {total:.3f}s > {budget:.3f}s")
+        ok = False
+    if ok:
+        print("\n✅ Within cold-start budget")
+    return ok
+
+
+# ==============================
+#  PROMPT SIZE
+# ==============================
+
+PROMPT_BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompt_baseline.json")
+PROMPT_TOLERANCE = 0.05  # allowed growth over baseline before failing
+
+SAMPLE_CHAT_HISTORY = (
+    "Summary so far: the student asked where the Calvin cycle happens.\n"
+    "Student: and what does RuBisCO do?\nTutor: It fixes CO2 onto RuBP."
+)
+
+
+def _sample_quiz(lean: bool = True) -> dict:
+    return json.loads(_sample_output(lean))
+
+
+def _sample_payload(selected_key: str = "B") -> dict:
+    q = _sample_question(5, lean=True)
+    return {
+        "user_info": SAMPLE_USER,
+        "selected_key": selected_key,
+        "selected_text": q["options"][selected_key],
+        "correct_key": q["correct_answer_key"],
+        "correct_text": q["options"][q["correct_answer_key"]],
+        # pinned: left empty, the prompt would get a random get_tone_reference() line
+        **{f"base_{kind}": lines[0] for kind, lines in query_pdf.TONE_PHRASE_BANK[SAMPLE_USER["gender"]].items()},
+    }
+
+
+def _sample_neutral() -> dict:
+    quiz = _sample_quiz()
+    return {"summary": quiz["sweet_summary"], "study_guide": quiz["study_guide"],
+            "questions": quiz["questions"]}
+
+
+# name → (llm task, prompt builder with representative inputs)
+PROMPT_CASES = {
+    "quiz": ("quiz", lambda: build_quiz_prompt(SAMPLE_PDF_TEXT, SAMPLE_USER)),
+    "quiz_neutral": ("quiz_neutral", lambda: query_pdf.build_neutral_content_prompt(SAMPLE_PDF_TEXT)),
+    "quiz_guide": ("quiz_guide", lambda: query_pdf.build_neutral_guide_prompt(SAMPLE_PDF_TEXT)),
+    "quiz_questions": ("quiz_questions", lambda: query_pdf.build_neutral_questions_prompt(
+        SAMPLE_PDF_TEXT, *query_pdf.QUESTION_TIERS[2])),
+    "quiz_style": ("quiz_style", lambda: query_pdf.build_persona_style_prompt(_sample_neutral(), SAMPLE_USER)),
+    "feedback": ("feedback", lambda: query_pdf.build_feedback_prompt(_sample_payload())),
+    "feedback_batch": ("feedback_batch", lambda: query_pdf.build_feedback_batch_prompt(
+        _sample_quiz(), SAMPLE_USER)),
+    "advice": ("advice", lambda: query_pdf.build_advice_prompt(
+        SAMPLE_USER, ["Calvin cycle location", "Light reactions"])),
+    "daily": ("daily", lambda: query_pdf.build_daily_message_prompt(SAMPLE_USER, _sample_quiz())),
+    "night": ("night", lambda: query_pdf.build_night_message_prompt(SAMPLE_USER, _sample_quiz())),
+    "gods": ("gods", lambda: query_pdf.build_gods_message_prompt(SAMPLE_USER)),
+    "chat": ("chat", lambda: query_pdf.build_chat_prompt(
+        "Why does the Calvin cycle need ATP?", SAMPLE_PDF_TEXT, SAMPLE_USER, SAMPLE_CHAT_HISTORY)),
+    "message_batch": ("message_batch", lambda: query_pdf.build_message_batch_prompt(
+        "daily", SAMPLE_USER, _sample_quiz(), 8)),
+}
+
+
+def render_prompt_tokens(variant: str) -> dict:
+    """Estimated input tokens of every prompt builder for one variant."""
+    with query_pdf.use_prompt_variant(variant):
+        return {name: estimate_tokens(build()) for name, (_, build) in PROMPT_CASES.items()}
+
+
+def bench_prompt_size(update_baseline: bool = False,
+                      tolerance: float = PROMPT_TOLERANCE) -> bool:
+    """
+    Prints prompt tokens per builder and variant; returns False when any
+    prompt grew more than `tolerance` over prompt_baseline.json.
+    """
+    current = {v: render_prompt_tokens(v) for v in query_pdf.PROMPT_VARIANTS}
+
+    try:
+        with open(PROMPT_BASELINE_FILE, encoding="utf-8") as f:
+            baseline = json.load(f)
+    except (OSError, ValueError):
+        baseline = {}
+
+    print(f"{'prompt':<16} {'verbose':>8} {'compact':>8} {'saved':>7}  baseline(v/c)")
+    regressions = []
+    for name in PROMPT_CASES:
+        verbose, compact = current["verbose"][name], current["compact"][name]
+        base = [baseline.get(v, {}).get(name) for v in ("verbose", "compact")]
+        print(f"{name:<16} {verbose:>8} {compact:>8} {100 * (verbose - compact) / verbose:>6.1f}%  "
+              f"{base[0] or '-'}/{base[1] or '-'}")
+        for variant, old in zip(("verbose", "compact"), base):
+            if old and current[variant][name] > old * (1 + tolerance):
+                regressions.append(f"{name} ({variant}): {old} → {current[variant][name]} tokens")
+
+    totals = {v: sum(t.values()) for v, t in current.items()}
+    print(f"{'TOTAL':<16} {totals['verbose']:>8} {totals['compact']:>8} "
+          f"{100 * (totals['verbose'] - totals['compact']) / totals['verbose']:>6.1f}%")
+
+    if update_baseline:
+        with open(PROMPT_BASELINE_FILE, "w", encoding="utf-8") as f:
+            json.dump(current, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"\n📝 Baseline written to {os.path.basename(PROMPT_BASELINE_FILE)}")
+        return True
+
+    if regressions:
+        print("\n❌ Prompt size regressed (> {:.0%}):\n  ".format(tolerance) + "\n  ".join(regressions))
+        return False
+    print("\n✅ No prompt size regressions")
+    return True
+
+
+def bench_prompt_latency(runs: int = 3, prefill_rate: float = 3000.0, decode_rate: float = 150.0):
+    """
+    Mean latency per task, verbose vs compact, on the fake backend with a
+    realistic prefill speed (input tokens/s), so prompt size shows up.
+    """
+    fake = llm.FakeBackend(base_latency=0.05, prefill_rate=prefill_rate, decode_rate=decode_rate)
+    original = llm.BACKENDS["fake"]
+    llm.BACKENDS["fake"] = fake
+    try:
+        print(f"\n{'task':<16} {'verbose_s':>10} {'compact_s':>10} {'saved':>7}")
+        for name, (task, build) in PROMPT_CASES.items():
+            means = []
+            for variant in query_pdf.PROMPT_VARIANTS:
+                with query_pdf.use_prompt_variant(variant):
+                    prompt = build()
+                start = time.perf_counter()
+                for _ in range(runs):
+                    fake.generate(prompt, "fake", task)
+                means.append((time.perf_counter() - start) / runs)
+            verbose_s, compact_s = means
+            print(f"{name:<16} {verbose_s:>10.3f} {compact_s:>10.3f} "
+                  f"{100 * (verbose_s - compact_s) / verbose_s:>6.1f}%")
+    finally:
+        llm.BACKENDS["fake"] = original
+
+
+# ==============================
+#  CLI
+# ==============================
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Study Buddy AI benchmarks")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    lean = sub.add_parser("lean-quiz", help="lean vs verbose quiz generation")
+    lean.add_argument("--pdf", help="run live against Gemini with this PDF")
+    lean.add_argument("--decode-rate", type=float, default=150.0,
+                      help="offline decode speed in tokens/s")
+
+    imp = sub.add_parser("import-time", help="cold-start import budget")
+    imp.add_argument("--module", action="append", choices=sorted(IMPORT_BUDGETS),
+                     help="entry module(s) to check (default: all)")
+    imp.add_argument("--budget", type=float, help="override the budget in seconds")
+
+    size = sub.add_parser("prompt-size", help="prompt token budget per builder")
+    size.add_argument("--update-baseline", action="store_true",
+                      help="write the current sizes to prompt_baseline.json")
+    size.add_argument("--tolerance", type=float, default=PROMPT_TOLERANCE,
+                      help="allowed growth over baseline (0.05 = 5%%)")
+    size.add_argument("--latency", action="store_true",
+                      help="also compare verbose vs compact latency on the fake backend")
+    size.add_argument("--prefill-rate", type=float, default=3000.0,
+                      help="fake backend input tokens/s")
+
+    args = parser.parse_args(argv)
+
+    if args.cmd == "lean-quiz":
+        bench_lean_quiz(args.pdf, args.decode_rate)
+    elif args.cmd == "import-time":
+        results = [
+            bench_import_time(m, args.budget or IMPORT_BUDGETS[m])
+            for m in (args.module or sorted(IMPORT_BUDGETS))
+        ]
+        return 0 if all(results) else 1
+    elif args.cmd == "prompt-size":
+        ok = bench_prompt_size(args.update_baseline, args.tolerance)
+        if args.latency:
+            bench_prompt_latency(prefill_rate=args.prefill_rate)
+        return 0 if ok else 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,9 @@
 import os
-from io import BytesIO
-from typing import Dict, Any
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional
 
 from dotenv import load_dotenv
 from telegram import (
@@ -19,14 +22,47 @@ from telegram.ext import (
 
 # ---- Import Gemini PDF functions ----
 from query_pdf import (
-    extract_text_from_pdf,
-    generate_quiz_data,
+    document_hash,
     generate_dynamic_feedback,
     generate_post_quiz_focus_advice,
     generate_daily_romantic_message,
     generate_night_mode_message,
     generate_gods_message,
+    generate_feedback_batch,
+    lookup_batch_feedback,
+    build_local_result_text,
+    build_degraded_feedback,
+    build_degraded_advice,
+    build_degraded_message,
+    with_local_fallback,
+    run_chat_from_pdf,
+    stream_chat_from_pdf,
+    summarize_chat_history,
+    BATCH_FEEDBACK,
+    STREAM_CHAT,
 )
+from feedback_cache import FEEDBACK_CACHE
+from answer_cache import ANSWER_CACHE
+import chat_memory
+from message_pool import MESSAGE_POOL, pool_seed
+from quiz_pipeline import (
+    build_quiz,
+    extract_document_text,
+    get_neutral_content,
+    report_progress,
+    style_quiz,
+    NEUTRAL_CACHE,
+    TWO_STAGE,
+    EXTRACT_FLIGHT,
+    NEUTRAL_FLIGHT,
+    QUIZ_FLIGHT,
+)
+from question_bank import get_question_bank
+from quiz_jobs import QUIZ_JOBS, QueueFull
+import daily_delivery
+from send_queue import OUTBOX
+import metrics
+import llm_backend
 
 # ============================================================
 # ENVIRONMENT + GLOBAL STATE
@@ -37,12 +73,41 @@ TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 if not TELEGRAM_TOKEN:
     raise RuntimeError("❌ TELEGRAM_TOKEN missing in .env file!")
 
+# Min seconds between edits of a streaming message (Telegram allows ~1 edit/sec per chat)
+STREAM_EDIT_INTERVAL = float(os.getenv("STUDYBUDDY_STREAM_EDIT_INTERVAL", "1.5"))
+
+# Message pools: seconds between idle warm-ups, and pools started per warm-up
+POOL_WARM_INTERVAL = float(os.getenv("STUDYBUDDY_POOL_WARM_INTERVAL", "30"))
+POOL_WARM_BATCH = int(os.getenv("STUDYBUDDY_POOL_WARM_BATCH", "3"))
+
+# Chats allowed to use /stats (comma-separated chat ids); nobody when unset
+ADMIN_CHAT_IDS = {
+    int(x) for x in os.getenv("STUDYBUDDY_ADMIN_CHAT_IDS", "").split(",") if x.strip()
+}
+
 
 USER_STATE: Dict[int, Dict[str, Any]] = {}
 
+# Updates run concurrently across chats; within a chat, state-changing
+# handlers take the chat's lock so they never interleave.
+CHAT_LOCKS: Dict[int, asyncio.Lock] = {}
+
+# Buttons that may act once per message; a repeat tap is a duplicate.
+IDEMPOTENT_CALLBACKS = {"ans", "next_q", "play_again", "start_quiz"}
+# Buttons that reset the session must not queue behind a slow operation
+UNLOCKED_CALLBACKS = {"restart", "restart_start"}
+MAX_CALLBACK_KEYS = 64  # remembered per chat
+
+# chat_id → idempotency key → done? (False while in flight)
+CALLBACK_KEYS: Dict[int, "OrderedDict[str, bool]"] = {}
+
 
 def _init_state(chat_id: int):
-    """Reset state for a user."""
+    """Reset state for a user. Work still running for the old session is cancelled."""
+    old = USER_STATE.get(chat_id)
+    if old is not None:
+        cancel_inflight(old, "reset")
+
     state = {
         "step": "ask_name",
         "user_info": {
@@ -53,13 +118,22 @@ def _init_state(chat_id: int):
             "mood_after": "",
         },
         "pdf_text": None,
+        "pdf_task": None,
+        "pdf_cancel": None,
+        "pdf_status": None,
+        "doc_hash": None,
         "quiz_data": None,
+        "feedback_bank": None,
+        "feedback_task": None,
         "current_question": 0,
         "score": 0,
         "wrong_focus": [],
         "awaiting_next": False,
         "dynamic_feedback": "",
         "chat_mode": False,
+        "chat_memory": chat_memory.new_memory(),
+        "inflight": set(),
+        "epoch": 0,
     }
     USER_STATE[chat_id] = state
     return state
@@ -70,6 +144,100 @@ def get_state(update: Update):
     return USER_STATE.get(chat_id) or _init_state(chat_id)
 
 
+def chat_lock(chat_id: int) -> asyncio.Lock:
+    return CHAT_LOCKS.setdefault(chat_id, asyncio.Lock())
+
+
+def callback_key(query) -> Optional[str]:
+    """Idempotency key of a button tap: one answer / next / replay per message."""
+    op = "ans" if query.data.startswith("ans_") else query.data
+    if op not in IDEMPOTENT_CALLBACKS:
+        return None
+    return f"{query.message.message_id}:{op}"
+
+
+# ============================================================
+# IN-FLIGHT WORK
+# ============================================================
+class SessionReset(Exception):
+    """The chat was reset, or got a new PDF, while this work was running."""
+
+
+def cancel_inflight(state, reason: str) -> int:
+    """
+    Cancels the chat's background and awaited work so its results are thrown
+    away. Worker threads can't be interrupted, but nothing they return is
+    written to the session or sent, and PDF preparation stops before the quiz
+    stage. Returns the number of tasks cancelled.
+    """
+    state["epoch"] += 1
+    if state.get("pdf_cancel") is not None:
+        state["pdf_cancel"].set()
+
+    cancelled = 0
+    for task in (state.get("pdf_task"), state.get("feedback_task"), *state["inflight"]):
+        if task is not None and not task.done():
+            task.cancel()
+            cancelled += 1
+            metrics.incr(f"inflight.cancelled.{task.get_name()}")
+    state["inflight"].clear()
+    if cancelled:
+        print(f"🧹 Cancelled {cancelled} stale task(s) ({reason})")
+    return cancelled
+
+
+async def await_tracked(state, task: asyncio.Task):
+    """Awaits a chat task; SessionReset if cancel_inflight() cancelled it."""
+    epoch = state["epoch"]
+    try:
+        return await task
+    except asyncio.CancelledError:
+        if state["epoch"] != epoch:
+            raise SessionReset() from None
+        raise
+
+
+def ensure_current(state, epoch: int):
+    """
+    SessionReset if cancel_inflight() ran since `epoch` was read. Called
+    before every send that follows an await, so a reset or new PDF never
+    gets an old session's message.
+    """
+    if state["epoch"] != epoch:
+        metrics.incr("inflight.stale_send")
+        raise SessionReset()
+
+
+async def _await_in_session(state, task: asyncio.Task):
+    state["inflight"].add(task)
+    try:
+        return await await_tracked(state, task)
+    finally:
+        state["inflight"].discard(task)
+
+
+async def track(state, kind: str, coro):
+    """Runs a coroutine as a chat task, cancelled together with the chat's other work."""
+    return await _await_in_session(state, asyncio.create_task(coro, name=kind))
+
+
+async def run_quiz_job(state, kind: str, fn, *args, status=None, **kwargs):
+    """
+    Quiz generation as a QUIZ_JOBS job: admission control, queue position
+    and progress on `status`, cancelled with the chat's other work.
+    Raises QueueFull when the bot is overloaded.
+    """
+    job = QUIZ_JOBS.submit(
+        fn, *args, on_progress=status.on_progress if status else None, **kwargs
+    )
+    return await _await_in_session(state, QUIZ_JOBS.as_task(job, name=kind))
+
+
+async def run_tracked(state, kind: str, fn, *args, **kwargs):
+    """asyncio.to_thread(fn, ...), cancelled together with the chat's other work."""
+    return await track(state, kind, asyncio.to_thread(fn, *args, **kwargs))
+
+
 # ============================================================
 # UI ELEMENTS
 # ============================================================
@@ -117,17 +285,177 @@ def build_results_keyboard() -> InlineKeyboardMarkup:
 # ============================================================
 # UTILITY
 # ============================================================
-async def send_long_message(context, chat_id, text, limit=3500):
-    while text:
-        chunk = text[:limit]
-        await context.bot.send_message(chat_id=chat_id, text=chunk)
-        text = text[limit:]
+async def send_long_message(context, chat_id, text):
+    # The outbox splits long texts and rate-limits per chat / globally
+    await OUTBOX.send(context.bot, chat_id, text)
+
+
+async def iterate_in_thread(gen_fn, *args):
+    """
+    Run a blocking generator in a worker thread and yield its items here.
+    If the consumer stops early (e.g. its task is cancelled), the worker
+    closes the generator at its next item instead of running it to the end.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    done = object()
+    stop = threading.Event()
+
+    def worker():
+        items = gen_fn(*args)
+        try:
+            for item in items:
+                if stop.is_set():
+                    break
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+        finally:
+            close = getattr(items, "close", None)
+            if close is not None:
+                close()
+            loop.call_soon_threadsafe(queue.put_nowait, done)
+
+    loop.run_in_executor(None, worker)
+
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+async def stream_reply(context, chat_id, chunks, limit=3500) -> str:
+    """
+    Posts a placeholder and edits it with the accumulated text at most
+    every STREAM_EDIT_INTERVAL seconds. Records time-to-first-token.
+    """
+    placeholder = await OUTBOX.send(context.bot, chat_id, "💭 …", coalesce=False)
+    start = time.perf_counter()
+    last_edit = start
+    first_token = None
+    text = ""
+    failed = False
+
+    try:
+        async for chunk in chunks:
+            if first_token is None:
+                first_token = time.perf_counter() - start
+                metrics.observe("chat.ttft", first_token)
+            text += chunk
+
+            now = time.perf_counter()
+            if now - last_edit >= STREAM_EDIT_INTERVAL and len(text) < limit:
+                last_edit = now
+                try:
+                    await OUTBOX.edit(placeholder, text + " ▌")
+                except Exception as e:
+                    print("⚠️ Stream edit skipped:", e)
+    except Exception as e:
+        print("❌ Chat stream failed:", e)
+        text += "\n\n😢 I lost my train of thought… ask me again?"
+        failed = True
+
+    total = time.perf_counter() - start
+    metrics.observe("chat.total", total)
+    print(f"💬 chat stream: ttft={first_token or total:.2f}s total={total:.2f}s")
+
+    await edit_long_message(context, placeholder, text or "🤐", limit)
+    return "" if failed else text
+
+
+async def edit_long_message(context, message, text, limit=3500, reply_markup=None):
+    """Edit a sent message in place; overflow goes out as new messages."""
+    try:
+        await OUTBOX.edit(message, text[:limit], reply_markup=reply_markup)
+    except Exception as e:
+        print("⚠️ Edit failed, sending instead:", e)
+        await send_long_message(context, message.chat_id, text[:limit])
+    if len(text) > limit:
+        await send_long_message(context, message.chat_id, text[limit:])
+
+
+# ============================================================
+# BATCH FEEDBACK PREFETCH
+# ============================================================
+async def _prefetch_feedback_bank(state, quiz_data):
+    """Generate feedback for the whole quiz in one background request."""
+    try:
+        bank = await asyncio.to_thread(generate_feedback_batch, quiz_data, state["user_info"])
+    except Exception as e:
+        print("⚠️ Batch feedback failed, falling back to per-question:", e)
+        return
+
+    # Only attach if the user is still on the same quiz
+    if state["quiz_data"] is quiz_data:
+        state["feedback_bank"] = bank
+
+
+def start_feedback_prefetch(state):
+    state["feedback_bank"] = None
+    if BATCH_FEEDBACK and state["quiz_data"]:
+        state["feedback_task"] = asyncio.create_task(
+            _prefetch_feedback_bank(state, state["quiz_data"]), name="feedback_batch"
+        )
+
+
+# ============================================================
+# POOLED MESSAGES
+# ============================================================
+async def pooled_message(kind, state, chat_id, generate):
+    """
+    Daily / night / God's message: pool first, then the LLM, then a local
+    fallback message when the LLM is degraded or fails.
+    """
+    msg = MESSAGE_POOL.get(kind, state["user_info"], pool_seed(state["quiz_data"]), chat_id)
+    if msg:
+        return msg
+    return await asyncio.to_thread(
+        with_local_fallback, kind, generate,
+        lambda: build_degraded_message(kind, state["user_info"]),
+    )
+
+
+async def warm_message_pools(context):
+    """JobQueue job: fill the pools new quizzes asked for, only while no quiz work is waiting."""
+    if QUIZ_JOBS.stats()["queued"] or llm_backend.pool_saturated():
+        return
+    MESSAGE_POOL.warm(POOL_WARM_BATCH)
+
+
+# ============================================================
+# CHAT MEMORY (ROLLING SUMMARY)
+# ============================================================
+async def _fold_chat_memory(memory):
+    """Fold pending turns into the summary, off the reply path."""
+    try:
+        while memory["pending"]:
+            batch = list(memory["pending"])
+            with metrics.timer("chat.summarize"):
+                summary = await asyncio.to_thread(summarize_chat_history, memory["summary"], batch)
+            memory["summary"] = chat_memory.trim_summary(summary)
+            memory["pending"] = [t for t in memory["pending"] if all(t is not b for b in batch)]
+    except Exception as e:
+        print("⚠️ Chat summary failed:", e)
+
+
+def remember_chat_turn(state, question, answer):
+    memory = state["chat_memory"]
+    folding = memory["fold_task"]
+    if chat_memory.add_turn(memory, question, answer) and (folding is None or folding.done()):
+        memory["fold_task"] = asyncio.create_task(_fold_chat_memory(memory), name="chat_fold")
 
 
 # ============================================================
 # QUIZ ENGINE
 # ============================================================
 async def send_question(context, chat_id, state):
+    epoch = state["epoch"]
     quiz = state["quiz_data"]
     i = state["current_question"]
 
@@ -137,21 +465,23 @@ async def send_question(context, chat_id, state):
 
     q = quiz["questions"][i]
 
+    intro = f"💬 {q['introduction']}\n\n" if q.get("introduction") else ""
     msg = (
         f"📖 Question {i + 1}/{len(quiz['questions'])}\n\n"
-        f"💬 {q['introduction']}\n\n"
+        f"{intro}"
         f"{q['question_text']}\n\n"
         + "\n".join([f"{k}) {v}" for k, v in q["options"].items()])
     )
 
     await send_long_message(context, chat_id, msg)
+    ensure_current(state, epoch)
 
     state["step"] = "in_quiz"
     state["awaiting_next"] = False
 
-    await context.bot.send_message(
-        chat_id=chat_id,
-        text="Choose your answer:",
+    await OUTBOX.send(
+        context.bot, chat_id,
+        "Choose your answer:",
         reply_markup=build_answer_keyboard()
     )
 
@@ -160,41 +490,68 @@ async def handle_answer(context, chat_id, state, selected_key):
     if state["awaiting_next"]:
         return
 
-    q = state["quiz_data"]["questions"][state["current_question"]]
+    epoch = state["epoch"]
+    i = state["current_question"]
+    q = state["quiz_data"]["questions"][i]
     correct_key = q["correct_answer_key"]
 
+    # ---- Phase 1: grade locally and answer instantly ----
+    state["awaiting_next"] = True
+
+    if selected_key == correct_key:
+        state["score"] += 1
+    else:
+        if selected_key != "E":
+            state["wrong_focus"].append(q["focus_if_wrong"])
+
+    result_text = build_local_result_text(q, selected_key, state["user_info"])
+    result_msg = await OUTBOX.send(context.bot, chat_id, result_text + "\n\n💭 …", coalesce=False)
+
+    # ---- Phase 2: LLM explanation, edited into the same message ----
     payload = {
         "user_info": state["user_info"],
         "selected_key": selected_key,
         "selected_text": q["options"][selected_key],
         "correct_key": correct_key,
         "correct_text": q["options"][correct_key],
-        "base_correct": q["correct_feedback_script"],
-        "base_incorrect": q["incorrect_feedback_script"],
-        "base_pass": q["pass_feedback_script"],
+        "base_correct": q.get("correct_feedback_script", ""),
+        "base_incorrect": q.get("incorrect_feedback_script", ""),
+        "base_pass": q.get("pass_feedback_script", ""),
     }
 
-    feedback = generate_dynamic_feedback(payload)
-    state["dynamic_feedback"] = feedback
-
-    if selected_key == correct_key:
-        state["score"] += 1
-    else:
-        if selected_key != "E":
-            state["wrong_focus"].append(q["focus_if_wrong"])
+    user = state["user_info"]
+    cache_key = FEEDBACK_CACHE.make_key(state["doc_hash"], q, selected_key, user)
+
+    feedback = lookup_batch_feedback(state["feedback_bank"], i, q, selected_key)
+    if feedback is None:
+        feedback = FEEDBACK_CACHE.get(cache_key, user)
+    if feedback is None:
+        def generate():
+            text = generate_dynamic_feedback(payload)
+            FEEDBACK_CACHE.put(cache_key, text, user)
+            return text
+
+        feedback = await run_tracked(
+            state, "feedback", with_local_fallback, "feedback", generate,
+            lambda: build_degraded_feedback(q, selected_key, user),
+        )
 
-    state["awaiting_next"] = True
+    ensure_current(state, epoch)
+    state["dynamic_feedback"] = feedback
 
-    await send_long_message(context, chat_id, "💝 Your Feedback:\n\n" + feedback)
+    # the instant result stays; the explanation replaces the "💭 …" placeholder
+    await edit_long_message(context, result_msg, result_text + "\n\n" + feedback)
+    ensure_current(state, epoch)
 
-    await context.bot.send_message(
-        chat_id=chat_id,
-        text="Next ➜",
+    await OUTBOX.send(
+        context.bot, chat_id,
+        "Next ➜",
         reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Next", callback_data="next_q")]])
     )
 
 
 async def show_results(context, chat_id, state):
+    epoch = state["epoch"]
     user = state["user_info"]
     score = state["score"]
     total = len(state["quiz_data"]["questions"])
@@ -214,12 +571,13 @@ async def show_results(context, chat_id, state):
         )
 
     await send_long_message(context, chat_id, msg)
+    ensure_current(state, epoch)
     # After quiz → always disable chat mode
     state["chat_mode"] = False
 
-    await context.bot.send_message(
-        chat_id=chat_id,
-        text="How do you feel now, sweetheart? (Type your answer)"
+    await OUTBOX.send(
+        context.bot, chat_id,
+        "How do you feel now, sweetheart? (Type your answer)"
     )
 
     state["step"] = "ask_mood_after"
@@ -233,13 +591,117 @@ async def start(update: Update, context):
     chat_id = update.effective_chat.id
     _init_state(chat_id)
 
-    await update.message.reply_text(
+    await OUTBOX.send(
+        context.bot, chat_id,
         "📚 Study Buddy AI\n\nTap Start to begin 💕",
         reply_markup=build_start_keyboard()
     )
 
 
+async def stats(update: Update, context):
+    if update.effective_chat.id not in ADMIN_CHAT_IDS:
+        return
+    cache = FEEDBACK_CACHE.stats()
+    answers = ANSWER_CACHE.stats()
+    neutral = NEUTRAL_CACHE.stats()
+    bank = get_question_bank()
+    bank = bank.stats() if bank is not None else None
+    await OUTBOX.send(
+        context.bot, update.effective_chat.id,
+        metrics.format_report()
+        + f"\n- feedback_cache.hit_rate: {cache['hit_rate']:.1%} ({cache['keys']} keys)"
+        + f"\n- answer_cache.hit_rate: {answers['hit_rate']:.1%} ({answers['entries']} answers)"
+        + f"\n- neutral_cache.hit_rate: {neutral['hit_rate']:.1%} ({neutral['docs']} docs)"
+        + (
+            f"\n- question_bank.hit_rate: {bank['hit_rate']:.1%} "
+            f"({bank['questions']} questions, {bank['docs']} docs, {bank['bytes'] // 1024} KB)"
+            if bank else ""
+        )
+        + "".join(
+            f"\n- singleflight.{flight.name}: {stats['coalesced']} coalesced "
+            f"of {stats['calls']} ({stats['coalesced_rate']:.1%})"
+            for flight in (EXTRACT_FLIGHT, NEUTRAL_FLIGHT, QUIZ_FLIGHT)
+            for stats in (flight.stats(),)
+        )
+        + "\n- quiz_jobs: {running}/{workers} running, {queued} queued, {rejected} rejected".format(
+            **QUIZ_JOBS.stats()
+        )
+        + f"\n- outbox.queued_now: {OUTBOX.stats()['queued_now']}"
+        + "".join(
+            f"\n- llm.{task}.hedge_rate: {h['hedge_rate']:.1%} "
+            f"(won {h['hedge_won']}, timeouts {h['timeouts']}, "
+            f"p99 {h['attempt_p99'] or 0:.2f}s → {h['served_p99'] or 0:.2f}s)"
+            for task, h in llm_backend.hedge_report().items()
+        )
+        + f"\n- llm.degraded: {'yes' if llm_backend.is_degraded() else 'no'}"
+        + "\n\n🧭 LLM routes\n"
+        + "\n".join(f"- {task}: {target}" for task, target in llm_backend.route_table().items())
+    )
+
+
+async def daily(update: Update, context):
+    chat_id = update.effective_chat.id
+    state = get_state(update)
+    args = context.args or []
+
+    usage = (
+        "⏰ Get your daily message automatically:\n"
+        "/daily 08:00 +06:00  (local time + your UTC offset)\n"
+        "/daily off  (stop)"
+    )
+
+    if not args:
+        await OUTBOX.send(context.bot, chat_id, usage)
+        return
+
+    if args[0].lower() == "off":
+        daily_delivery.unsubscribe(chat_id)
+        await OUTBOX.send(context.bot, chat_id, "Okay… no more daily messages 💔")
+        return
+
+    try:
+        local_time, offset = daily_delivery.parse_local_time(" ".join(args))
+    except (ValueError, IndexError):
+        await OUTBOX.send(context.bot, chat_id, usage)
+        return
+
+    daily_delivery.subscribe(chat_id, local_time, offset, state["user_info"], state["quiz_data"])
+    await OUTBOX.send(context.bot, chat_id, f"💌 Deal! I'll message you every day at {local_time}.")
+
+
+async def search(update: Update, context):
+    """/search <topic>: bank questions about a topic from the current PDF."""
+    state = get_state(update)
+    query = " ".join(context.args or []).strip()
+    bank = get_question_bank()
+
+    if not query:
+        await OUTBOX.send(context.bot, update.effective_chat.id, "🔎 /search <topic> — questions about a topic from your PDF")
+        return
+    if bank is None or not state.get("doc_hash"):
+        await OUTBOX.send(context.bot, update.effective_chat.id, "Send me a PDF first 📄")
+        return
+
+    found = await asyncio.to_thread(bank.search, query, state["doc_hash"], 5)
+    if not found:
+        await OUTBOX.send(context.bot, update.effective_chat.id, f"No questions about “{query}” in this PDF yet 🤔")
+        return
+    await OUTBOX.send(
+        context.bot, update.effective_chat.id,
+        f"🔎 Questions about “{query}”:\n\n"
+        + "\n\n".join(f"{i}. {q['question_text']}" for i, q in enumerate(found, start=1))
+    )
+
+
 async def handle_text(update: Update, context):
+    async with chat_lock(update.effective_chat.id):
+        try:
+            await _handle_text(update, context)
+        except SessionReset:
+            metrics.incr("inflight.discarded")
+
+
+async def _handle_text(update: Update, context):
     chat_id = update.effective_chat.id
     text = (update.message.text or "").strip()
     state = get_state(update)
@@ -251,17 +713,47 @@ async def handle_text(update: Update, context):
 
     # ---------------- CHAT MODE ----------------
     if state.get("chat_mode"):
-        from query_pdf import run_chat_from_pdf
-        answer = run_chat_from_pdf(text, state["pdf_text"], user)
-
-        # Send AI chat reply
-        await update.message.reply_text(answer)
-
+        epoch = state["epoch"]
+        history = chat_memory.render_history(state["chat_memory"])
+        # Follow-ups ("and why is that?") depend on history → never cached
+        cacheable = not chat_memory.is_follow_up(text, state["chat_memory"])
+        cached = ANSWER_CACHE.lookup(state["doc_hash"], user, text) if cacheable else None
+
+        if cached:
+            answer = cached
+            await send_long_message(context, chat_id, cached)
+        elif STREAM_CHAT:
+            answer = await track(state, "chat", stream_reply(
+                context, chat_id,
+                iterate_in_thread(stream_chat_from_pdf, text, state["pdf_text"], user, history)
+            ))
+        else:
+            try:
+                with metrics.timer("chat.total"):
+                    answer = await run_tracked(state, "chat", run_chat_from_pdf, text, state["pdf_text"], user, history)
+            except SessionReset:
+                raise
+            except Exception as e:
+                # Hard timeout / provider error: nothing to cache or remember
+                print("❌ Chat reply failed:", e)
+                answer = ""
+
+            ensure_current(state, epoch)
+            # Send AI chat reply
+            await OUTBOX.send(context.bot, chat_id, answer or "😢 I lost my train of thought… ask me again?")
+
+        if answer:
+            if cacheable and not cached:
+                ANSWER_CACHE.add(state["doc_hash"], user, text, answer)
+            remember_chat_turn(state, text, answer)
+
+        ensure_current(state, epoch)
         # Always show quiz button after reply
         quiz_keyboard = InlineKeyboardMarkup([
             [InlineKeyboardButton("❤️ Start Quiz", callback_data="start_quiz")]
         ])
-        await update.message.reply_text(
+        await OUTBOX.send(
+            context.bot, chat_id,
             "You can start your quiz anytime ❤️",
             reply_markup=quiz_keyboard
         )
@@ -275,7 +767,8 @@ async def handle_text(update: Update, context):
     if step == "ask_name":
         user["name"] = text or "Sweetheart"
         state["step"] = "ask_gender"
-        await update.message.reply_text(
+        await OUTBOX.send(
+            context.bot, chat_id,
             "How should I treat you?\n"
             "1. Pinacle of creation/ Ashraful Makhlukat 😍 (female)\n"
             "2. 2nd class creation 😒 (male)"
@@ -286,10 +779,10 @@ async def handle_text(update: Update, context):
     if step == "ask_gender":
         if text.startswith("1"):
             user["gender"] = "female"
-            await update.message.reply_text("💕 Aww queen… where were you born? 🌍")
+            await OUTBOX.send(context.bot, chat_id, "💕 Aww queen… where were you born? 🌍")
         else:
             user["gender"] = "male"
-            await update.message.reply_text("😒 Okay bro… where were you born? 🌍")
+            await OUTBOX.send(context.bot, chat_id, "😒 Okay bro… where were you born? 🌍")
         state["step"] = "ask_country"
         return
 
@@ -297,23 +790,37 @@ async def handle_text(update: Update, context):
     if step == "ask_country":
         user["country"] = text or "Unknown"
         state["step"] = "ask_mood_before"
-        await update.message.reply_text("How do you feel right now? 💭")
+        await OUTBOX.send(context.bot, chat_id, "How do you feel right now? 💭")
         return
 
     # mood before
     if step == "ask_mood_before":
         user["mood_before"] = text
         state["step"] = "await_pdf"
-        await update.message.reply_text("📄 Now send your study PDF… ❤️")
+        if state.get("pdf_task"):
+            # PDF came first and has been processing during onboarding
+            epoch = state["epoch"]
+            await OUTBOX.send(context.bot, chat_id, "📘 Finishing your study guide… ❤️")
+            ensure_current(state, epoch)
+            await finish_pdf(context, chat_id, state)
+            return
+        await OUTBOX.send(context.bot, chat_id, "📄 Now send your study PDF… ❤️")
         return
 
     # mood after results
     if step == "ask_mood_after":
         user["mood_after"] = text
-        advice = generate_post_quiz_focus_advice(user, state["wrong_focus"])
+        epoch = state["epoch"]
+        advice = await run_tracked(
+            state, "advice", with_local_fallback, "advice",
+            lambda: generate_post_quiz_focus_advice(user, state["wrong_focus"]),
+            lambda: build_degraded_advice(user, state["wrong_focus"]),
+        )
 
+        ensure_current(state, epoch)
         await send_long_message(context, chat_id, "📚 What You Should Study More:\n\n" + advice)
-        await context.bot.send_message(chat_id, "Choose an option:", reply_markup=build_results_keyboard())
+        ensure_current(state, epoch)
+        await OUTBOX.send(context.bot, chat_id, "Choose an option:", reply_markup=build_results_keyboard())
 
         extra = (
             "💖 Remember, my lovely queen, rest is just as important as study! Take care of yourself. 👑"
@@ -321,68 +828,248 @@ async def handle_text(update: Update, context):
             if user["gender"] == "female"
             else "Don't pretend to study all night bro 😒"
         )
-        await context.bot.send_message(chat_id, extra)
+        ensure_current(state, epoch)
+        await OUTBOX.send(context.bot, chat_id, extra)
 
+        ensure_current(state, epoch)
         state["step"] = "results_menu"
         return
 
-    await update.message.reply_text("Use the buttons please 💕")
+    await OUTBOX.send(context.bot, chat_id, "Use the buttons please 💕")
 
 
 # ============================================================
 # PDF HANDLER
 # ============================================================
-async def handle_pdf(update: Update, context):
-    chat_id = update.effective_chat.id
-    state = get_state(update)
-
-    if state["step"] != "await_pdf":
-        await update.message.reply_text("I'm not ready for PDF yet 😅")
-        return
-
-    doc = update.message.document
-    if not doc or not doc.mime_type.endswith("pdf"):
-        await update.message.reply_text("Send me a real PDF please 📄")
-        return
-
-    await update.message.reply_text("📘 Reading your PDF… einen moment bitte ❤️")
+# Steps before the persona is known; a PDF sent now is read in the background
+ONBOARDING_STEPS = {"ask_name", "ask_gender", "ask_country", "ask_mood_before"}
 
-    tgfile = await doc.get_file()
-    pdf_bytes = await tgfile.download_as_bytearray()
 
-    pdf_obj = BytesIO(pdf_bytes)
+def _prepare_document(pdf_bytes: bytes, doc_hash: str, cancelled: threading.Event) -> Dict[str, Any]:
+    """
+    Everything that doesn't need the persona: text extraction and the
+    persona-neutral quiz stage. Runs while onboarding questions are answered.
+    Skips the quiz stage if the chat moved on during extraction.
+    """
+    prepared = {"pdf_text": None, "neutral": None, "error": None}
+    try:
+        with metrics.timer("pdf.extract"):
+            prepared["pdf_text"] = extract_document_text(doc_hash, pdf_bytes)
+    except Exception as e:
+        print("❌ PDF extraction failed:", e)
+        prepared["error"] = "read"
+        return prepared
+    report_progress("extracted")
+
+    if cancelled.is_set():
+        metrics.incr("inflight.skipped.quiz_neutral")
+        return prepared
+
+    if TWO_STAGE:
+        try:
+            prepared["neutral"] = get_neutral_content(doc_hash, prepared["pdf_text"])
+        except Exception as e:
+            # retried with the persona stage in finish_pdf()
+            print("⚠️ Background quiz generation failed:", e)
+    return prepared
+
+
+class PdfStatus:
+    """One status message per PDF, edited as the quiz job reports its stages."""
+
+    STEPS = (
+        ("downloaded", "PDF downloaded"),
+        ("extracted", "PDF read"),
+        ("questions", "Questions"),
+        ("ready", "Study guide"),
+    )
 
+    def __init__(self, message, title: str):
+        self.message = message
+        self.title = title
+        self.reached = set()
+        self.position = 0
+        self.questions = None
+        self.failed = False
+
+        self._loop = asyncio.get_running_loop()
+        self._lock = asyncio.Lock()
+        self._shown = None
+        self._last_edit = 0.0
+        self._closed = False
+        self._refreshes = set()  # keeps pending refresh tasks referenced
+
+    def on_progress(self, stage: str, **info):
+        """Job progress callback; runs on a worker thread."""
+        self._loop.call_soon_threadsafe(self.mark, stage, info)
+
+    def mark(self, stage: str, info: Optional[Dict[str, Any]] = None):
+        info = info or {}
+        self.position = info.get("position", 0) if stage == "queued" else 0
+        if stage == "questions":
+            self.questions = (info["ready"], info["total"])
+            if info["ready"] < info["total"]:
+                stage = "extracted"
+        self.failed = self.failed or stage == "failed"
+        steps = [s for s, _ in self.STEPS]
+        if stage in steps:
+            # a later stage implies the earlier ones (e.g. cached questions)
+            self.reached.update(steps[:steps.index(stage) + 1])
+        task = asyncio.create_task(self.refresh())
+        self._refreshes.add(task)
+        task.add_done_callback(self._refreshes.discard)
+
+    def render(self) -> str:
+        lines = [self.title, ""]
+        if self.position:
+            lines.append(f"⏳ Lots of people are studying right now, you're #{self.position} in line")
+        current = next((s for s, _ in self.STEPS if s not in self.reached), None)
+        for stage, label in self.STEPS:
+            if stage == "questions" and self.questions:
+                label = f"Questions {self.questions[0]}/{self.questions[1]}"
+            if stage in self.reached:
+                mark = "✅"
+            elif stage == current:
+                mark = "😢" if self.failed else ("⏳" if not self.position else "▫️")
+            else:
+                mark = "▫️"
+            lines.append(f"{mark} {label}")
+        return "\n".join(lines)
+
+    async def replace(self, text: str):
+        """Final text instead of the stage list; later progress is ignored."""
+        async with self._lock:
+            self._closed = True
+            try:
+                await OUTBOX.edit(self.message, text)
+            except Exception as e:
+                print("⚠️ Status edit failed:", e)
+
+    async def refresh(self):
+        async with self._lock:
+            text = self.render()
+            if self._closed or text == self._shown:
+                return
+            # Telegram allows ~1 edit/sec per chat; newer stages win
+            wait = STREAM_EDIT_INTERVAL - (time.perf_counter() - self._last_edit)
+            if wait > 0:
+                await asyncio.sleep(wait)
+                text = self.render()
+            try:
+                await OUTBOX.edit(self.message, text)
+                self._shown = text
+            except Exception as e:
+                print("⚠️ Status edit failed:", e)
+            self._last_edit = time.perf_counter()
+
+
+def start_pdf_processing(state, pdf_bytes: bytes, status: Optional[PdfStatus] = None):
+    """Queues the document job; raises QueueFull when the bot is overloaded."""
+    cancel_inflight(state, "new_pdf")
+    doc_hash = document_hash(pdf_bytes)
+    cancelled = threading.Event()
+    job = QUIZ_JOBS.submit(
+        _prepare_document, bytes(pdf_bytes), doc_hash, cancelled,
+        on_progress=status.on_progress if status else None,
+    )
+    state["doc_hash"] = doc_hash
+    state["pdf_cancel"] = cancelled
+    state["pdf_status"] = status
+    state["pdf_task"] = QUIZ_JOBS.as_task(job, name="pdf")
+    state["pdf_started"] = time.perf_counter()
+
+
+async def finish_pdf(context, chat_id, state):
+    """
+    Waits for the background document work, applies the persona and posts
+    the study guide. Called on upload, or when onboarding ends if the PDF
+    came first.
+    """
+    epoch = state["epoch"]
+    task = state.pop("pdf_task")
+    waited_from = time.perf_counter()
+    state["inflight"].add(task)
     try:
-        pdf_text = extract_text_from_pdf(pdf_obj)
-    except Exception:
-        await update.message.reply_text("I couldn't read the PDF 😢")
+        prepared = await await_tracked(state, task)
+    finally:
+        state["inflight"].discard(task)
+    metrics.observe("pdf.wait_after_onboarding", time.perf_counter() - waited_from)
+    metrics.observe("pdf.ready", time.perf_counter() - state.pop("pdf_started", waited_from))
+
+    status = state.get("pdf_status")
+    if prepared["error"] == "read":
+        state["step"] = "await_pdf"
+        if status:
+            status.mark("failed")
+        await OUTBOX.send(context.bot, chat_id, "I couldn't read the PDF 😢 Send it again?")
         return
 
+    pdf_text = prepared["pdf_text"]
     state["pdf_text"] = pdf_text
 
     try:
-        quiz_data = generate_quiz_data(pdf_text, state["user_info"])
+        if prepared["neutral"] is not None:
+            quiz_data = await run_quiz_job(
+                state, "quiz_style", style_quiz, prepared["neutral"], state["user_info"], status=status
+            )
+        else:
+            quiz_data = await run_quiz_job(
+                state, "quiz", build_quiz, state["doc_hash"], pdf_text, state["user_info"], status=status
+            )
+    except SessionReset:
+        raise
+    except QueueFull:
+        state["step"] = "await_pdf"
+        busy = (
+            "😢 So many people are studying right now that I can't finish your quiz. "
+            "Send the PDF again in a few minutes?"
+        )
+        if status:
+            await status.replace(busy)
+        else:
+            await OUTBOX.send(context.bot, chat_id, busy)
+        return
     except Exception:
-        await update.message.reply_text("Error generating questions 😢")
+        state["step"] = "await_pdf"
+        if status:
+            status.mark("failed")
+        if llm_backend.is_degraded("quiz"):
+            await OUTBOX.send(
+                context.bot, chat_id,
+                "My brain is having a slow moment 😢 Send the PDF again in a minute?"
+            )
+        else:
+            await OUTBOX.send(context.bot, chat_id, "Error generating questions 😢")
         return
 
+    ensure_current(state, epoch)
     state["quiz_data"] = quiz_data
     state["current_question"] = 0
     state["score"] = 0
     state["wrong_focus"] = []
+    start_feedback_prefetch(state)
+    MESSAGE_POOL.prewarm(state["user_info"], pool_seed(quiz_data))
+    if status:
+        status.mark("ready")
+
+    # Queue every part at once so the outbox can coalesce small ones
+    posted = []
+
+    def post(text):
+        posted.append(OUTBOX.post(context.bot, chat_id, text))
 
-    await update.message.reply_text("✨ Study Guide Ready!")
+    post("✨ Study Guide Ready!")
 
     # soft summary
-    await send_long_message(context, chat_id, "💖 Soft Summary:\n\n" + quiz_data["sweet_summary"])
+    post("💖 Soft Summary:\n\n" + quiz_data["sweet_summary"])
 
     sg = quiz_data["study_guide"]
 
-    await send_long_message(context, chat_id, "📚 What This PDF Is About:\n\n" + sg["overall_advice"])
-    await send_long_message(context, chat_id, "📝 Exam Strategy:\n\n" + sg["exam_strategy"])
+    post("📚 What This PDF Is About:\n\n" + sg["overall_advice"])
+    post("📝 Exam Strategy:\n\n" + sg["exam_strategy"])
 
     if sg.get("key_topics"):
-        await send_long_message(context, chat_id, "🔥 Key Topics:\n" + "\n".join(f"- {t}" for t in sg["key_topics"]))
+        post("🔥 Key Topics:\n" + "\n".join(f"- {t}" for t in sg["key_topics"]))
 
     if sg.get("topic_notes"):
         blocks = ["✨ Nuance Notes:"]
@@ -392,10 +1079,17 @@ async def handle_pdf(update: Update, context):
                 f"- 💡 {t['nuance_note']}\n"
                 f"- 🎯 {t['why_important']}"
             )
-        await send_long_message(context, chat_id, "".join(blocks))
+        post("".join(blocks))
 
-    await context.bot.send_message(
-        chat_id,
+    # The study guide lands before the keyboard; a part that failed is logged
+    for result in await asyncio.gather(*posted, return_exceptions=True):
+        if isinstance(result, Exception):
+            metrics.incr("outbox.failed")
+            print(f"⚠️ Study guide part for {chat_id} not sent:", result)
+
+    ensure_current(state, epoch)
+    await OUTBOX.send(
+        context.bot, chat_id,
         "What would you like to do next?",
         reply_markup=build_quiz_or_chat_keyboard()
     )
@@ -403,38 +1097,131 @@ async def handle_pdf(update: Update, context):
     state["step"] = "ready_for_quiz"
 
 
+async def handle_pdf(update: Update, context):
+    """
+    Accepts a PDF at any step. During onboarding the document is read in the
+    background and attached once the persona is known.
+    """
+    # The old document's work stops now, not after it releases the lock
+    cancel_inflight(get_state(update), "new_pdf")
+    async with chat_lock(update.effective_chat.id):
+        try:
+            await _handle_pdf(update, context)
+        except SessionReset:
+            metrics.incr("inflight.discarded")
+
+
+async def _handle_pdf(update: Update, context):
+    chat_id = update.effective_chat.id
+    state = get_state(update)
+
+    doc = update.message.document
+    if not doc or not doc.mime_type.endswith("pdf"):
+        await OUTBOX.send(context.bot, chat_id, "Send me a real PDF please 📄")
+        return
+
+    onboarding = state["step"] in ONBOARDING_STEPS
+    title = (
+        "📘 Got your PDF! I'll start reading it while we get to know each other ❤️"
+        if onboarding else "📘 Reading your PDF… einen moment bitte ❤️"
+    )
+    status = PdfStatus(await OUTBOX.send(context.bot, chat_id, title, coalesce=False), title)
+
+    with metrics.timer("pdf.download"):
+        tgfile = await doc.get_file()
+        pdf_bytes = await tgfile.download_as_bytearray()
+    status.mark("downloaded")
+
+    try:
+        start_pdf_processing(state, pdf_bytes, status)
+    except QueueFull:
+        await status.replace(
+            "😢 So many people are studying right now that I can't take another PDF. "
+            "Send it again in a few minutes?"
+        )
+        return
+
+    if onboarding:
+        return
+    await finish_pdf(context, chat_id, state)
+
+
 # ============================================================
 # BUTTON HANDLER
 # ============================================================
 async def handle_buttons(update: Update, context):
+    """
+    Acknowledges every tap at once. Duplicate taps (same button message and
+    operation, in flight or done) stop here, without any LLM work.
+    """
     q = update.callback_query
+    chat_id = q.message.chat_id
+
+    key = callback_key(q)
+    seen = CALLBACK_KEYS.setdefault(chat_id, OrderedDict())
+    if key is not None:
+        if key in seen:
+            metrics.incr("callbacks.duplicate")
+            await q.answer("Already done 💕" if seen[key] else "⏳ On it…")
+            return
+        seen[key] = False
+        while len(seen) > MAX_CALLBACK_KEYS:
+            seen.popitem(last=False)
+
     await q.answer()
+    try:
+        if q.data in UNLOCKED_CALLBACKS:
+            await _handle_button(context, chat_id, q.data)
+        else:
+            async with chat_lock(chat_id):
+                await _handle_button(context, chat_id, q.data)
+    except SessionReset:
+        metrics.incr("inflight.discarded")
+    except Exception:
+        seen.pop(key, None)  # let the user retry
+        raise
+    if key is not None and key in seen:
+        seen[key] = True
 
-    chat_id = q.message.chat_id
+
+async def _handle_button(context, chat_id: int, data: str):
     state = USER_STATE.get(chat_id) or _init_state(chat_id)
-    data = q.data
+    epoch = state["epoch"]
 
     # start button
     if data == "restart_start":
-        _init_state(chat_id)
-        await context.bot.send_message(chat_id, "What should I call you? 💕")
+        # keep a PDF that was sent before pressing Start
+        pending = {
+            k: state.pop(k)
+            for k in ("pdf_task", "pdf_cancel", "pdf_status", "pdf_started", "doc_hash")
+            if state.get(k)
+        }
+        _init_state(chat_id).update(pending)
+        await OUTBOX.send(
+            context.bot, chat_id,
+            "What should I call you? 💕\n(You can send your study PDF anytime 📄)"
+        )
         return
 
     # chat mode
     if data == "chat_mode":
         state["chat_mode"] = True
-        await context.bot.send_message(chat_id, "💬 Ask anything from your PDF!")
+        await OUTBOX.send(context.bot, chat_id, "💬 Ask anything from your PDF!")
         return
 
     # start quiz
     if data == "start_quiz":
         state["chat_mode"] = False
-        await context.bot.send_message(chat_id, "Starting quiz ❤️")
+        await OUTBOX.send(context.bot, chat_id, "Starting quiz ❤️")
+        ensure_current(state, epoch)
         await send_question(context, chat_id, state)
         return
 
     if data == "gods_msg":
-        msg = generate_gods_message(state["user_info"])
+        msg = await pooled_message(
+            "gods", state, chat_id, lambda: generate_gods_message(state["user_info"])
+        )
+        ensure_current(state, epoch)
         await send_long_message(context, chat_id, msg)
         return
 
@@ -454,32 +1241,62 @@ async def handle_buttons(update: Update, context):
 
     # daily message
     if data == "daily_msg":
-        msg = generate_daily_romantic_message(state["user_info"], state["quiz_data"])
+        msg = await pooled_message(
+            "daily", state, chat_id,
+            lambda: generate_daily_romantic_message(state["user_info"], state["quiz_data"]),
+        )
+        ensure_current(state, epoch)
         await send_long_message(context, chat_id, msg)
         return
 
     # night message
     if data == "night_msg":
-        msg = generate_night_mode_message(state["user_info"], state["quiz_data"]) + "\n\nGood night 🌙"
+        msg = await pooled_message(
+            "night", state, chat_id,
+            lambda: generate_night_mode_message(state["user_info"], state["quiz_data"]),
+        ) + "\n\nGood night 🌙"
+        ensure_current(state, epoch)
         await send_long_message(context, chat_id, msg)
         return
 
     # play again
     if data == "play_again":
-        quiz_data = generate_quiz_data(state["pdf_text"], state["user_info"])
+        try:
+            if llm_backend.is_degraded("quiz"):
+                raise llm_backend.LLMUnavailable("quiz backend degraded")
+            # a new set from the question bank when it has one, generated otherwise
+            quiz_data = await run_quiz_job(
+                state, "quiz", build_quiz, state["doc_hash"], state["pdf_text"], state["user_info"],
+                fresh=True, exclude=state["quiz_data"]["questions"],
+            )
+            ready_text = "🔁 New quiz ready!"
+        except SessionReset:
+            raise
+        except Exception as e:
+            # Degraded: replay the questions we already have (feedback bank still matches)
+            print("⚠️ New quiz failed, replaying the current one:", e)
+            quiz_data = state["quiz_data"]
+            ready_text = "🔁 My brain is a bit slow right now… let's go through this quiz once more!"
+
+        ensure_current(state, epoch)
+        is_new = quiz_data is not state["quiz_data"]
         state["quiz_data"] = quiz_data
         state["current_question"] = 0
         state["score"] = 0
         state["wrong_focus"] = []
+        if is_new:
+            start_feedback_prefetch(state)
+            MESSAGE_POOL.prewarm(state["user_info"], pool_seed(quiz_data))
 
-        await context.bot.send_message(chat_id, "🔁 New quiz ready!")
+        await OUTBOX.send(context.bot, chat_id, ready_text)
+        ensure_current(state, epoch)
         await send_question(context, chat_id, state)
         return
 
     # restart
     if data == "restart":
         _init_state(chat_id)
-        await context.bot.send_message(chat_id, "Restarted. What should I call you?")
+        await OUTBOX.send(context.bot, chat_id, "Restarted. What should I call you?")
         return
 
 
@@ -490,15 +1307,25 @@ if __name__ == "__main__":
     app = ApplicationBuilder()\
     .token(TELEGRAM_TOKEN)\
     .connection_pool_size(20)\
+    .concurrent_updates(True)\
     .read_timeout(60)\
     .write_timeout(60)\
     .build()
 
 
     app.add_handler(CommandHandler("start", start))
+    app.add_handler(CommandHandler("stats", stats))
+    app.add_handler(CommandHandler("daily", daily))
+    app.add_handler(CommandHandler("search", search))
     app.add_handler(MessageHandler(filters.Document.PDF, handle_pdf))
     app.add_handler(CallbackQueryHandler(handle_buttons))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
 
+    if app.job_queue:
+        daily_delivery.schedule(app.job_queue)
+        app.job_queue.run_repeating(warm_message_pools, interval=POOL_WARM_INTERVAL, first=POOL_WARM_INTERVAL)
+    else:
+        print("⚠️ JobQueue not installed (python-telegram-bot[job-queue]); /daily delivery disabled")
+
     print("Bot is running…")
     app.run_polling()
@@ -0,0 +1,86 @@
+"""
+Bounded conversation memory for "Chat from PDF".
+
+Recent turns are kept verbatim up to a fixed token budget. Older turns are
+moved to `pending` and folded into a rolling summary by a background task,
+so prompt size stays flat however long the conversation runs. If the
+summarizer falls behind, the oldest pending turns are compacted into the
+summary on the spot (question only, no LLM call) instead of being lost.
+"""
+import os
+import re
+from typing import Dict, Any, List
+
+import metrics
+from query_pdf import estimate_tokens
+
+# Token budget for verbatim recent turns / for the rolling summary
+HISTORY_TOKENS = int(os.getenv("STUDYBUDDY_CHAT_HISTORY_TOKENS", "600"))
+SUMMARY_TOKENS = int(os.getenv("STUDYBUDDY_CHAT_SUMMARY_TOKENS", "200"))
+
+# A connective opener, or a pronoun within the first three words ("what does it mean?")
+_FOLLOW_UP = re.compile(
+    r"^(and|but|so|also|then|why|how come|what about|how about"
+    r"|(\w+\s+){0,2}(it|that|this|those|these|they|them))\b",
+    re.IGNORECASE,
+)
+
+
+def new_memory() -> Dict[str, Any]:
+    # fold_task: the running summarizer task, if any
+    return {"summary": "", "turns": [], "pending": [], "fold_task": None}
+
+
+def has_history(memory: Dict[str, Any]) -> bool:
+    return bool(memory["summary"] or memory["pending"] or memory["turns"])
+
+
+def is_follow_up(question: str, memory: Dict[str, Any]) -> bool:
+    """True if the question probably depends on earlier turns ("and why is that?")."""
+    return has_history(memory) and bool(_FOLLOW_UP.search(question.strip()))
+
+
+def _turn_tokens(turn: Dict[str, str]) -> int:
+    return estimate_tokens(turn["question"]) + estimate_tokens(turn["answer"])
+
+
+def add_turn(memory: Dict[str, Any], question: str, answer: str) -> bool:
+    """
+    Appends a turn and moves the oldest turns to `pending` while the recent
+    turns exceed HISTORY_TOKENS. Returns True if there is work to fold.
+    """
+    memory["turns"].append({"question": question, "answer": answer})
+
+    while len(memory["turns"]) > 1 and sum(map(_turn_tokens, memory["turns"])) > HISTORY_TOKENS:
+        memory["pending"].append(memory["turns"].pop(0))
+
+    # If summarizing falls behind, never let pending grow past the budget either
+    while len(memory["pending"]) > 1 and sum(map(_turn_tokens, memory["pending"])) > HISTORY_TOKENS:
+        compact_turn(memory, memory["pending"].pop(0))
+
+    return bool(memory["pending"])
+
+
+def compact_turn(memory: Dict[str, Any], turn: Dict[str, str]):
+    """Folds a turn into the summary without the LLM, keeping only the question."""
+    memory["summary"] = trim_summary(f"{memory['summary']}\n- Student asked: {turn['question']}".strip())
+    metrics.incr("chat.memory_compacted")
+
+
+def render_history(memory: Dict[str, Any]) -> str:
+    """Summary + not-yet-folded turns + recent turns, as prompt text."""
+    parts = []
+    if memory["summary"]:
+        parts.append(f"Summary of earlier conversation:\n{memory['summary']}")
+
+    turns: List[Dict[str, str]] = memory["pending"] + memory["turns"]
+    for t in turns:
+        parts.append(f"Student: {t['question']}\nYou: {t['answer']}")
+
+    return "\n\n".join(parts)
+
+
+def trim_summary(summary: str) -> str:
+    """Hard cap so a verbose summary can't grow the prompt."""
+    max_chars = SUMMARY_TOKENS * 4
+    return summary if len(summary) <= max_chars else summary[-max_chars:]
@@ -0,0 +1,353 @@
+"""
+Scheduled daily-message delivery.
+
+Opted-in users get their daily romantic/roast message at a local time:
+  1. A planner job (bot JobQueue) looks LEAD_MINUTES (+ one planning interval)
+     ahead for users due soon, leaving time for the batch job to finish.
+  2. Due users are grouped by (gender, country, seed) and their messages are
+     generated in bulk through a batch client — one request per group, not
+     one call per user (Gemini Batch API, or a local stand-in for tests).
+  3. Sends are spread out so the whole worker stays under Telegram's global
+     rate limit (SEND_RATE messages/second).
+A subscriber counts as planned for the day only once their message exists.
+Anyone the batch didn't cover (failure, batch timeout, unreadable output)
+goes through the direct path instead: message pool → LLM → local message.
+"""
+import os
+import json
+import time
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, List, Optional, Set, Tuple
+
+import metrics
+import llm_backend as llm
+from send_queue import OUTBOX
+from message_pool import MESSAGE_POOL, pool_seed, seed_quiz
+from query_pdf import (
+    get_client,
+    build_degraded_message,
+    build_message_batch_prompt,
+    generate_daily_romantic_message,
+    parse_message_batch,
+    with_local_fallback,
+    POOL_NAME_TOKEN,
+)
+
+SUBSCRIBERS_FILE = os.getenv("STUDYBUDDY_SUBSCRIBERS_FILE", "subscribers.json")
+BATCH_BACKEND = os.getenv("STUDYBUDDY_BATCH_BACKEND", "gemini")  # gemini | local
+
+PLAN_INTERVAL_MINUTES = int(os.getenv("STUDYBUDDY_PLAN_INTERVAL_MINUTES", "15"))
+LEAD_MINUTES = int(os.getenv("STUDYBUDDY_DAILY_LEAD_MINUTES", "60"))
+SEND_RATE = float(os.getenv("STUDYBUDDY_DAILY_SEND_RATE", "25"))  # Telegram global limit is ~30/s
+MESSAGES_PER_REQUEST = 50
+
+# chat_id → {"time": "HH:MM", "utc_offset": minutes, "user_info": {...},
+#            "seed": str (message_pool.pool_seed), "planned_for": "YYYY-MM-DD"}
+SUBSCRIBERS: Dict[int, Dict[str, Any]] = {}
+
+# chat_ids whose messages are being generated right now; memory only, so a
+# restart mid-batch plans them again
+IN_FLIGHT: Set[int] = set()
+
+
+# ==============================
+#  SUBSCRIPTIONS
+# ==============================
+def parse_local_time(text: str) -> Tuple[str, int]:
+    """
+    Parses "08:00" or "08:00 +06:00" / "21:30 -4" → ("HH:MM", utc offset minutes).
+    Raises ValueError on bad input.
+    """
+    parts = text.split()
+    hh, mm = (int(x) for x in parts[0].split(":"))
+    if not (0 <= hh < 24 and 0 <= mm < 60):
+        raise ValueError("bad time")
+
+    offset = 0
+    if len(parts) > 1:
+        raw = parts[1]
+        sign = -1 if raw.startswith("-") else 1
+        oh, _, om = raw.lstrip("+-").partition(":")
+        offset = sign * (int(oh) * 60 + int(om or 0))
+        if abs(offset) > 14 * 60:
+            raise ValueError("bad offset")
+
+    return f"{hh:02d}:{mm:02d}", offset
+
+
+def subscribe(chat_id: int, local_time: str, utc_offset: int,
+              user_info: Dict[str, Any], quiz_data: Optional[Dict[str, Any]] = None):
+    SUBSCRIBERS[chat_id] = {
+        "time": local_time,
+        "utc_offset": utc_offset,
+        "user_info": dict(user_info),
+        "seed": pool_seed(quiz_data),
+        "planned_for": "",
+    }
+    save_subscribers()
+
+
+def unsubscribe(chat_id: int):
+    SUBSCRIBERS.pop(chat_id, None)
+    save_subscribers()
+
+
+def save_subscribers():
+    try:
+        with open(SUBSCRIBERS_FILE, "w", encoding="utf-8") as f:
+            json.dump({str(k): v for k, v in SUBSCRIBERS.items()}, f, ensure_ascii=False)
+    except OSError as e:
+        print("⚠️ Could not save subscribers:", e)
+
+
+def load_subscribers():
+    try:
+        with open(SUBSCRIBERS_FILE, encoding="utf-8") as f:
+            SUBSCRIBERS.update({int(k): v for k, v in json.load(f).items()})
+    except (OSError, ValueError):
+        pass
+
+
+def next_send_utc(sub: Dict[str, Any], now: datetime) -> datetime:
+    """Next UTC datetime (>= now) of the subscriber's local send time."""
+    hh, mm = (int(x) for x in sub["time"].split(":"))
+    local_now = now + timedelta(minutes=sub["utc_offset"])
+    local_send = local_now.replace(hour=hh, minute=mm, second=0, microsecond=0)
+    if local_send < local_now:
+        local_send += timedelta(days=1)
+    return local_send - timedelta(minutes=sub["utc_offset"])
+
+
+def due_subscribers(now: datetime, start: timedelta, end: timedelta):
+    """Subscribers whose next send falls in [now+start, now+end), not yet planned or in flight."""
+    due = []
+    for chat_id, sub in SUBSCRIBERS.items():
+        if chat_id in IN_FLIGHT:
+            continue
+        send_at = next_send_utc(sub, now)
+        day = send_at.strftime("%Y-%m-%d")
+        if now + start <= send_at < now + end and sub.get("planned_for") != day:
+            due.append((chat_id, sub, send_at))
+    return due
+
+
+# ==============================
+#  BATCH CLIENTS
+# ==============================
+class GeminiBatchClient:
+    """Gemini Batch API: many prompts in one job, polled until done."""
+
+    def __init__(self, model: Optional[str] = None, poll_seconds: float = 20.0,
+                 max_wait_seconds: float = 45 * 60):
+        self.model = model or llm.gemini_model("message_batch")
+        self.poll_seconds = poll_seconds
+        self.max_wait_seconds = max_wait_seconds
+
+    def run(self, prompts: List[str]) -> List[Optional[str]]:
+        client = get_client()
+        job = client.batches.create(
+            model=self.model,
+            src=[{"contents": [{"parts": [{"text": p}], "role": "user"}]} for p in prompts],
+            config={"display_name": f"studybuddy-daily-{int(time.time())}"},
+        )
+
+        deadline = time.monotonic() + self.max_wait_seconds
+        done_states = {"JOB_STATE_SUCCEEDED", "JOB_STATE_FAILED",
+                       "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED"}
+        while job.state.name not in done_states:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Batch job {job.name} still {job.state.name}")
+            time.sleep(self.poll_seconds)
+            job = client.batches.get(name=job.name)
+
+        if job.state.name != "JOB_STATE_SUCCEEDED":
+            raise RuntimeError(f"Batch job {job.name} ended as {job.state.name}")
+
+        return [
+            r.response.text if getattr(r, "response", None) else None
+            for r in job.dest.inlined_responses
+        ]
+
+
+class LocalBatchClient:
+    """
+    Local stand-in for the batch API (tests / offline runs).
+    `responder(prompt) -> str` defaults to canned JSON message lists.
+    """
+
+    def __init__(self, responder=None):
+        self.responder = responder or self._canned
+        self.calls: List[List[str]] = []
+
+    @staticmethod
+    def _canned(prompt: str) -> str:
+        marker = "Write "
+        n = int(prompt.split(marker, 1)[1].split()[0]) if marker in prompt else 1
+        return json.dumps([
+            f"{POOL_NAME_TOKEN}, study a little today 📚 ({i + 1})" for i in range(n)
+        ])
+
+    def run(self, prompts: List[str]) -> List[Optional[str]]:
+        self.calls.append(list(prompts))
+        return [self.responder(p) for p in prompts]
+
+
+def get_batch_client():
+    return LocalBatchClient() if BATCH_BACKEND == "local" else GeminiBatchClient()
+
+
+# ==============================
+#  PLANNING
+# ==============================
+def generate_daily_batch(due, batch_client=None) -> Dict[int, str]:
+    """
+    Generates one daily message per due subscriber, grouped by
+    (gender, country, seed) into bulk requests. Returns chat_id → message.
+    """
+    batch_client = batch_client or get_batch_client()
+
+    groups: Dict[Tuple[str, str, str], List[Tuple[int, Dict[str, Any]]]] = {}
+    for chat_id, sub, _ in due:
+        user = sub["user_info"]
+        key = (
+            (user.get("gender") or "female").lower(),
+            (user.get("country") or "default").strip().lower(),
+            sub.get("seed", ""),
+        )
+        groups.setdefault(key, []).append((chat_id, sub))
+
+    requests = []  # (members, prompt)
+    for members in groups.values():
+        for i in range(0, len(members), MESSAGES_PER_REQUEST):
+            chunk = members[i:i + MESSAGES_PER_REQUEST]
+            user = chunk[0][1]["user_info"]
+            quiz_seed = seed_quiz("daily", chunk[0][1].get("seed", ""))
+            requests.append((chunk, build_message_batch_prompt("daily", user, quiz_seed, len(chunk))))
+
+    with metrics.timer("daily.batch"):
+        outputs = batch_client.run([prompt for _, prompt in requests]) if requests else []
+    metrics.incr("daily.batch_requests", len(requests))
+
+    messages: Dict[int, str] = {}
+    for (members, _), raw in zip(requests, outputs):
+        try:
+            texts = parse_message_batch(raw) if raw else []
+        except RuntimeError as e:
+            print("⚠️ Daily batch output unreadable:", e)
+            texts = []
+        for j, (chat_id, sub) in enumerate(members):
+            if texts:
+                name = sub["user_info"].get("name") or "Sweetheart"
+                messages[chat_id] = texts[j % len(texts)].replace(POOL_NAME_TOKEN, name)
+    return messages
+
+
+def direct_daily_message(chat_id: int, sub: Dict[str, Any]) -> str:
+    """One subscriber's message without the batch: pool, then LLM, then local."""
+    user = sub["user_info"]
+    seed = sub.get("seed", "")
+    message = MESSAGE_POOL.get("daily", user, seed, chat_id)
+    if message:
+        return message
+    return with_local_fallback(
+        "daily",
+        lambda: generate_daily_romantic_message(user, seed_quiz("daily", seed)),
+        lambda: build_degraded_message("daily", user),
+    )
+
+
+def generate_daily_messages(due, batch_client=None) -> Dict[int, str]:
+    """
+    Batch first; every subscriber the batch didn't cover (it failed, timed
+    out, or its output was unreadable) gets a direct message instead.
+    """
+    try:
+        messages = generate_daily_batch(due, batch_client)
+    except Exception as e:
+        print("❌ Daily batch generation failed, using the direct path:", e)
+        metrics.incr("daily.batch_failed")
+        messages = {}
+
+    missing = [(chat_id, sub) for chat_id, sub, _ in due if chat_id not in messages]
+    if missing:
+        metrics.incr("daily.direct", len(missing))
+    for chat_id, sub in missing:
+        messages[chat_id] = direct_daily_message(chat_id, sub)
+    return messages
+
+
+def spread_sends(targets: List[Tuple[int, datetime]], rate: float = SEND_RATE,
+                 not_before: Optional[datetime] = None) -> List[Tuple[int, datetime]]:
+    """
+    Assigns each (chat_id, target_time) a send slot so that at most `rate`
+    messages go out per second overall. Slots are never before the target.
+    """
+    gap = timedelta(seconds=1.0 / rate)
+    slot = not_before or datetime.min.replace(tzinfo=timezone.utc)
+    planned = []
+    for chat_id, target in sorted(targets, key=lambda t: t[1]):
+        slot = max(slot, target)
+        planned.append((chat_id, slot))
+        slot += gap
+    return planned
+
+
+# ==============================
+#  JOBQUEUE CALLBACKS
+# ==============================
+async def _send_daily(context):
+    chat_id, text = context.job.data
+    try:
+        await OUTBOX.send(context.bot, chat_id, "💌 " + text)
+        metrics.incr("daily.sent")
+    except Exception as e:
+        metrics.incr("daily.failed")
+        print(f"⚠️ Daily send to {chat_id} failed:", e)
+
+
+async def plan_deliveries(context):
+    """
+    Repeating job: batch-generate messages for users due in the next planning
+    window and schedule their (rate-spread) sends.
+    """
+    now = datetime.now(timezone.utc)
+    # Everything due before the end of the next window that isn't planned yet
+    # (also catches users who subscribed less than LEAD_MINUTES ago)
+    due = due_subscribers(
+        now,
+        timedelta(0),
+        timedelta(minutes=LEAD_MINUTES + PLAN_INTERVAL_MINUTES),
+    )
+    if not due:
+        return
+
+    chat_ids = {chat_id for chat_id, _, _ in due}
+    IN_FLIGHT.update(chat_ids)
+    try:
+        messages = await asyncio.to_thread(generate_daily_messages, due)
+
+        # only subscribers that still exist and have a message count as planned
+        planned = [
+            (chat_id, sub, send_at) for chat_id, sub, send_at in due
+            if messages.get(chat_id) and SUBSCRIBERS.get(chat_id) is sub
+        ]
+        for chat_id, sub, send_at in planned:
+            sub["planned_for"] = send_at.strftime("%Y-%m-%d")
+        save_subscribers()
+    finally:
+        IN_FLIGHT.difference_update(chat_ids)
+
+    targets = [(chat_id, send_at) for chat_id, _, send_at in planned]
+    for chat_id, slot in spread_sends(targets, not_before=datetime.now(timezone.utc)):
+        context.job_queue.run_once(
+            _send_daily, when=slot, data=(chat_id, messages[chat_id]),
+            name=f"daily-{chat_id}",
+        )
+    print(f"📅 Planned {len(targets)} daily messages")
+
+
+def schedule(job_queue):
+    """Registers the planner on the bot's JobQueue."""
+    load_subscribers()
+    job_queue.run_repeating(plan_deliveries, interval=PLAN_INTERVAL_MINUTES * 60, first=10)
@@ -0,0 +1,133 @@
+"""
+Feedback cache for quiz answers.
+
+Key: (document hash, question hash, selected key, persona variant)
+  - several feedback variants per key, served round-robin so tone stays fresh
+  - LRU eviction over keys
+  - the learner's name is stored as a placeholder so variants can be
+    shared by everyone with the same persona variant
+"""
+import os
+import re
+import json
+import random
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+import metrics
+
+NAME_PLACEHOLDER = "⟨name⟩"
+
+CacheKey = Tuple[str, str, str, str]
+
+
+def strip_name(text: str, user_info: Dict[str, Any]) -> str:
+    """Replaces the learner's name with NAME_PLACEHOLDER before caching."""
+    name = (user_info.get("name") or "").strip()
+    if len(name) > 1:
+        text = re.sub(rf"\b{re.escape(name)}\b", NAME_PLACEHOLDER, text)
+    return text
+
+
+def fill_name(text: str, user_info: Dict[str, Any]) -> str:
+    """Puts the current learner's name back into a cached text."""
+    return text.replace(NAME_PLACEHOLDER, user_info.get("name") or "Sweetheart")
+
+
+def question_hash(question: Dict[str, Any]) -> str:
+    raw = json.dumps(
+        [question.get("question_text", ""), question.get("options", {})],
+        sort_keys=True, ensure_ascii=False,
+    )
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def persona_variant(user_info: Dict[str, Any]) -> str:
+    gender = (user_info.get("gender") or "female").lower()
+    country = (user_info.get("country") or "default").strip().lower()
+    return f"{gender}:{country}"
+
+
+class FeedbackCache:
+    def __init__(self, max_keys: int = 5000, max_variants: int = 3,
+                 refresh_rate: float = 0.25):
+        """
+        max_keys:     LRU capacity (number of keys)
+        max_variants: feedback texts kept per key
+        refresh_rate: share of hits turned into misses while a key still has
+                      fewer than max_variants, so new variants get generated
+        """
+        self.max_keys = max_keys
+        self.max_variants = max_variants
+        self.refresh_rate = refresh_rate
+
+        self._data: "OrderedDict[CacheKey, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(doc_hash: str, question: Dict[str, Any], selected_key: str,
+                 user_info: Dict[str, Any]) -> CacheKey:
+        return (doc_hash or "", question_hash(question), selected_key, persona_variant(user_info))
+
+    def get(self, key: CacheKey, user_info: Dict[str, Any]) -> Optional[str]:
+        with self._lock:
+            entry = self._data.get(key)
+
+            if entry is None:
+                self.misses += 1
+                metrics.incr("feedback_cache.miss")
+                return None
+
+            variants = entry["variants"]
+            if len(variants) < self.max_variants and random.random() < self.refresh_rate:
+                self.refreshes += 1
+                metrics.incr("feedback_cache.refresh")
+                return None
+
+            self._data.move_to_end(key)
+            text = variants[entry["next"] % len(variants)]
+            entry["next"] += 1
+            self.hits += 1
+
+        metrics.incr("feedback_cache.hit")
+        return fill_name(text, user_info)
+
+    def put(self, key: CacheKey, text: str, user_info: Dict[str, Any]):
+        text = strip_name(text, user_info)
+
+        with self._lock:
+            entry = self._data.setdefault(key, {"variants": [], "next": 0})
+            self._data.move_to_end(key)
+
+            if text not in entry["variants"]:
+                entry["variants"].append(text)
+                del entry["variants"][:-self.max_variants]
+
+            while len(self._data) > self.max_keys:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses + self.refreshes
+            return {
+                "keys": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "refreshes": self.refreshes,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+FEEDBACK_CACHE = FeedbackCache(
+    max_keys=int(os.getenv("STUDYBUDDY_FEEDBACK_CACHE_SIZE", "5000")),
+    max_variants=int(os.getenv("STUDYBUDDY_FEEDBACK_VARIANTS", "3")),
+)
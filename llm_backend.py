@@ -0,0 +1,697 @@
+"""
+Unified LLM backend layer.
+
+Every generation in the app goes through `generate(task, prompt)` /
+`stream(task, prompt)`. A routing table picks the backend and model tier
+per task type, so cheap/fast models can serve feedback and messages while
+a larger one writes quizzes. Backends are interchangeable:
+
+  - "gemini": Google Gemini (google.genai)
+  - "hf":     HuggingFace Qwen2-VL (multimodal, see query_telegram.py)
+  - "fake":   local deterministic stand-in for benchmarks and offline runs
+
+Per-task latency is recorded as metrics "llm.<task>" so routing can be tuned.
+"""
+import os
+import re
+import json
+import time
+import random
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Any, Iterator, Optional, Tuple, TYPE_CHECKING
+
+import metrics
+
+if TYPE_CHECKING:
+    from google import genai
+
+
+# ==============================
+#   GEMINI CLIENT HELPER
+# ==============================
+
+_CLIENT = None
+_CLIENT_LOCK = threading.Lock()
+
+
+def get_client() -> "genai.Client":
+    """
+    Returns a configured Gemini client using GEMINI_API_KEY
+    from environment variables. Built once, on first use.
+    """
+    global _CLIENT
+    if _CLIENT is None:
+        with _CLIENT_LOCK:
+            if _CLIENT is None:
+                api_key = os.getenv("GEMINI_API_KEY")
+                if not api_key:
+                    raise RuntimeError("GEMINI_API_KEY is missing in environment variables.")
+                from google import genai
+                _CLIENT = genai.Client(api_key=api_key)
+    return _CLIENT
+
+
+# ==============================
+#   BACKENDS
+# ==============================
+
+class LLMBackend:
+    name = "base"
+
+    def generate(self, prompt: str, model: str, task: str, images=None) -> str:
+        raise NotImplementedError
+
+    def stream(self, prompt: str, model: str, task: str) -> Iterator[str]:
+        # Backends without native streaming yield the whole reply at once
+        yield self.generate(prompt, model, task)
+
+
+class GeminiBackend(LLMBackend):
+    name = "gemini"
+
+    def generate(self, prompt, model, task, images=None):
+        contents = prompt
+        if images:
+            from google.genai import types
+            from query_telegram import encoded_images
+            contents = [
+                types.Part.from_bytes(data=bytes(payload), mime_type="image/jpeg")
+                for payload in encoded_images(images)
+            ] + [prompt]
+        response = get_client().models.generate_content(
+            model=model, contents=contents, config=self._config(task)
+        )
+        return response.text
+
+    def stream(self, prompt, model, task):
+        chunks = get_client().models.generate_content_stream(
+            model=model, contents=prompt, config=self._config(task)
+        )
+        for chunk in chunks:
+            if chunk.text:
+                yield chunk.text
+
+    @staticmethod
+    def _config(task: str):
+        """
+        Bounded tasks get the same limit as an HTTP timeout, so an attempt
+        the caller gave up on releases its worker instead of hanging on.
+        """
+        timeout = call_timeout(task)
+        if timeout is None:
+            return None
+        from google.genai import types
+        return types.GenerateContentConfig(
+            http_options=types.HttpOptions(timeout=int(timeout * 1000))
+        )
+
+
+class HFBackend(LLMBackend):
+    name = "hf"
+
+    def generate(self, prompt, model, task, images=None):
+        from query_telegram import hf_generate
+        return hf_generate(
+            prompt,
+            images=images,
+            max_tokens=HF_MAX_TOKENS.get(task, 1024),
+            temperature=HF_TEMPERATURES.get(task, 0.7),
+        )
+
+
+class FakeBackend(LLMBackend):
+    """
+    Deterministic local backend. Latency models a real API:
+    base + prompt_tokens / prefill_rate + output_tokens / decode_rate.
+    """
+    name = "fake"
+
+    def __init__(self, base_latency: float = 0.05, prefill_rate: float = 50000.0,
+                 decode_rate: float = 200.0, tail_probability: float = 0.0,
+                 tail_latency: float = 0.0):
+        self.base_latency = base_latency
+        self.prefill_rate = prefill_rate
+        self.decode_rate = decode_rate
+        # Occasional slow outliers, to exercise hedging and timeouts
+        self.tail_probability = tail_probability
+        self.tail_latency = tail_latency
+        self._rng = random.Random(0)
+
+    def generate(self, prompt, model, task, images=None):
+        reply = self._reply(task, prompt)
+        tail = self.tail_latency if self._rng.random() < self.tail_probability else 0.0
+        time.sleep(
+            self.base_latency
+            + tail
+            + (len(prompt) / 4) / self.prefill_rate
+            + (len(reply) / 4) / self.decode_rate
+        )
+        return reply
+
+    @staticmethod
+    def _count_after(prompt: str, marker: str, default: int) -> int:
+        if marker not in prompt:
+            return default
+        digits = "".join(c for c in prompt.split(marker, 1)[1][:12] if c.isdigit() or c == " ").split()
+        return int(digits[0]) if digits else default
+
+    def _reply(self, task: str, prompt: str) -> str:
+        if task == "quiz":
+            return json.dumps(fake_quiz_data())
+        if task == "quiz_neutral":
+            data = fake_quiz_data()
+            for q in data["questions"]:
+                del q["introduction"], q["romance_level"]
+            return json.dumps({"summary": data["sweet_summary"], "study_guide": data["study_guide"],
+                               "questions": data["questions"]})
+        if task == "quiz_guide":
+            data = fake_quiz_data()
+            return json.dumps({"summary": data["sweet_summary"], "study_guide": data["study_guide"]})
+        if task == "quiz_questions":
+            n = self._count_after(prompt, "Generate EXACTLY", 5)
+            first = re.search(r"\(questions (\d+)", prompt)
+            data = fake_quiz_data(n, first=int(first.group(1)) if first else 1)
+            # a top-up lists the questions it must not repeat: answer with new ones
+            avoided = prompt.count("\n- Fake question")
+            for q in data["questions"]:
+                del q["introduction"], q["romance_level"]
+                if avoided:
+                    q["question_text"] = q["question_text"].replace("?", f" (more {avoided})?")
+            return json.dumps({"questions": data["questions"]})
+        if task == "quiz_style":
+            n = self._count_after(prompt, "EXACTLY", 17)
+            return json.dumps({
+                "sweet_summary": "Fake persona summary.",
+                "introductions": [f"Fake intro {i}." for i in range(1, n + 1)],
+                "daily_romantic_message_seed": "Fake daily seed.",
+                "night_mode_message_seed": "Fake night seed.",
+            })
+        if task == "feedback_batch":
+            n = self._count_after(prompt, "from 1 to", 17)
+            return json.dumps({
+                str(i): {k: f"Fake feedback for question {i}, option {k}." for k in "ABCDE"}
+                for i in range(1, n + 1)
+            })
+        if task == "message_batch":
+            n = self._count_after(prompt, "Write", 8)
+            return json.dumps([f"[NAME], fake message {i + 1} 💌" for i in range(n)])
+        return f"Fake {task} reply."
+
+
+def fake_quiz_data(num_questions: int = 17, first: int = 1) -> Dict[str, Any]:
+    """A structurally valid quiz_data dict, used by the fake backend (numbered from `first`)."""
+    keys = "ABCD"
+    return {
+        "sweet_summary": "Fake summary of the document.",
+        "study_guide": {
+            "overall_advice": "Fake overall advice.",
+            "exam_strategy": "Fake exam strategy.",
+            "key_topics": ["Topic 1", "Topic 2", "Topic 3"],
+            "topic_notes": [
+                {"topic": "Topic 1", "nuance_note": "Fake nuance.", "why_important": "Fake reason."}
+            ],
+        },
+        "questions": [
+            {
+                "introduction": f"Fake intro {i}.",
+                "question_text": f"Fake question {i}?",
+                "options": {"A": "Option A", "B": "Option B", "C": "Option C",
+                            "D": "Option D", "E": "Pass"},
+                "correct_answer_key": keys[i % 4],
+                "focus_if_wrong": f"Review topic {i % 3 + 1}.",
+                "romance_level": i,
+            }
+            for i in range(first, first + num_questions)
+        ],
+        "daily_romantic_message_seed": "Fake daily seed.",
+        "night_mode_message_seed": "Fake night seed.",
+    }
+
+
+BACKENDS: Dict[str, LLMBackend] = {
+    "gemini": GeminiBackend(),
+    "hf": HFBackend(),
+    "fake": FakeBackend(),
+}
+
+
+# ==============================
+#   ROUTING TABLE
+# ==============================
+
+DEFAULT_BACKEND = os.getenv("STUDYBUDDY_LLM_BACKEND", "gemini")
+
+MODEL_TIERS: Dict[str, Dict[str, str]] = {
+    "gemini": {
+        "large": os.getenv("STUDYBUDDY_MODEL_LARGE", "gemini-2.0-flash"),
+        "small": os.getenv("STUDYBUDDY_MODEL_SMALL", "gemini-2.0-flash-lite"),
+    },
+    "hf": {
+        "large": "Qwen/Qwen2-VL-2B-Instruct",
+        "small": "Qwen/Qwen2-VL-2B-Instruct",
+    },
+    "fake": {"large": "fake-large", "small": "fake-small"},
+}
+
+# task → model tier
+TASK_TIERS: Dict[str, str] = {
+    "quiz": "large",
+    "quiz_neutral": "large",
+    "quiz_guide": "large",
+    "quiz_questions": "large",
+    "feedback_batch": "large",
+    "chat": "large",
+    "feedback": "small",
+    "advice": "small",
+    "daily": "small",
+    "night": "small",
+    "gods": "small",
+    "message_batch": "small",
+    "chat_summary": "small",
+    "quiz_style": "small",
+}
+
+# Qwen2-VL generation limits per task (the HF endpoint needs explicit max_tokens)
+HF_MAX_TOKENS: Dict[str, int] = {
+    "quiz": 4096, "quiz_neutral": 4096, "quiz_guide": 2048, "quiz_questions": 2048,
+    "feedback_batch": 4096,
+    "quiz_style": 2048, "message_batch": 2048,
+    "feedback": 700, "advice": 700, "daily": 512, "night": 512,
+}
+HF_TEMPERATURES: Dict[str, float] = {"feedback": 0.85}
+
+_backend_override: ContextVar[Optional[str]] = ContextVar("llm_backend_override", default=None)
+
+
+@contextmanager
+def use_backend(name: str):
+    """Temporarily route every task to one backend (e.g. "hf" or "fake")."""
+    token = _backend_override.set(name)
+    try:
+        yield
+    finally:
+        _backend_override.reset(token)
+
+
+def route(task: str) -> Tuple[LLMBackend, str]:
+    """
+    Returns (backend, model) for a task. Per-task overrides:
+      STUDYBUDDY_BACKEND_<TASK>=gemini|hf|fake
+      STUDYBUDDY_MODEL_<TASK>=<model name>
+    """
+    env_task = task.upper()
+    backend_name = (
+        _backend_override.get()
+        or os.getenv(f"STUDYBUDDY_BACKEND_{env_task}")
+        or DEFAULT_BACKEND
+    )
+    tier = TASK_TIERS.get(task, "large")
+    model = os.getenv(f"STUDYBUDDY_MODEL_{env_task}") or MODEL_TIERS[backend_name][tier]
+    return BACKENDS[backend_name], model
+
+
+def gemini_model(task: str) -> str:
+    """Gemini model for a task, for callers that use the client directly (Batch API)."""
+    return (
+        os.getenv(f"STUDYBUDDY_MODEL_{task.upper()}")
+        or MODEL_TIERS["gemini"][TASK_TIERS.get(task, "large")]
+    )
+
+
+def route_table() -> Dict[str, str]:
+    table = {}
+    for task in TASK_TIERS:
+        backend, model = route(task)
+        table[task] = f"{backend.name}:{model}"
+    return table
+
+
+# ==============================
+#   CIRCUIT BREAKER
+# ==============================
+
+class LLMUnavailable(RuntimeError):
+    """Raised instead of calling a backend whose circuit is open."""
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures. An interactive
+    call slower than `slow_seconds` counts as a failure too. While open, calls fail
+    fast and a background probe retries the backend every `cooldown`
+    seconds (doubling up to `max_cooldown`) until it answers, then closes.
+    """
+
+    PROBE_PROMPT = "Reply with the single word OK."
+
+    def __init__(self, backend: LLMBackend, failure_threshold: int = 3,
+                 slow_seconds: float = 25.0, cooldown: float = 15.0,
+                 max_cooldown: float = 120.0):
+        self.backend = backend
+        self.failure_threshold = failure_threshold
+        self.slow_seconds = slow_seconds
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def allow(self) -> bool:
+        return not self.is_open
+
+    def record(self, ok: bool, seconds: float = 0.0):
+        if ok and seconds > self.slow_seconds:
+            ok = False
+            metrics.incr(f"llm.breaker.{self.backend.name}.slow")
+        with self._lock:
+            if ok:
+                self.failures = 0
+                return
+            self.failures += 1
+            if self.is_open or self.failures < self.failure_threshold:
+                return
+            self.opened_at = time.monotonic()
+
+        metrics.incr(f"llm.breaker.{self.backend.name}.opened")
+        print(f"⚠️ LLM backend '{self.backend.name}' degraded — serving local fallbacks")
+        threading.Thread(target=self._probe_until_healthy, daemon=True,
+                         name=f"llm-probe-{self.backend.name}").start()
+
+    def _probe_until_healthy(self):
+        wait_s = self.cooldown
+        model = MODEL_TIERS[self.backend.name]["small"]
+        while True:
+            time.sleep(wait_s)
+            metrics.incr(f"llm.breaker.{self.backend.name}.probes")
+            start = time.perf_counter()
+            try:
+                self.backend.generate(self.PROBE_PROMPT, model, "probe")
+                if time.perf_counter() - start <= self.slow_seconds:
+                    break
+            except Exception as e:
+                print(f"⚠️ LLM probe for '{self.backend.name}' failed:", e)
+            wait_s = min(wait_s * 2, self.max_cooldown)
+
+        with self._lock:
+            metrics.observe(f"llm.breaker.{self.backend.name}.open_seconds",
+                            time.monotonic() - self.opened_at)
+            self.failures = 0
+            self.opened_at = None
+        print(f"✅ LLM backend '{self.backend.name}' recovered")
+
+
+BREAKERS: Dict[str, CircuitBreaker] = {
+    name: CircuitBreaker(
+        backend,
+        failure_threshold=int(os.getenv("STUDYBUDDY_BREAKER_FAILURES", "3")),
+        slow_seconds=float(os.getenv("STUDYBUDDY_BREAKER_SLOW_SECONDS", "25")),
+        cooldown=float(os.getenv("STUDYBUDDY_BREAKER_COOLDOWN", "15")),
+    )
+    for name, backend in BACKENDS.items()
+}
+
+
+def is_degraded(task: str = "feedback") -> bool:
+    """True while the backend this task routes to has an open circuit."""
+    backend, _ = route(task)
+    return BREAKERS[backend.name].is_open
+
+
+def _check_breaker(task: str, backend: LLMBackend) -> CircuitBreaker:
+    breaker = BREAKERS[backend.name]
+    if not breaker.allow():
+        metrics.incr(f"llm.{task}.rejected")
+        raise LLMUnavailable(f"LLM backend '{backend.name}' is degraded")
+    return breaker
+
+
+# ==============================
+#   HEDGING + TIMEOUTS
+# ==============================
+
+# Interactive tasks (a student is waiting on them) get a hard timeout and
+# a hedge: if the first attempt is slower than the task's recent
+# HEDGE_PERCENTILE latency, an identical second request is sent and the
+# first reply wins. Each attempt's own latency is kept under
+# llm.<task>.attempt so hedging never skews its own deadline.
+# No hedge is sent while every hedge worker is busy or the backend's
+# circuit is open — a duplicate would only queue or fail.
+HEDGE_TASKS = {
+    t.strip() for t in os.getenv("STUDYBUDDY_HEDGE_TASKS", "feedback,chat").split(",") if t.strip()
+}
+HEDGE_PERCENTILE = float(os.getenv("STUDYBUDDY_HEDGE_PERCENTILE", "90"))
+HEDGE_MIN_SAMPLES = 20
+HEDGE_DEFAULT_DEADLINE = float(os.getenv("STUDYBUDDY_HEDGE_DEADLINE", "4"))  # until enough samples
+HEDGE_MIN_DEADLINE = 0.5
+
+HEDGE_WORKERS = int(os.getenv("STUDYBUDDY_HEDGE_WORKERS", "16"))
+# Longest wait for the next chunk of a hedged stream
+STREAM_CHUNK_TIMEOUT = float(os.getenv("STUDYBUDDY_STREAM_CHUNK_TIMEOUT", "10"))
+
+TIMEOUTS: Dict[str, float] = {"feedback": 20.0, "chat": 30.0}
+
+_HEDGE_EXECUTOR = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="llm-hedge")
+_attempts_running = 0
+_attempts_lock = threading.Lock()
+
+
+def _submit(fn, *args) -> Future:
+    """Runs one attempt on the hedge pool, counted until it finishes."""
+    global _attempts_running
+    with _attempts_lock:
+        _attempts_running += 1
+    future = _HEDGE_EXECUTOR.submit(fn, *args)
+    future.add_done_callback(_attempt_finished)
+    return future
+
+
+def _attempt_finished(_future: Future):
+    global _attempts_running
+    with _attempts_lock:
+        _attempts_running -= 1
+
+
+def pool_saturated() -> bool:
+    """True while every hedge worker is busy (a hedge would only queue)."""
+    with _attempts_lock:
+        return _attempts_running >= HEDGE_WORKERS
+
+
+def hedge_deadline(task: str, series: str = "attempt") -> float:
+    """Seconds to wait for the first attempt before sending a hedge."""
+    name = f"llm.{task}.{series}"
+    if metrics.count(name) < HEDGE_MIN_SAMPLES:
+        return HEDGE_DEFAULT_DEADLINE
+    return max(HEDGE_MIN_DEADLINE, metrics.percentile(name, HEDGE_PERCENTILE))
+
+
+def call_timeout(task: str) -> Optional[float]:
+    """Hard timeout for a task (STUDYBUDDY_LLM_TIMEOUT_<TASK>), None if unbounded."""
+    raw = os.getenv(f"STUDYBUDDY_LLM_TIMEOUT_{task.upper()}")
+    return float(raw) if raw else TIMEOUTS.get(task)
+
+
+def _timed_attempt(name: str, fn, *args):
+    start = time.perf_counter()
+    try:
+        return fn(*args)
+    finally:
+        metrics.observe(name, time.perf_counter() - start)
+
+
+def _next_chunk(chunks: Iterator[str]) -> Optional[str]:
+    return next(chunks, None)
+
+
+def _close(chunks: Iterator[str]):
+    close = getattr(chunks, "close", None)
+    if close is not None:
+        try:
+            close()
+        except Exception as e:
+            print("⚠️ Could not close LLM stream:", e)
+
+
+def _close_when_done(future: Future, chunks: Iterator[str]):
+    """Drops a stream nobody will read, once its worker (if any) lets go of it."""
+    future.cancel()
+    future.add_done_callback(lambda _: _close(chunks))
+
+
+def _follow(task: str, chunks: Iterator[str], first: Future) -> Iterator[str]:
+    """
+    The rest of a stream whose first chunk came from `first`. Each later
+    chunk is read on the hedge pool and must arrive within
+    STREAM_CHUNK_TIMEOUT, so a stalled stream can't hold the caller.
+    """
+    future = first
+    try:
+        while True:
+            done, _ = wait([future], timeout=STREAM_CHUNK_TIMEOUT)
+            if not done:
+                metrics.incr(f"llm.{task}.timeouts")
+                raise TimeoutError(
+                    f"LLM task '{task}' stream stalled for {STREAM_CHUNK_TIMEOUT:g}s"
+                )
+            chunk = future.result()
+            if chunk is None:
+                return
+            yield chunk
+            future = _submit(_next_chunk, chunks)
+    finally:
+        _close_when_done(future, chunks)
+
+
+def _hedged(task: str, submit_attempt, series: str = "attempt",
+            breaker: Optional["CircuitBreaker"] = None):
+    """
+    Runs submit_attempt() (→ Future) and, if it misses the hedge deadline
+    (or fails fast), a second one — unless the pool is saturated or the
+    breaker has opened. Returns (winning future, attempt index); raises
+    TimeoutError past the hard timeout, or the first error if every
+    attempt failed. Attempts that haven't started when it returns are
+    cancelled.
+    """
+    start = time.perf_counter()
+    timeout = call_timeout(task)
+    deadline = hedge_deadline(task, series)
+    if timeout is not None:
+        deadline = min(deadline, timeout)
+
+    pending = [submit_attempt()]
+    done, _ = wait(pending, timeout=deadline)
+    failed = bool(done) and pending[0].exception() is not None
+
+    if not done or failed:
+        if pool_saturated() or (breaker is not None and breaker.is_open):
+            metrics.incr(f"llm.{task}.hedge_skipped")
+        else:
+            # Slow (or failed fast): one duplicate, first good reply wins
+            metrics.incr(f"llm.{task}.hedged")
+            pending.append(submit_attempt())
+
+    errors = []
+    remaining = set(pending)
+    while remaining:
+        left = None if timeout is None else timeout - (time.perf_counter() - start)
+        if left is not None and left <= 0:
+            break
+        done, _ = wait(remaining, timeout=left, return_when=FIRST_COMPLETED)
+        if not done:
+            break
+        for future in done:
+            remaining.discard(future)
+            if future.exception() is None:
+                index = pending.index(future)
+                if index:
+                    metrics.incr(f"llm.{task}.hedge_won")
+                for other in remaining:
+                    other.cancel()
+                return future, index
+            errors.append(future.exception())
+
+    for other in remaining:
+        other.cancel()
+    if errors and not remaining:
+        raise errors[0]
+    metrics.incr(f"llm.{task}.timeouts")
+    raise TimeoutError(f"LLM task '{task}' timed out after {timeout:g}s")
+
+
+def hedge_report() -> Dict[str, Dict[str, Any]]:
+    """Per hedged task: hedge rate, wins, timeouts and p99 with vs without hedging."""
+    snap = metrics.snapshot()["counters"]
+    report = {}
+    for task in sorted(HEDGE_TASKS):
+        calls = snap.get(f"llm.{task}.calls", 0)
+        if not calls:
+            continue
+        report[task] = {
+            "hedge_rate": snap.get(f"llm.{task}.hedged", 0) / calls,
+            "hedge_won": snap.get(f"llm.{task}.hedge_won", 0),
+            "hedge_skipped": snap.get(f"llm.{task}.hedge_skipped", 0),
+            "timeouts": snap.get(f"llm.{task}.timeouts", 0),
+            "attempt_p99": metrics.percentile(f"llm.{task}.attempt", 99),
+            "served_p99": metrics.percentile(f"llm.{task}", 99),
+        }
+    return report
+
+
+# ==============================
+#   ENTRY POINTS
+# ==============================
+
+def generate(task: str, prompt: str, images=None) -> str:
+    """
+    Routes one generation and records its latency under llm.<task>.
+    Tasks in HEDGE_TASKS are hedged and bounded by call_timeout(task).
+    """
+    backend, model = route(task)
+    breaker = _check_breaker(task, backend)
+    metrics.incr(f"llm.{task}.calls")
+    start = time.perf_counter()
+    try:
+        with metrics.timer(f"llm.{task}"):
+            args = (f"llm.{task}.attempt", backend.generate, prompt, model, task, images)
+            if task not in HEDGE_TASKS:
+                text = _timed_attempt(*args).strip()
+            else:
+                future, _ = _hedged(task, lambda: _submit(_timed_attempt, *args), breaker=breaker)
+                text = future.result().strip()
+    except Exception:
+        metrics.incr(f"llm.{task}.errors")
+        breaker.record(False)
+        raise
+    # Only interactive tasks count slowness as failure (a quiz may take a while)
+    breaker.record(True, time.perf_counter() - start if task in HEDGE_TASKS else 0.0)
+    return text
+
+
+def stream(task: str, prompt: str) -> Iterator[str]:
+    """
+    Streams one generation; records total latency under llm.<task>.
+    For hedged tasks the hedge races on time-to-first-chunk: the first
+    stream to produce text is the one that is followed to the end, each
+    chunk within STREAM_CHUNK_TIMEOUT; the losing stream is closed.
+    """
+    backend, model = route(task)
+    breaker = _check_breaker(task, backend)
+    metrics.incr(f"llm.{task}.calls")
+    start = time.perf_counter()
+    try:
+        if task not in HEDGE_TASKS:
+            yield from backend.stream(prompt, model, task)
+            breaker.record(True)
+            return
+
+        attempts = []  # (first-chunk future, stream)
+
+        def submit_attempt():
+            chunks = backend.stream(prompt, model, task)
+            future = _submit(_timed_attempt, f"llm.{task}.ttfc", _next_chunk, chunks)
+            attempts.append((future, chunks))
+            return future
+
+        index = None
+        try:
+            _, index = _hedged(task, submit_attempt, series="ttfc", breaker=breaker)
+        finally:
+            for i, (future, chunks) in enumerate(attempts):
+                if i != index:
+                    _close_when_done(future, chunks)
+        yield from _follow(task, attempts[index][1], attempts[index][0])
+        breaker.record(True)
+    except Exception:
+        metrics.incr(f"llm.{task}.errors")
+        breaker.record(False)
+        raise
+    finally:
+        metrics.observe(f"llm.{task}", time.perf_counter() - start)
@@ -0,0 +1,196 @@
+"""
+Pre-generated pools for the daily, night and God's messages.
+
+Pool key: (kind, gender, country, seed). The seed is persona-neutral
+(pool_seed: the document's key topics, not the per-learner styled seed
+ideas), so every learner of the same gender and country studying the
+same document shares a pool. Messages are generated in bulk
+(generate_message_batch) and served instantly; each user never gets the
+same pooled message twice. When a user has few unseen messages left, the
+pool is refilled on a background thread.
+
+prewarm only records which pools a new quiz will need; warm() fills them
+later, from a scheduled job when the bot is idle, so prewarming never
+competes with quiz and feedback generation.
+
+Both the pools and the per-user "seen" sets are LRU-bounded: new documents
+bring new seeds, so old pools and their seen sets age out.
+"""
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Set, Tuple
+
+import metrics
+from query_pdf import generate_message_batch, POOL_NAME_TOKEN
+
+SEED_FIELDS = {
+    "daily": "daily_romantic_message_seed",
+    "night": "night_mode_message_seed",
+    "gods": None,
+}
+
+PoolKey = Tuple[str, str, str, str]
+
+# Key topics that make up a pool seed
+SEED_TOPICS = 3
+
+
+def pool_seed(quiz_data: Optional[Dict[str, Any]]) -> str:
+    """The document's first key topics: the same for every learner, whatever the persona."""
+    topics = ((quiz_data or {}).get("study_guide") or {}).get("key_topics") or []
+    return ", ".join(str(t).strip() for t in topics[:SEED_TOPICS]).lower()
+
+
+def seed_quiz(kind: str, seed: str) -> Optional[Dict[str, Any]]:
+    """A pool seed in the quiz_data shape the message prompt builders read."""
+    field = SEED_FIELDS[kind]
+    if not field or not seed:
+        return None
+    return {field: f"Today's study topics: {seed}"}
+
+
+def pool_key(kind: str, user_info: Dict[str, Any], seed: str = "") -> PoolKey:
+    gender = (user_info.get("gender") or "female").lower()
+    seed = seed if SEED_FIELDS[kind] else ""
+    # God's messages only depend on gender
+    country = "" if kind == "gods" else (user_info.get("country") or "default").strip().lower()
+    return (kind, gender, country, seed)
+
+
+class MessagePool:
+    def __init__(self, batch_size: int = 8, low_water: int = 2, max_size: int = 64,
+                 max_pools: int = 256, max_seen: int = 10000):
+        """
+        batch_size: messages generated per bulk call
+        low_water:  refill when a user has this many unseen messages or fewer
+        max_size:   messages kept per pool (oldest dropped first)
+        max_pools:  pools kept (least recently used dropped first)
+        max_seen:   (user, pool) seen-sets kept (least recently used dropped first)
+        """
+        self.batch_size = batch_size
+        self.low_water = low_water
+        self.max_size = max_size
+        self.max_pools = max_pools
+        self.max_seen = max_seen
+
+        self._pools: "OrderedDict[PoolKey, List[str]]" = OrderedDict()
+        self._seen: "OrderedDict[Tuple[Any, PoolKey], Set[str]]" = OrderedDict()
+        self._refilling: Set[PoolKey] = set()
+        self._wanted: "OrderedDict[PoolKey, Tuple[Dict[str, Any], str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2)
+
+    def get(self, kind: str, user_info: Dict[str, Any], seed: str,
+            user_id: Any) -> Optional[str]:
+        """
+        Returns an unseen pooled message for this user (name filled in),
+        or None on a miss. Schedules a background refill when running low.
+        """
+        key = pool_key(kind, user_info, seed)
+
+        with self._lock:
+            pool = self._pools.get(key, [])
+            if pool:
+                self._pools.move_to_end(key)
+            # only messages still in the pool matter, so a seen-set never outgrows it
+            seen = self._seen.pop((user_id, key), set()).intersection(pool)
+            self._seen[(user_id, key)] = seen
+            while len(self._seen) > self.max_seen:
+                self._seen.popitem(last=False)
+
+            unseen = [m for m in pool if m not in seen]
+            message = unseen[0] if unseen else None
+            if message:
+                seen.add(message)
+
+        if len(unseen) - 1 <= self.low_water:
+            self.refill_async(kind, user_info, seed)
+
+        if message is None:
+            metrics.incr("message_pool.miss")
+            return None
+
+        metrics.incr("message_pool.hit")
+        return message.replace(POOL_NAME_TOKEN, user_info.get("name") or "Sweetheart")
+
+    def add(self, key: PoolKey, messages: List[str]):
+        with self._lock:
+            pool = self._pools.setdefault(key, [])
+            self._pools.move_to_end(key)
+            pool.extend(m for m in messages if m not in pool)
+            del pool[:-self.max_size]
+            while len(self._pools) > self.max_pools:
+                self._pools.popitem(last=False)
+
+    def refill(self, kind: str, user_info: Dict[str, Any], seed: str = ""):
+        """Blocking bulk refill of one pool."""
+        key = pool_key(kind, user_info, seed)
+        try:
+            with metrics.timer("message_pool.refill"):
+                messages = generate_message_batch(kind, user_info, seed_quiz(kind, seed), self.batch_size)
+            self.add(key, messages)
+        except Exception as e:
+            print(f"⚠️ Message pool refill failed for {kind}:", e)
+        finally:
+            with self._lock:
+                self._refilling.discard(key)
+
+    def refill_async(self, kind: str, user_info: Dict[str, Any], seed: str = "") -> bool:
+        key = pool_key(kind, user_info, seed)
+        with self._lock:
+            if key in self._refilling:
+                return False
+            self._refilling.add(key)
+        self._executor.submit(self.refill, kind, dict(user_info), seed)
+        return True
+
+    def prewarm(self, user_info: Dict[str, Any], seed: str = ""):
+        """
+        Records that a new quiz will need all three pools for this
+        gender/country/seed. Nothing is generated here: warm() fills them
+        later, off the post-quiz peak.
+        """
+        with self._lock:
+            for kind in SEED_FIELDS:
+                key = pool_key(kind, user_info, seed)
+                self._wanted[key] = ({"gender": key[1], "country": key[2]}, seed)
+                self._wanted.move_to_end(key)
+                while len(self._wanted) > self.max_pools:
+                    self._wanted.popitem(last=False)
+
+    def warm(self, limit: int = 3) -> int:
+        """
+        Starts background refills for up to `limit` wanted pools that are
+        still short (most recently wanted first). Returns how many started.
+        """
+        started = 0
+        while started < limit:
+            with self._lock:
+                if not self._wanted:
+                    break
+                key, (user_info, seed) = self._wanted.popitem()
+                if len(self._pools.get(key, [])) >= self.batch_size:
+                    continue
+            if self.refill_async(key[0], user_info, seed):
+                started += 1
+        if started:
+            metrics.incr("message_pool.warmed", started)
+        return started
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "pools": len(self._pools),
+                "messages": sum(len(p) for p in self._pools.values()),
+                "seen_entries": len(self._seen),
+                "refilling": len(self._refilling),
+                "wanted": len(self._wanted),
+            }
+
+
+MESSAGE_POOL = MessagePool(
+    batch_size=int(os.getenv("STUDYBUDDY_MESSAGE_BATCH", "8")),
+    max_seen=int(os.getenv("STUDYBUDDY_MESSAGE_POOL_SEEN", "10000")),
+)
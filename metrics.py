@@ -0,0 +1,89 @@
+"""
+Tiny in-process metrics shared by the bot and the Streamlit app:
+  - counters   (incr)
+  - latencies  (observe / timer), kept as a rolling window per name
+"""
+import time
+import threading
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from typing import Dict, Any, Optional
+
+_LOCK = threading.Lock()
+_WINDOW = 500
+
+COUNTERS: Dict[str, int] = defaultdict(int)
+TIMINGS: Dict[str, deque] = defaultdict(lambda: deque(maxlen=_WINDOW))
+
+
+def incr(name: str, n: int = 1):
+    with _LOCK:
+        COUNTERS[name] += n
+
+
+def observe(name: str, seconds: float):
+    with _LOCK:
+        TIMINGS[name].append(seconds)
+
+
+@contextmanager
+def timer(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+
+def count(name: str) -> int:
+    with _LOCK:
+        return len(TIMINGS.get(name, ()))
+
+
+def _percentile(samples: list, p: float) -> Optional[float]:
+    """p-th percentile (0–100) of already sorted samples, or None."""
+    if not samples:
+        return None
+    idx = min(len(samples) - 1, int(round(p / 100 * (len(samples) - 1))))
+    return samples[idx]
+
+
+def percentile(name: str, p: float) -> Optional[float]:
+    """Returns the p-th percentile (0–100) of recent samples, or None."""
+    with _LOCK:
+        samples = sorted(TIMINGS.get(name, ()))
+    return _percentile(samples, p)
+
+
+def ratio(part: str, *others: str) -> float:
+    """part / (part + others), e.g. ratio("cache.hit", "cache.miss")."""
+    with _LOCK:
+        num = COUNTERS.get(part, 0)
+        total = num + sum(COUNTERS.get(o, 0) for o in others)
+    return num / total if total else 0.0
+
+
+def snapshot() -> Dict[str, Any]:
+    # copy everything under the lock; sorting happens outside it
+    with _LOCK:
+        counters = dict(COUNTERS)
+        windows = {name: list(samples) for name, samples in TIMINGS.items()}
+    timings = {}
+    for name, samples in windows.items():
+        samples.sort()
+        timings[name] = {
+            "count": len(samples),
+            "p50": _percentile(samples, 50),
+            "p95": _percentile(samples, 95),
+        }
+    return {"counters": counters, "timings": timings}
+
+
+def format_report() -> str:
+    snap = snapshot()
+    lines = ["📊 Stats"]
+    for name, value in sorted(snap["counters"].items()):
+        lines.append(f"- {name}: {value}")
+    for name, t in sorted(snap["timings"].items()):
+        lines.append(f"- {name}: n={t['count']} p50={t['p50']:.2f}s p95={t['p95']:.2f}s")
+    return "\n".join(lines)
@@ -1,30 +1,23 @@
 import os
 import json
-from typing import List, Dict, Any, Optional
-import os
-from google.genai import Client
+import time
+import random
+import hashlib
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+from typing import Callable, List, Dict, Any, Optional, Sequence
 from dotenv import load_dotenv
 load_dotenv()
 
-client = Client(api_key=os.getenv("GEMINI_API_KEY"))
-
-from PyPDF2 import PdfReader
-from google import genai
-
-
-# ==============================
-#   GEMINI CLIENT HELPER
-# ==============================
-
-def get_client() -> genai.Client:
-    """
-    Returns a configured Gemini client using GEMINI_API_KEY
-    from environment variables.
-    """
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        raise RuntimeError("GEMINI_API_KEY is missing in environment variables.")
-    return genai.Client(api_key=api_key)
+# google.genai and PyPDF2 are imported lazily (first request, not import time)
+# to keep bot / Streamlit cold start fast. All LLM calls go through
+# llm_backend, which routes each task type to a backend + model tier.
+import llm_backend as llm
+import metrics
+from answer_balance import balance_answer_keys
+from answer_cache import normalize_question
+from llm_backend import get_client  # re-exported for existing callers
 
 
 # ==============================
@@ -35,6 +28,8 @@ def extract_text_from_pdf(file) -> str:
     """
     Extracts plain text from an uploaded PDF file-like object.
     """
+    from PyPDF2 import PdfReader
+
     reader = PdfReader(file)
     text = ""
     for page in reader.pages:
@@ -42,14 +37,185 @@ def extract_text_from_pdf(file) -> str:
     return text.strip()
 
 
+def document_hash(data: bytes) -> str:
+    """
+    Stable content hash of an uploaded document (used as cache key).
+    """
+    return hashlib.sha256(bytes(data)).hexdigest()
+
+
+# ==============================
+#   TOKEN ESTIMATE
+# ==============================
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough token count (~4 characters per token for English prose).
+    Good enough to compare prompt/output sizes without a tokenizer.
+    """
+    return max(1, len(text) // 4) if text else 0
+
+
 # ==============================
 #   CORE QUIZ GENERATION
 # ==============================
 
+# Lean mode: the quiz call does NOT write per-question feedback scripts.
+# Feedback is generated on demand anyway, so tone references come from
+# the local phrase bank below instead of 51 extra generated texts.
+LEAN_QUIZ = os.getenv("STUDYBUDDY_LEAN_QUIZ", "1") != "0"
+
+_FEEDBACK_SCRIPT_FIELDS = """
+      "correct_feedback_script": "Persona-style feedback if user selected the correct answer. MUST include: 'Your answer: X', 'Correct answer: Y', and then a romantic/sarcastic emotional reaction plus a short academic explanation.",
+      "incorrect_feedback_script": "Persona-style feedback if user selected an incorrect option. MUST include: 'Your answer: X', 'Correct answer: Y', then a comforting (girl) or roasting (boy) reaction, and then a simple academic explanation.",
+      "pass_feedback_script": "Persona-style feedback if user chose Pass (E). Gentle romantic reassurance for girls, mocking but safe sarcasm for boys. Also briefly mention what the correct idea was.",
+"""
+
+_FEEDBACK_SCRIPT_RULE = """- In feedback scripts ALWAYS mention what the learner chose and what was actually correct.
+"""
+
+
+# ==============================
+#   TONE REFERENCE PHRASE BANK
+# ==============================
+
+# Short "base emotion" lines used as tone references for
+# generate_dynamic_feedback when the quiz has no feedback scripts.
+TONE_PHRASE_BANK: Dict[str, Dict[str, List[str]]] = {
+    "female": {
+        "correct": [
+            "Baby you got it! I'm so proud my heart is doing somersaults 🥺💗",
+            "My clever angel… you make studying look so easy, I'm melting.",
+            "Sweetheart that was perfect, I knew my genius would get it ✨",
+            "Look at you shining, my love! I'm clapping like a proud fool 💕",
+        ],
+        "incorrect": [
+            "Aww my love, come here… it's okay, we'll fix this together.",
+            "Don't be sad baby, you were so close and I'm still proud of you.",
+            "Shh, no stress angel, one mistake doesn't change how brilliant you are.",
+            "My heart, every wrong answer just means we learn it deeper together 💗",
+        ],
+        "pass": [
+            "It's okay to skip, sweetheart. Your comfort matters more than perfection.",
+            "No pressure my love, we'll learn this one slowly together.",
+            "Skipping is fine, angel. I'll explain it softly for you 💕",
+        ],
+    },
+    "male": {
+        "correct": [
+            "Oh wow, your brain actually worked. Mark the calendar.",
+            "Correct. Don't let it go to your head, there's not much room up there.",
+            "Fine, you got it. Even a broken clock is right twice a day.",
+            "Look at that, a right answer. I'm shocked, honestly.",
+        ],
+        "incorrect": [
+            "Wrong. Of course it's wrong. Why am I even surprised?",
+            "Did you read the question or just vibe with the letters?",
+            "Incredible. Confidently incorrect, as always.",
+            "Nope. Try opening the PDF instead of staring at it.",
+        ],
+        "pass": [
+            "Skipping? Brave. Lazy, but brave.",
+            "Running away from a question. Classic you.",
+            "Pass again? At least you're consistent at something.",
+        ],
+    },
+}
+
+
+def get_tone_reference(user_info: Dict[str, Any], result_type: str) -> str:
+    """
+    Picks a random base-emotion line for the persona and result type
+    ("correct", "incorrect" or "pass") from the local phrase bank.
+    """
+    gender = user_info.get("gender", "female").lower()
+    bank = TONE_PHRASE_BANK.get(gender, TONE_PHRASE_BANK["female"])
+    return random.choice(bank.get(result_type, bank["correct"]))
+
+
+# ==============================
+#   PROMPT VARIANTS
+# ==============================
+
+# "verbose" = the original long prompts, "compact" = same rules, fewer tokens.
+# Compare them with `python bench.py prompt-size --latency`.
+PROMPT_VARIANT = os.getenv("STUDYBUDDY_PROMPT_VARIANT", "verbose")
+PROMPT_VARIANTS = ("verbose", "compact")
+
+_prompt_variant_override: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("prompt_variant", default=None)
+
+
+@contextmanager
+def use_prompt_variant(name: str):
+    """Temporarily render prompts with another variant (benchmarks)."""
+    token = _prompt_variant_override.set(name)
+    try:
+        yield
+    finally:
+        _prompt_variant_override.reset(token)
+
+
+def prompt_variant() -> str:
+    return _prompt_variant_override.get() or PROMPT_VARIANT
+
+
+# ==============================
+#   PROGRESS REPORTING
+# ==============================
+
+# Set by whoever runs a long generation (quiz_jobs) to hear about its stages;
+# copied into fan-out workers with the rest of the context.
+_progress_hook: contextvars.ContextVar[Optional[Callable[..., None]]] = contextvars.ContextVar("progress", default=None)
+
+
+@contextmanager
+def use_progress(hook: Callable[..., None]):
+    """hook(stage, **info) is called for every report_progress() inside the block."""
+    token = _progress_hook.set(hook)
+    try:
+        yield
+    finally:
+        _progress_hook.reset(token)
+
+
+def report_progress(stage: str, **info):
+    hook = _progress_hook.get()
+    if hook is not None:
+        try:
+            hook(stage, **info)
+        except Exception as e:
+            print("⚠️ Progress hook failed:", e)
+
+
+def _build_compact_persona_block(user_info: Dict[str, Any]) -> str:
+    name = user_info.get("name", "Sweetheart")
+    country = user_info.get("country", "default")
+
+    if user_info.get("gender", "female").lower() == "female":
+        return f"""
+You are {name}'s loving, playful, dramatic boyfriend; she is from {country}.
+- Warm, protective, clingy, romantic — NEVER sexual, explicit, vulgar or insulting.
+- Cute nicknames (baby, angel, my love…). Sometimes one safe romantic word from her
+  local language ({country}) with its English meaning in parentheses. Mostly English.
+- Romance grows with the question number (1 → 17). Invent new lines, never copy examples.
+- Correct: proud, dramatic praise. Wrong: comfort, never shame. Pass (E): gentle reassurance.
+"""
+    return f"""
+You are {name}'s sarcastic, annoyed ex-girlfriend; he is from {country}.
+- Savage, eye-rolling, mocking but SAFE: no slurs, hate, sexual content or encouraging harm.
+- Never reuse a line; improvise fresh sarcasm. Occasionally one slang word from {country}, explained.
+- Harshness grows with the question number (1 → 17).
+- Correct: minimal, mocking praise. Wrong: roast, but explain. Pass (E): mock the skip.
+"""
+
+
 def _build_persona_block(user_info: Dict[str, Any]) -> str:
     """
     Builds a persona block based on gender for the main prompt.
     """
+    if prompt_variant() == "compact":
+        return _build_compact_persona_block(user_info)
+
     gender = user_info.get("gender", "female").lower()
     name = user_info.get("name", "Sweetheart")
     country = user_info.get("country", "default")
@@ -201,20 +367,46 @@ NEVER:
 """
 
 
-def generate_quiz_data(pdf_text: str, user_info: Dict[str, Any]) -> Dict[str, Any]:
+_DIFFICULTY_RULES = """Difficulty Levels (MANDATORY):
+
+- Questions 1–5 → EASY  
+  • Require basic recall and simple understanding  
+  • Direct facts, definitions, straightforward concepts  
+
+- Questions 6–10 → MEDIUM  
+  • Require interpretation, application, or moderate reasoning  
+  • Slightly tricky distractors  
+  • Multi-step understanding  
+
+- Questions 11–17 → HARD  
+  • Require deep reasoning, synthesis, cross-linking ideas  
+  • Situational analysis, conceptual traps, or subtle distinctions  
+  • Hard distractors that require attention  
+
+Each question must clearly reflect the intended difficulty level.
+"""
+
+_CONTENT_QUALITY_RULES = """IMPORTANT EXTRA RULES FOR CONTENT QUALITY:
+- The details explainations and study guide should be large and detailed enough that a student could 
+  understand the full picture and know what to focus on for exams.
+- Nuance notes must highlight: typical mistakes, tricky concepts, hidden assumptions, 
+  and exam-style pitfalls.
+- Everything must be tied clearly to the PDF.
+"""
+
+
+def build_quiz_prompt(pdf_text: str, user_info: Dict[str, Any],
+                      lean: Optional[bool] = None) -> str:
     """
-    Main function that:
-    - Reads the PDF content
-    - Generates:
-      - sweet_summary (romantic or sarcastic)
-      - study_guide: topics, nuance notes, exam-important hints
-      - MCQ questions with boyfriend/ex feedback scripts
-      - focus_if_wrong notes per question
-      - seeds for daily romantic message & night mode messages
+    Builds the main quiz-generation prompt.
+    In lean mode the per-question feedback script fields are left out.
     """
-    client = get_client()
+    if lean is None:
+        lean = LEAN_QUIZ
 
     persona_block = _build_persona_block(user_info)
+    feedback_fields = "" if lean else _FEEDBACK_SCRIPT_FIELDS
+    feedback_rule = "" if lean else _FEEDBACK_SCRIPT_RULE
 
     name = user_info.get("name", "Sweetheart")
     country = user_info.get("country", "default")
@@ -232,13 +424,7 @@ PDF CONTENT:
 
 Your task is to output STRICT JSON with the following structure ONLY:
 
-IMPORTANT EXTRA RULES FOR CONTENT QUALITY:
-- The details explainations and study guide should be large and detailed enough that a student could 
-  understand the full picture and know what to focus on for exams.
-- Nuance notes must highlight: typical mistakes, tricky concepts, hidden assumptions, 
-  and exam-style pitfalls.
-- Everything must be tied clearly to the PDF.
-
+{_CONTENT_QUALITY_RULES}
 STRUCTURE (MUST MATCH EXACTLY THESE KEYS):
 
 {{
@@ -269,11 +455,7 @@ STRUCTURE (MUST MATCH EXACTLY THESE KEYS):
         "E": "Pass"
       }},
       "correct_answer_key": "A",
-
-      "correct_feedback_script": "Persona-style feedback if user selected the correct answer. MUST include: 'Your answer: X', 'Correct answer: Y', and then a romantic/sarcastic emotional reaction plus a short academic explanation.",
-      "incorrect_feedback_script": "Persona-style feedback if user selected an incorrect option. MUST include: 'Your answer: X', 'Correct answer: Y', then a comforting (girl) or roasting (boy) reaction, and then a simple academic explanation.",
-      "pass_feedback_script": "Persona-style feedback if user chose Pass (E). Gentle romantic reassurance for girls, mocking but safe sarcasm for boys. Also briefly mention what the correct idea was.",
-
+{feedback_fields}
       "focus_if_wrong": "If the learner gets this question wrong, what EXACT topic or concept should they review from the PDF and why? Short and clear, exam-focused.",
 
       "romance_level": 1
@@ -290,48 +472,43 @@ Rules:
 - For girls: increase romance_level with each question (more emotional, more clingy, more dramatic boyfriend).
 - For boys: increase harshness with each question (more sarcastic, more "done with this", but still SAFE).
 - "focus_if_wrong" must directly reference a real concept, section, or idea implied by the PDF content.
-- In feedback scripts ALWAYS mention what the learner chose and what was actually correct.
-- Output MUST be valid JSON only. No markdown, no commentary, no ``` fences.
+{feedback_rule}- Output MUST be valid JSON only. No markdown, no commentary, no ``` fences.
 
-IMPORTANT ― ANSWER DISTRIBUTION RULES (MANDATORY):
-- You MUST distribute correct answers RANDOMLY across A, B, C, and D.
-- You MUST avoid repeating the same correct_answer_key more than 2 times in a row.
-- The final set of 17 questions MUST include:
-    * Minimum 3 correct answers = "A"
-    * Minimum 3 correct answers = "B"
-    * Minimum 3 correct answers = "C"
-    * Minimum 3 correct answers = "D"
-- The remaining answers (17 - 12 = 5) may be ANY of A/B/C/D.
-- NEVER default to one letter (like B or C). No clustering. No patterns.
-- The distribution MUST look naturally random.
+{_DIFFICULTY_RULES}
 
-Difficulty Levels (MANDATORY):
+    """
 
-- Questions 1–5 → EASY  
-  • Require basic recall and simple understanding  
-  • Direct facts, definitions, straightforward concepts  
+    return prompt
 
-- Questions 6–10 → MEDIUM  
-  • Require interpretation, application, or moderate reasoning  
-  • Slightly tricky distractors  
-  • Multi-step understanding  
 
-- Questions 11–17 → HARD  
-  • Require deep reasoning, synthesis, cross-linking ideas  
-  • Situational analysis, conceptual traps, or subtle distinctions  
-  • Hard distractors that require attention  
+def generate_quiz_data(pdf_text: str, user_info: Dict[str, Any],
+                       lean: Optional[bool] = None, images=None) -> Dict[str, Any]:
+    """
+    Main function that:
+    - Reads the PDF content
+    - Generates:
+      - sweet_summary (romantic or sarcastic)
+      - study_guide: topics, nuance notes, exam-important hints
+      - MCQ questions (with boyfriend/ex feedback scripts unless lean)
+      - focus_if_wrong notes per question
+      - seeds for daily romantic message & night mode messages
 
-Each question must clearly reflect the intended difficulty level.
+    `images` (page images) are only used by multimodal backends (HF Qwen2-VL).
+    """
+    prompt = build_quiz_prompt(pdf_text, user_info, lean=lean)
 
+    response = llm.generate("quiz", prompt, images=images)
 
-    """
+    quiz_data = _parse_json_response(response)
+    balance_answer_keys(quiz_data["questions"])
+    return quiz_data
 
-    response = client.models.generate_content(
-        model="gemini-2.0-flash",
-        contents=prompt
-    )
 
-    raw_text = response.text.strip()
+def _parse_json_response(raw_text: str) -> Any:
+    """
+    Parses a JSON reply from the LLM backend, stripping ```json fences if present.
+    """
+    raw_text = raw_text.strip()
 
     # Clean ```json fences if model adds them
     if raw_text.startswith("```"):
@@ -340,39 +517,394 @@ Each question must clearly reflect the intended difficulty level.
             raw_text = raw_text[4:].strip()
 
     try:
-        quiz_data = json.loads(raw_text)
+        return json.loads(raw_text)
     except json.JSONDecodeError as e:
-        raise RuntimeError(f"Failed to parse JSON from Gemini: {e}\nRaw text:\n{raw_text}")
+        raise RuntimeError(f"Failed to parse JSON from the model: {e}\nRaw text:\n{raw_text}")
 
-    return quiz_data
 
 
 # ==============================
-#  POST-QUIZ FOCUS ADVICE
+#  TWO-STAGE QUIZ: NEUTRAL CONTENT + PERSONA STYLING
 # ==============================
 
-def generate_post_quiz_focus_advice(
-    user_info: Dict[str, Any],
-    wrong_focus_list: List[str]
-) -> str:
+# Stage 1 reads the document and is persona-neutral, so its output can be
+# shared by every learner of the same document (see quiz_pipeline.py).
+# Stage 2 only adds the persona voice: summary tone, question intros and
+# message seeds. It never sees the PDF, so it is small and cheap.
+
+def build_neutral_content_prompt(pdf_text: str, num_questions: int = 17) -> str:
+    """Quiz + study guide prompt with no persona (stage 1)."""
+    return f"""
+You are an expert exam tutor writing study material from a PDF.
+Write in a neutral, clear, academic voice. No persona, no greetings.
+
+PDF CONTENT:
+--- START PDF ---
+{pdf_text}
+--- END PDF ---
+
+{_CONTENT_QUALITY_RULES}
+Output STRICT JSON with EXACTLY these keys:
+
+{{
+  "summary": "A 20-30 sentence explanation of what the PDF covers, its main ideas, and why it matters for the exam.",
+  "study_guide": {{
+    "overall_advice": "High-level explanation of what this PDF is mainly about, in simple words. At least 6–10 sentences.",
+    "exam_strategy": "What to prioritize for an exam, common tricky concepts, relationships or formulas. 5–10 sentences.",
+    "key_topics": ["topic1", "topic2", "topic3"],
+    "topic_notes": [
+      {{
+        "topic": "short topic name",
+        "nuance_note": "extra nuance or tricky detail that can cause confusion in the exam.",
+        "why_important": "one sentence why this topic is important."
+      }}
+    ]
+  }},
+  "questions": [
+    {{
+      "question_text": "MCQ question on an important exam topic of the PDF. Clear, single-correct-answer.",
+      "options": {{"A": "...", "B": "...", "C": "...", "D": "...", "E": "Pass"}},
+      "correct_answer_key": "A",
+      "focus_if_wrong": "The EXACT topic or concept from the PDF to review if this is answered wrongly, and why."
+    }}
+  ]
+}}
+
+Rules:
+- Generate EXACTLY {num_questions} questions.
+- "focus_if_wrong" must directly reference a real concept, section, or idea implied by the PDF content.
+- Output MUST be valid JSON only. No markdown, no commentary, no ``` fences.
+
+{_DIFFICULTY_RULES}"""
+
+
+# ---------- fan-out: guide + one request per difficulty tier ----------
+
+# When enabled, stage 1 is split into 4 concurrent requests (study guide,
+# easy, medium, hard questions) so the wait is the slowest part, not the sum.
+QUIZ_FANOUT = os.getenv("STUDYBUDDY_QUIZ_FANOUT", "1") != "0"
+
+# (name, first question number, last question number, what the tier tests)
+QUESTION_TIERS = [
+    ("EASY", 1, 5, "basic recall and simple understanding: direct facts, definitions, straightforward concepts"),
+    ("MEDIUM", 6, 10, "interpretation, application or moderate multi-step reasoning, with slightly tricky distractors"),
+    ("HARD", 11, 17, "deep reasoning and synthesis across ideas: situational analysis, conceptual traps, subtle distinctions, hard distractors"),
+]
+
+# Follow-up requests per tier for questions lost to repeats or a short reply
+FANOUT_TOPUPS = 2
+
+# Every quiz job worker (STUDYBUDDY_QUIZ_WORKERS) can run all of its parts at
+# once; otherwise concurrent jobs queue behind each other's parts.
+FANOUT_WORKERS = int(os.getenv(
+    "STUDYBUDDY_FANOUT_WORKERS",
+    str(int(os.getenv("STUDYBUDDY_QUIZ_WORKERS", "4")) * (len(QUESTION_TIERS) + 1)),
+))
+
+_FANOUT_EXECUTOR = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix="quiz-fanout")
+
+
+def tag_question_tiers(questions: List[Dict[str, Any]]):
+    """Sets each untagged question's "tier" from its position (QUESTION_TIERS)."""
+    for number, q in enumerate(questions, start=1):
+        if not q.get("tier"):
+            q["tier"] = next(
+                (name for name, first, last, _ in QUESTION_TIERS if first <= number <= last),
+                QUESTION_TIERS[-1][0],
+            )
+
+
+def build_neutral_guide_prompt(pdf_text: str) -> str:
+    """Fan-out part: summary + study guide only."""
+    return f"""
+You are an expert exam tutor writing study material from a PDF.
+Write in a neutral, clear, academic voice. No persona, no greetings.
+
+PDF CONTENT:
+--- START PDF ---
+{pdf_text}
+--- END PDF ---
+
+{_CONTENT_QUALITY_RULES}
+Output STRICT JSON with EXACTLY these keys:
+
+{{
+  "summary": "A 20-30 sentence explanation of what the PDF covers, its main ideas, and why it matters for the exam.",
+  "study_guide": {{
+    "overall_advice": "High-level explanation of what this PDF is mainly about, in simple words. At least 6–10 sentences.",
+    "exam_strategy": "What to prioritize for an exam, common tricky concepts, relationships or formulas. 5–10 sentences.",
+    "key_topics": ["topic1", "topic2", "topic3"],
+    "topic_notes": [
+      {{
+        "topic": "short topic name",
+        "nuance_note": "extra nuance or tricky detail that can cause confusion in the exam.",
+        "why_important": "one sentence why this topic is important."
+      }}
+    ]
+  }}
+}}
+
+Output MUST be valid JSON only. No markdown, no commentary, no ``` fences.
+"""
+
+
+def build_neutral_questions_prompt(pdf_text: str, tier: str, first: int, last: int,
+                                   focus: str, count: Optional[int] = None,
+                                   avoid: Sequence[str] = ()) -> str:
     """
-    Given a list of 'focus_if_wrong' notes from questions the user got wrong,
-    generate a single romantic/sarcastic study advice message.
+    Fan-out part: one difficulty tier of questions. A top-up asks for
+    `count` more and lists the questions it must not repeat.
+    """
+    n = count or last - first + 1
+    avoid_block = (
+        "\nDo NOT repeat or rephrase any of these existing questions:\n"
+        + "\n".join(f"- {text}" for text in avoid) + "\n"
+        if avoid else ""
+    )
+    return f"""
+You are an expert exam tutor writing multiple-choice questions from a PDF.
+Neutral, clear, academic voice. No persona.
+
+PDF CONTENT:
+--- START PDF ---
+{pdf_text}
+--- END PDF ---
+
+Write the {tier} questions of a 17-question exam (questions {first}–{last}).
+{tier} questions require {focus}.
+
+Output STRICT JSON only, no ``` fences:
+{{
+  "questions": [
+    {{
+      "question_text": "MCQ question on an important exam topic of the PDF. Clear, single-correct-answer.",
+      "options": {{"A": "...", "B": "...", "C": "...", "D": "...", "E": "Pass"}},
+      "correct_answer_key": "A",
+      "focus_if_wrong": "The EXACT topic or concept from the PDF to review if this is answered wrongly, and why."
+    }}
+  ]
+}}
+
+Rules:
+- Generate EXACTLY {n} questions.
+- Spread them over different topics of the PDF.
+- "focus_if_wrong" must directly reference a real concept, section, or idea implied by the PDF content.
+{avoid_block}"""
+
+
+def _submit(fn, *args):
+    # copy the context so per-call backend overrides (llm.use_backend) apply in the worker
+    return _FANOUT_EXECUTOR.submit(contextvars.copy_context().run, fn, *args)
+
+
+def _timed_json(task: str, prompt: str, images=None):
+    start = time.perf_counter()
+    data = _parse_json_response(llm.generate(task, prompt, images=images))
+    return data, time.perf_counter() - start
+
+
+def _accept_questions(questions: List[Dict[str, Any]], wanted: int, seen: set,
+                      tier: str) -> List[Dict[str, Any]]:
+    """
+    Up to `wanted` questions whose normalized text isn't in `seen` yet,
+    tagged with their tier. `seen` is updated; repeats are counted.
+    """
+    accepted = []
+    for q in questions:
+        if len(accepted) == wanted:
+            break
+        text = normalize_question(q.get("question_text", ""))
+        if not text or text in seen:
+            metrics.incr("quiz.fanout.duplicate")
+            continue
+        seen.add(text)
+        q["tier"] = tier
+        accepted.append(q)
+    return accepted
+
+
+def generate_neutral_content_fanout(pdf_text: str, images=None) -> Dict[str, Any]:
+    """
+    Stage 1 as 4 concurrent requests, merged into the same shape as
+    generate_neutral_content(). A question that repeats one already
+    accepted is dropped, and a tier left short (by repeats or a short
+    reply) is topped up with a follow-up request, up to FANOUT_TOPUPS
+    times; after that it raises. Progress counts accepted questions only.
+    The first part to fail is raised right away and the parts that haven't
+    started are cancelled.
+    """
+    start = time.perf_counter()
+    tier_specs = {name: (first, last, focus) for name, first, last, focus in QUESTION_TIERS}
+    guide = _submit(_timed_json, "quiz_guide", build_neutral_guide_prompt(pdf_text), images)
+    pending: Dict[Any, Optional[str]] = {guide: None}
+    for name, (first, last, focus) in tier_specs.items():
+        prompt = build_neutral_questions_prompt(pdf_text, name, first, last, focus)
+        pending[_submit(_timed_json, "quiz_questions", prompt, images)] = name
+
+    total = QUESTION_TIERS[-1][2]
+    guide_data: Dict[str, Any] = {}
+    parts: Dict[str, List[Dict[str, Any]]] = {name: [] for name in tier_specs}
+    topups = dict.fromkeys(tier_specs, 0)
+    seen: set = set()
+    part_seconds = 0.0
+    try:
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = pending.pop(future)
+                data, seconds = future.result()
+                part_seconds += seconds
+                if name is None:
+                    guide_data = data
+                    continue
+
+                first, last, focus = tier_specs[name]
+                wanted = last - first + 1 - len(parts[name])
+                parts[name].extend(
+                    _accept_questions(data.get("questions") or [], wanted, seen, name)
+                )
+                missing = last - first + 1 - len(parts[name])
+                if missing:
+                    if topups[name] >= FANOUT_TOPUPS:
+                        raise ValueError(f"{name} tier is still {missing} question(s) short")
+                    topups[name] += 1
+                    metrics.incr("quiz.fanout.topup")
+                    avoid = [q["question_text"] for tier in parts.values() for q in tier]
+                    prompt = build_neutral_questions_prompt(
+                        pdf_text, name, first, last, focus, count=missing, avoid=avoid
+                    )
+                    pending[_submit(_timed_json, "quiz_questions", prompt, images)] = name
+                report_progress("questions", ready=sum(len(p) for p in parts.values()), total=total)
+    except BaseException:
+        for future in pending:
+            future.cancel()
+        metrics.incr("quiz.fanout.failed")
+        raise
+
+    wall = time.perf_counter() - start
+    metrics.observe("quiz.fanout.wall", wall)
+    metrics.observe("quiz.fanout.saved", max(0.0, part_seconds - wall))
+
+    return {
+        "summary": guide_data["summary"],
+        "study_guide": guide_data["study_guide"],
+        "questions": [q for name, _, _, _ in QUESTION_TIERS for q in parts[name]],
+    }
+
+
+def generate_neutral_content(pdf_text: str, images=None,
+                             fan_out: Optional[bool] = None) -> Dict[str, Any]:
+    """
+    Stage 1: persona-neutral summary, study guide and questions, each
+    question tagged with its difficulty "tier".
+    The answer key is balanced here, before the content is shared, so every
+    learner of a document sees the same options (and feedback cache keys).
+    """
+    if QUIZ_FANOUT if fan_out is None else fan_out:
+        content = generate_neutral_content_fanout(pdf_text, images=images)
+    else:
+        response = llm.generate("quiz_neutral", build_neutral_content_prompt(pdf_text), images=images)
+        content = _parse_json_response(response)
+        report_progress("questions", ready=len(content["questions"]), total=len(content["questions"]))
+    tag_question_tiers(content["questions"])
+    balance_answer_keys(content["questions"])
+    return content
+
+
+def build_persona_style_prompt(neutral: Dict[str, Any], user_info: Dict[str, Any]) -> str:
+    """Stage 2 prompt: adds the persona voice to finished neutral content."""
+    persona_block = _build_persona_block(user_info)
+    mood_before = user_info.get("mood_before", "unknown")
+    questions = "\n".join(
+        f"{i}. {q['question_text']}" for i, q in enumerate(neutral["questions"], start=1)
+    )
+    n = len(neutral["questions"])
+
+    return f"""
+{persona_block}
+
+The study material below is already written. Your only job is to add your voice.
+The learner's mood before studying: {mood_before}
+
+NEUTRAL SUMMARY:
+{neutral["summary"]}
+
+QUESTIONS (for context only — do NOT reveal or hint at answers):
+{questions}
+
+Output STRICT JSON only, no ``` fences:
+{{
+  "sweet_summary": "The neutral summary retold in your persona's tone. Keep every fact; 20-30 sentences.",
+  "introductions": ["short persona intro before question 1", "... one per question ..."],
+  "daily_romantic_message_seed": "For girls: a seed idea for a daily romantic, encouraging study message. For boys: a daily roast or sarcastic reminder.",
+  "night_mode_message_seed": "For girls: a very soft, safe 'goodnight, I'm proud of you' line. For boys: short sarcastic goodnight summary."
+}}
+
+Rules:
+- EXACTLY {n} introductions, 1–2 sentences each, each one different.
+- Intensity (romance for girls, harshness for boys) grows from question 1 to {n}.
+"""
+
+
+def generate_persona_styling(neutral: Dict[str, Any], user_info: Dict[str, Any]) -> Dict[str, Any]:
+    """Stage 2: persona summary, per-question intros and message seeds."""
+    response = llm.generate("quiz_style", build_persona_style_prompt(neutral, user_info))
+    return _parse_json_response(response)
+
+
+def merge_quiz_data(neutral: Dict[str, Any],
+                    styling: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Combines stage 1 + stage 2 into the usual quiz_data shape. The neutral
+    content is copied, never mutated, so it stays safe to share.
+    Without styling (stage 2 failed / degraded) the neutral text is used.
     """
+    styling = styling or {}
+    intros = styling.get("introductions") or []
+
+    questions = []
+    for i, q in enumerate(neutral["questions"]):
+        question = json.loads(json.dumps(q))
+        question["introduction"] = intros[i] if i < len(intros) else ""
+        question["romance_level"] = i + 1
+        questions.append(question)
+
+    return {
+        "sweet_summary": styling.get("sweet_summary") or neutral["summary"],
+        "study_guide": json.loads(json.dumps(neutral["study_guide"])),
+        "questions": questions,
+        "daily_romantic_message_seed": styling.get("daily_romantic_message_seed", ""),
+        "night_mode_message_seed": styling.get("night_mode_message_seed", ""),
+    }
+
+
+# ==============================
+#  POST-QUIZ FOCUS ADVICE
+# ==============================
+
+def build_advice_prompt(user_info: Dict[str, Any], wrong_focus_list: List[str]) -> str:
     if not wrong_focus_list:
         # Nothing wrong, just pure praise.
         wrong_focus_list = ["No major weak areas – she handled everything beautifully."]
 
-    client = get_client()
-    gender = user_info.get("gender", "female").lower()
-    name = user_info.get("name", "Sweetheart")
     country = user_info.get("country", "default")
 
     persona_block = _build_persona_block(user_info)
 
     joined_focus = "\n".join(f"- {item}" for item in wrong_focus_list)
 
-    prompt = f"""
+    if prompt_variant() == "compact":
+        return f"""
+{persona_block}
+
+Post-quiz study advice. Weak topics (focus_if_wrong notes):
+{joined_focus}
+
+Write ONE short paragraph that tells them what to study next without repeating
+the list — loving and encouraging for a girl, roasting but useful for a boy.
+"""
+
+    return f"""
 {persona_block}
 
 You are now giving a post-quiz study recommendation.
@@ -396,24 +928,28 @@ Your task:
 Output: ONE short paragraph message.
     """
 
-    response = client.models.generate_content(
-        model="gemini-2.0-flash",
-        contents=prompt
-    )
-    return response.text.strip()
+
+def generate_post_quiz_focus_advice(
+    user_info: Dict[str, Any],
+    wrong_focus_list: List[str]
+) -> str:
+    """
+    Given a list of 'focus_if_wrong' notes from questions the user got wrong,
+    generate a single romantic/sarcastic study advice message.
+    """
+    return llm.generate("advice", build_advice_prompt(user_info, wrong_focus_list))
 
 
 # ==============================
 #  DAILY ROMANTIC MESSAGE
 # ==============================
 
-def generate_daily_romantic_message(user_info: Dict[str, Any],
-                                    quiz_data: Optional[Dict[str, Any]] = None) -> str:
+def build_daily_message_prompt(user_info: Dict[str, Any],
+                               quiz_data: Optional[Dict[str, Any]] = None) -> str:
     """
-    Generates a daily romantic (for girls) or sarcastic (for boys) study message
+    Builds the daily romantic (girls) / sarcastic (boys) message prompt
     using the seed from quiz_data if available.
     """
-    client = get_client()
     gender = user_info.get("gender", "female").lower()
     name = user_info.get("name", "Sweetheart")
     country = user_info.get("country", "default")
@@ -453,24 +989,27 @@ Task:
 Output: One short message only.
     """
 
-    response = client.models.generate_content(
-        model="gemini-2.0-flash",
-        contents=prompt
-    )
-    return response.text.strip()
+    return prompt
+
+
+def generate_daily_romantic_message(user_info: Dict[str, Any],
+                                    quiz_data: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Generates a daily romantic (for girls) or sarcastic (for boys) study message
+    using the seed from quiz_data if available.
+    """
+    return llm.generate("daily", build_daily_message_prompt(user_info, quiz_data))
 
 
 # ==============================
 #  NIGHT MODE "GOODNIGHT" MESSAGE
 # ==============================
-def generate_night_mode_message(user_info: Dict[str, Any],
-                                quiz_data: Optional[Dict[str, Any]] = None) -> str:
+def build_night_message_prompt(user_info: Dict[str, Any],
+                               quiz_data: Optional[Dict[str, Any]] = None) -> str:
     """
-    Generates a soft 'goodnight, I'm proud of you' whisper style message
-    for girls, or a short sarcastic goodnight for boys.
+    Builds the night-mode whisper (girls) / sarcastic goodnight (boys) prompt.
     Uses night_mode_message_seed from quiz_data if available.
     """
-    client = get_client()
     gender = user_info.get("gender", "female").lower()
     name = user_info.get("name", "Sweetheart")
     country = user_info.get("country", "default")
@@ -512,24 +1051,19 @@ Output rules:
 
     """
 
-    response = client.models.generate_content(
-        model="gemini-2.0-flash",
-        contents=prompt
-    )
-    return response.text.strip()
+    return prompt
 
-def generate_dynamic_feedback(payload: Dict[str, Any]) -> str:
+
+def generate_night_mode_message(user_info: Dict[str, Any],
+                                quiz_data: Optional[Dict[str, Any]] = None) -> str:
     """
-    Generates dynamic feedback using the LLM with strict formatting rules.
-    Ensures:
-    - Always shows selected and correct answer first
-    - Explains why the correct answer is correct
-    - If wrong: explains why the user’s answer is wrong
-    - Female: romantic boyfriend with optional country phrase
-    - Male: dry sarcastic ex, factual correction, minimal praise
+    Generates a soft 'goodnight, I'm proud of you' whisper style message
+    for girls, or a short sarcastic goodnight for boys.
+    Uses night_mode_message_seed from quiz_data if available.
     """
+    return llm.generate("night", build_night_message_prompt(user_info, quiz_data))
 
-    client = get_client()
+def build_feedback_prompt(payload: Dict[str, Any]) -> str:
     user = payload["user_info"]
 
     persona_block = _build_persona_block(user)
@@ -539,25 +1073,28 @@ def generate_dynamic_feedback(payload: Dict[str, Any]) -> str:
     correct_key = payload["correct_key"]
     correct_text = payload["correct_text"]
 
-    base_correct = payload["base_correct"]
-    base_incorrect = payload["base_incorrect"]
-    base_pass = payload["base_pass"]
-
-    # Determine result type
-    if selected_key == correct_key:
-        result_type = "correct"
-        base = base_correct
-    elif selected_key == "E":
-        result_type = "pass"
-        base = base_pass
-    else:
-        result_type = "incorrect"
-        base = base_incorrect
+    result_type = get_result_type({"correct_answer_key": correct_key}, selected_key)
+
+    # Lean quizzes carry no feedback scripts → use the local phrase bank
+    base = payload.get(f"base_{result_type}") or get_tone_reference(user, result_type)
 
-    gender = user.get("gender", "female").lower()
     country = user.get("country", "Unknown")
 
-    prompt = f"""
+    if prompt_variant() == "compact":
+        wrong_line = "\n- then why their answer is wrong" if result_type == "incorrect" else ""
+        return f"""
+{persona_block}
+
+Quiz feedback. Start with EXACTLY these two lines:
+"You selected: [{selected_key}] {selected_text}"
+"Correct answer: [{correct_key}] {correct_text}"
+Then 4–7 natural lines, no labels, no markdown:
+- why the correct answer is correct (from the question context only){wrong_line}
+- then your persona's reaction.
+Tone reference (do not copy): "{base}"
+"""
+
+    return f"""
 {persona_block}
 
 You are generating feedback for a quiz question.
@@ -608,14 +1145,240 @@ BASE EMOTION REFERENCE (DO NOT COPY):
 Now produce the final feedback message:
 """
 
-    response = client.models.generate_content(
-        model="gemini-2.0-flash",
-        contents=prompt
+
+def generate_dynamic_feedback(payload: Dict[str, Any]) -> str:
+    """
+    Generates dynamic feedback using the LLM with strict formatting rules.
+    Ensures:
+    - Always shows selected and correct answer first
+    - Explains why the correct answer is correct
+    - If wrong: explains why the user’s answer is wrong
+    - Female: romantic boyfriend with optional country phrase
+    - Male: dry sarcastic ex, factual correction, minimal praise
+    """
+    return llm.generate("feedback", build_feedback_prompt(payload))
+
+# ==============================
+#  BATCH FEEDBACK (ONE CALL PER QUIZ)
+# ==============================
+
+# When enabled, feedback for every question × every choice (A–E) is
+# generated in ONE request right after the quiz, so answering a question
+# becomes a local lookup instead of a round trip.
+BATCH_FEEDBACK = os.getenv("STUDYBUDDY_BATCH_FEEDBACK", "1") != "0"
+
+
+def build_feedback_batch_prompt(quiz_data: Dict[str, Any], user_info: Dict[str, Any]) -> str:
+    persona_block = _build_persona_block(user_info)
+
+    lines = []
+    for i, q in enumerate(quiz_data["questions"], start=1):
+        options = "\n".join(f"   {k}) {v}" for k, v in q["options"].items())
+        lines.append(
+            f"Q{i}: {q['question_text']}\n{options}\n   Correct: {q['correct_answer_key']}"
+        )
+    joined_questions = "\n\n".join(lines)
+
+    return f"""
+{persona_block}
+
+You are pre-writing quiz feedback for EVERY possible answer the learner might pick.
+
+QUESTIONS:
+{joined_questions}
+
+For EACH question and EACH option A, B, C, D and E (E = Pass) write the feedback
+the learner gets if they pick that option:
+- Correct option: why it is correct, then persona reaction.
+- Wrong option: why the correct answer is correct AND why that option is wrong, then persona reaction.
+- E (Pass): briefly what the correct idea is, then persona reaction to skipping.
+- 3–6 lines each, natural, unique, no labels, no markdown.
+- Do NOT start with "You selected" or "Correct answer" lines (they are added separately).
+- Romance/harshness grows with the question number.
+
+Output STRICT JSON only, no ``` fences:
+{{
+  "1": {{"A": "...", "B": "...", "C": "...", "D": "...", "E": "..."}},
+  "2": {{"A": "...", "B": "...", "C": "...", "D": "...", "E": "..."}}
+}}
+Include every question from 1 to {len(quiz_data["questions"])}.
+"""
+
+
+def generate_feedback_batch(quiz_data: Dict[str, Any],
+                            user_info: Dict[str, Any]) -> Dict[str, Dict[str, str]]:
+    """
+    Generates persona feedback for every question and every possible
+    choice in one structured request.
+
+    Returns: { "1": {"A": "...", ..., "E": "..."}, "2": {...}, ... }
+    The "You selected / Correct answer" header is NOT generated here;
+    lookup_batch_feedback() prepends it locally.
+    """
+    response = llm.generate("feedback_batch", build_feedback_batch_prompt(quiz_data, user_info))
+
+    return _parse_json_response(response)
+
+
+def lookup_batch_feedback(bank: Optional[Dict[str, Dict[str, str]]],
+                          question_index: int,
+                          question: Dict[str, Any],
+                          selected_key: str) -> Optional[str]:
+    """
+    Returns pre-generated feedback for (question_index, selected_key) with the
+    "You selected / Correct answer" header, or None if the bank misses it.
+    """
+    if not bank:
+        return None
+
+    body = bank.get(str(question_index + 1), {}).get(selected_key)
+    if not body:
+        return None
+
+    correct_key = question["correct_answer_key"]
+    options = question["options"]
+    return (
+        f"You selected: [{selected_key}] {options[selected_key]}\n"
+        f"Correct answer: [{correct_key}] {options[correct_key]}\n\n"
+        f"{body.strip()}"
+    )
+
+
+# ==============================
+#  LOCAL GRADING (NO LLM)
+# ==============================
+
+RESULT_EMOJI = {
+    "female": {"correct": "✅ 🥰💗", "incorrect": "❌ 🫂💕", "pass": "⏭ 🤗"},
+    "male": {"correct": "✅ 🙄", "incorrect": "❌ 🤦‍♀️", "pass": "⏭ 😒"},
+}
+
+
+def get_result_type(question: Dict[str, Any], selected_key: str) -> str:
+    """Returns "correct", "pass" or "incorrect" for the selected option."""
+    if selected_key == question["correct_answer_key"]:
+        return "correct"
+    if selected_key == "E":
+        return "pass"
+    return "incorrect"
+
+
+def build_local_result_text(question: Dict[str, Any], selected_key: str,
+                            user_info: Dict[str, Any]) -> str:
+    """
+    Renders the instant result message from the question itself:
+    persona emoji + selected option + correct option.
+    """
+    gender = user_info.get("gender", "female").lower()
+    emoji = RESULT_EMOJI.get(gender, RESULT_EMOJI["female"])[get_result_type(question, selected_key)]
+
+    correct_key = question["correct_answer_key"]
+    options = question["options"]
+    return (
+        f"{emoji}\n\n"
+        f"You selected: [{selected_key}] {options[selected_key]}\n"
+        f"Correct answer: [{correct_key}] {options[correct_key]}"
     )
 
-    return response.text.strip()
 
-def run_chat_from_pdf(question, pdf_text, user_info):
+# ==============================
+#  DEGRADED MODE (LLM SLOW / DOWN)
+# ==============================
+
+# Used while the LLM circuit is open: everything below is built locally from
+# the quiz itself, so the quiz keeps moving during provider incidents.
+LOCAL_MESSAGES: Dict[str, Dict[str, List[str]]] = {
+    "daily": {
+        "female": [
+            "Good morning my love ☀️ one small study session today and I'll be the proudest boyfriend alive 💕",
+            "Angel, just 25 focused minutes today… I'll be right here cheering for you 🥺💗",
+        ],
+        "male": [
+            "Wake up. Open the notes. Yes, today. No, scrolling doesn't count 😒",
+            "One study session. That's all I'm asking. Try not to disappoint me again.",
+        ],
+    },
+    "night": {
+        "female": [
+            "You did so well today, sweetheart… close your eyes, I'm proud of you 🌙💗",
+            "Rest now my love, your brain worked hard today. Sweet dreams 😴💕",
+        ],
+        "male": [
+            "Go to sleep. Your brain needs it more than anyone's 🙄",
+            "Lights off. Pretending to study at 3am isn't a personality.",
+        ],
+    },
+    "gods": {
+        "female": [
+            "\"My Lord, increase me in knowledge.\" (Qur'an 20:114) 🤍 May Allah make your studies easy.",
+        ],
+        "male": [
+            "\"My Lord, increase me in knowledge.\" (Qur'an 20:114) 🤍 May Allah make your studies easy.",
+        ],
+    },
+}
+
+
+def build_degraded_feedback(question: Dict[str, Any], selected_key: str,
+                            user_info: Dict[str, Any]) -> str:
+    """
+    Templated feedback from the question's own options, correct answer and
+    focus_if_wrong note, plus a pre-written persona line.
+    """
+    result_type = get_result_type(question, selected_key)
+    correct_key = question["correct_answer_key"]
+    options = question["options"]
+
+    lines = [build_local_result_text(question, selected_key, user_info), ""]
+    if result_type == "correct":
+        lines.append(f"[{correct_key}] {options[correct_key]} is exactly right.")
+    else:
+        if result_type == "incorrect":
+            lines.append(f"[{selected_key}] {options[selected_key]} isn't it.")
+        lines.append(f"The answer is [{correct_key}] {options[correct_key]}.")
+        if question.get("focus_if_wrong"):
+            lines.append(f"📌 Focus: {question['focus_if_wrong']}")
+    lines += ["", get_tone_reference(user_info, result_type)]
+    return "\n".join(lines)
+
+
+def build_degraded_advice(user_info: Dict[str, Any], wrong_focus_list: List[str]) -> str:
+    if not wrong_focus_list:
+        return get_tone_reference(user_info, "correct")
+    topics = "\n".join(f"- {item}" for item in wrong_focus_list)
+    return f"Focus on these next:\n{topics}\n\n{get_tone_reference(user_info, 'incorrect')}"
+
+
+def build_degraded_message(kind: str, user_info: Dict[str, Any]) -> str:
+    gender = (user_info.get("gender") or "female").lower()
+    bank = LOCAL_MESSAGES[kind]
+    return random.choice(bank.get(gender, bank["female"]))
+
+
+def with_local_fallback(task: str, generate, fallback) -> Any:
+    """
+    Returns generate() unless the LLM is degraded or the call fails, in which
+    case fallback() is served instead. Never raises from the LLM side.
+    """
+    if not llm.is_degraded(task):
+        try:
+            return generate()
+        except Exception as e:
+            print(f"⚠️ {task} generation failed, serving local fallback:", e)
+    metrics.incr(f"degraded.{task}")
+    return fallback()
+
+
+# Stream chat replies token-by-token instead of waiting for the full answer
+STREAM_CHAT = os.getenv("STUDYBUDDY_STREAM_CHAT", "1") != "0"
+
+
+def build_chat_prompt(question, pdf_text, user_info, history: str = "") -> str:
+
+    history_block = f"""
+CONVERSATION SO FAR (use it to understand follow-up questions):
+{history}
+""" if history else ""
 
     prompt = f"""
 You are StudyBuddy AI.
@@ -640,24 +1403,63 @@ Knowledge Rules:
 
 PDF CONTENT (truncated for safety):
 {pdf_text[:8000]}
-
+{history_block}
 User question:
 "{question}"
 """
 
-    response = client.models.generate_content(
-        model="gemini-2.0-flash",
-        contents=prompt
+    return prompt
+
+
+def run_chat_from_pdf(question, pdf_text, user_info, history: str = ""):
+
+    prompt = build_chat_prompt(question, pdf_text, user_info, history)
+
+    return llm.generate("chat", prompt)
+
+
+def stream_chat_from_pdf(question, pdf_text, user_info, history: str = ""):
+    """
+    Same as run_chat_from_pdf, but yields text chunks as Gemini streams them.
+    """
+    prompt = build_chat_prompt(question, pdf_text, user_info, history)
+
+    yield from llm.stream("chat", prompt)
+
+
+def summarize_chat_history(summary: str, turns: List[Dict[str, str]]) -> str:
+    """
+    Folds older chat turns into the rolling conversation summary.
+    Runs in the background, never on the reply path.
+    """
+    joined_turns = "\n\n".join(
+        f"Student: {t['question']}\nTutor: {t['answer']}" for t in turns
     )
 
-    return response.text
+    prompt = f"""
+Update the running summary of a study chat between a student and a tutor.
 
+CURRENT SUMMARY:
+{summary or "(empty)"}
 
-def generate_gods_message(user_info: Dict[str, Any]) -> str:
+NEW TURNS TO FOLD IN:
+{joined_turns}
+
+Rules:
+- Keep only facts, topics and open questions needed to understand follow-ups.
+- No persona, no greetings, no romance or sarcasm.
+- At most 120 words. Plain text only.
+"""
+
+    return llm.generate("chat_summary", prompt)
+
+
+def build_gods_message_prompt(user_info: Dict[str, Any],
+                              quiz_data: Optional[Dict[str, Any]] = None) -> str:
     """
-    Uses the LLM to generate a safe Islamic dua/hadith/Quran verse 
+    Builds the prompt for a safe Islamic dua/hadith/Quran verse
     related to studying, knowledge, mental peace, and emotional strength.
-    
+
     Must include:
     - Reference number (Quran X:X, or Hadith source + number)
     - NO war/violence/hate verses
@@ -665,7 +1467,6 @@ def generate_gods_message(user_info: Dict[str, Any]) -> str:
     - Gender-specific message: girl (soft, nurturing), boy (supportive & firm)
     - ONE final message only (never output both)
     """
-    client = get_client()
     gender = user_info.get("gender", "female").lower()
     name = user_info.get("name", "")
 
@@ -702,9 +1503,69 @@ A single Islamic reminder message including:
 4. A small motivational line in gender-specific tone
     """
 
-    resp = client.models.generate_content(
-        model="gemini-2.0-flash",
-        contents=prompt
+    return prompt
+
+
+def generate_gods_message(user_info: Dict[str, Any]) -> str:
+    """
+    Uses the LLM to generate a safe Islamic dua/hadith/Quran verse
+    related to studying, knowledge, mental peace, and emotional strength.
+    """
+    return llm.generate("gods", build_gods_message_prompt(user_info))
+
+
+# ==============================
+#  BULK MESSAGE GENERATION (POOLS)
+# ==============================
+
+# Placeholder the pooled messages use instead of a real name
+POOL_NAME_TOKEN = "[NAME]"
+
+MESSAGE_PROMPT_BUILDERS = {
+    "daily": build_daily_message_prompt,
+    "night": build_night_message_prompt,
+    "gods": build_gods_message_prompt,
+}
+
+
+def build_message_batch_prompt(kind: str, user_info: Dict[str, Any],
+                               quiz_data: Optional[Dict[str, Any]] = None,
+                               n: int = 8) -> str:
+    """
+    Builds a prompt asking for `n` different name-neutral messages of one kind.
+    """
+    pool_user = {
+        "name": POOL_NAME_TOKEN,
+        "gender": user_info.get("gender", "female"),
+        "country": user_info.get("country", "default"),
+        "mood_before": "unknown",
+        "mood_after": "unknown",
+    }
+    return MESSAGE_PROMPT_BUILDERS[kind](pool_user, quiz_data) + f"""
+
+BATCH MODE (overrides the single-message output rule above):
+- Write {n} DIFFERENT messages following the task above. No two may share a sentence.
+- Refer to the learner only as {POOL_NAME_TOKEN}.
+- Output STRICT JSON only: a list of {n} strings. No ``` fences.
+"""
+
+
+def parse_message_batch(raw_text: str) -> List[str]:
+    messages = _parse_json_response(raw_text)
+    return [m.strip() for m in messages if isinstance(m, str) and m.strip()]
+
+
+def generate_message_batch(kind: str, user_info: Dict[str, Any],
+                           quiz_data: Optional[Dict[str, Any]] = None,
+                           n: int = 8) -> List[str]:
+    """
+    Generates `n` different daily / night / God's messages in ONE call.
+    Messages are name-neutral (they use POOL_NAME_TOKEN) so a pool can be
+    shared by every user with the same gender, country and seed.
+    """
+    response = llm.generate(
+        "message_batch",
+        build_message_batch_prompt(kind, user_info, quiz_data, n)
     )
 
-    return resp.text.strip()
+    return parse_message_batch(response)
@@ -1,37 +1,59 @@
 import os
-import json
-from typing import List, Dict, Any, Optional
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Tuple
 from io import BytesIO
 from dotenv import load_dotenv
-from PyPDF2 import PdfReader
-from pdf2image import convert_from_bytes
-from huggingface_hub import InferenceClient
+
+import llm_backend as llm
+import query_pdf
+
+# PyPDF2, pdf2image and huggingface_hub are imported lazily on first use
+# so importing this module stays cheap.
 
 # ======================================================
 # LOAD ENV
 # ======================================================
 load_dotenv()
 HF_API_KEY = os.getenv("HUGGINGFACE_API_KEY")
-if not HF_API_KEY:
-    raise RuntimeError("HUGGINGFACE_API_KEY missing in environment")
 
 # ======================================================
 # MULTIMODAL CLIENT: Qwen2-VL-2B-Instruct
 # ======================================================
-hf_client = InferenceClient(
-    "Qwen/Qwen2-VL-2B-Instruct",
-    token=HF_API_KEY
-)
+_hf_client = None
+
+
+def get_hf_client():
+    """Builds the HF InferenceClient on first use."""
+    global _hf_client
+    if _hf_client is None:
+        if not HF_API_KEY:
+            raise RuntimeError("HUGGINGFACE_API_KEY missing in environment")
+        from huggingface_hub import InferenceClient
+        _hf_client = InferenceClient(
+            "Qwen/Qwen2-VL-2B-Instruct",
+            token=HF_API_KEY
+        )
+    return _hf_client
+
+# Render settings used for page images (pdf2image default DPI)
+PDF_RENDER_DPI = 200
+JPEG_QUALITY = 85
+
 
 # ======================================================
 # IMAGE + TEXT EXTRACTION
 # ======================================================
-def extract_pdf_text_and_images(file_bytes: bytes):
+def extract_pdf_text_and_images(file_bytes: bytes, dpi: int = PDF_RENDER_DPI,
+                                quality: int = JPEG_QUALITY):
     """
     Extract:
       ✔ Text via PyPDF2
-      ✔ Page-rendered images via pdf2image (PIL Images)
+      ✔ Page images, JPEG-encoded once per document (EncodedImageStore)
     """
+    from PyPDF2 import PdfReader
+
     # TEXT
     buffer = BytesIO(file_bytes)
     reader = PdfReader(buffer)
@@ -40,255 +62,158 @@ def extract_pdf_text_and_images(file_bytes: bytes):
     for page in reader.pages:
         text += page.extract_text() or ""
 
-    # IMAGES (PIL)
-    images = convert_from_bytes(file_bytes)
-
-    return text.strip(), images
+    # IMAGES (rendered + encoded only the first time this document is seen)
+    return text.strip(), get_image_store(file_bytes, dpi, quality)
 
 
 # ======================================================
-# HF MULTIMODAL GENERATE
+# ENCODED IMAGE STORE (PER DOCUMENT)
 # ======================================================
-def hf_generate(prompt: str, images=None, max_tokens=4096, temperature=0.7):
+class EncodedImageStore:
     """
-    Sends multimodal messages to Qwen2-VL:
-      - images: list of PIL Images or None
-      - text prompt
+    Holds the JPEG-encoded page images of ONE document at ONE render setting:
+      ✔ Encoded bytes are appended as immutable chunks (never copied again)
+      ✔ Pages are addressed by page index
+      ✔ Callers get memoryview slices → no re-encode, no copy
     """
-    messages = []
 
-    if images:
-        for img in images:
+    def __init__(self, dpi: int = PDF_RENDER_DPI, quality: int = JPEG_QUALITY):
+        self.dpi = dpi
+        self.quality = quality
+        self._chunks: List[bytes] = []
+        self._spans: Dict[int, Tuple[int, int, int]] = {}  # page → (chunk, start, end)
+        self.nbytes = 0
+
+    def __len__(self) -> int:
+        return len(self._spans)
+
+    def add_pages(self, images):
+        """Encodes every page not stored yet and appends them as one chunk."""
+        parts = []
+        offset = 0
+        chunk = len(self._chunks)
+
+        for i, img in enumerate(images):
+            if i in self._spans:
+                continue
             buf = BytesIO()
-            img.save(buf, format="JPEG")
-            messages.append({"type": "image", "image": buf.getvalue()})
+            img.convert("RGB").save(buf, format="JPEG", quality=self.quality)
+            data = buf.getvalue()
+            self._spans[i] = (chunk, offset, offset + len(data))
+            offset += len(data)
+            parts.append(data)
 
-    messages.append({"type": "text", "text": prompt})
+        if parts:
+            self._chunks.append(b"".join(parts))
+            self.nbytes += offset
 
-    response = hf_client.chat_completion(
-        messages=messages,
-        max_tokens=max_tokens,
-        temperature=temperature
-    )
+    def get(self, page_index: int) -> memoryview:
+        chunk, start, end = self._spans[page_index]
+        return memoryview(self._chunks[chunk])[start:end]
 
-    return response.choices[0].message["content"]
+    def payloads(self) -> List[memoryview]:
+        return [self.get(i) for i in range(len(self._spans))]
 
 
-# ======================================================
-# PERSONA BLOCK (ROMANTIC BF / SARCASTIC EX)
-# ======================================================
-def _build_persona_block(user_info: Dict[str, Any]) -> str:
-    gender = user_info.get("gender", "female").lower()
-    name = user_info.get("name", "Sweetheart")
-    country = user_info.get("country", "default")
+# (doc_hash, dpi, quality) → EncodedImageStore, least recently used first
+IMAGE_STORES: "OrderedDict[Tuple[str, int, int], EncodedImageStore]" = OrderedDict()
+IMAGE_STORE_MAX_DOCS = int(os.getenv("STUDYBUDDY_IMAGE_STORE_DOCS", "8"))
+IMAGE_STORE_MAX_BYTES = int(os.getenv("STUDYBUDDY_IMAGE_STORE_MB", "200")) * 1024 * 1024
+_IMAGE_STORES_LOCK = threading.Lock()
 
-    if gender == "female":
-        return f"""
-You are speaking to a girl named {name} from {country}.
-You are her extremely romantic, dramatic, clingy, loving boyfriend.
 
-STYLE:
-- Overly romantic
-- Dramatic, clingy, emotional
-- Cute, protective, affectionate
-- NEVER sexual or explicit
+def get_image_store(file_bytes: bytes, dpi: int = PDF_RENDER_DPI,
+                    quality: int = JPEG_QUALITY) -> EncodedImageStore:
+    """
+    Returns the encoded page images for a PDF, rendering and encoding
+    the pages only the first time these render settings are requested.
+    Stores are evicted LRU by document count and total encoded size.
+    """
+    key = (hashlib.sha256(file_bytes).hexdigest(), dpi, quality)
+    with _IMAGE_STORES_LOCK:
+        store = IMAGE_STORES.get(key)
+        if store is not None:
+            IMAGE_STORES.move_to_end(key)
+            return store
+
+    from pdf2image import convert_from_bytes
+
+    store = EncodedImageStore(dpi, quality)
+    store.add_pages(convert_from_bytes(file_bytes, dpi=dpi))
+
+    with _IMAGE_STORES_LOCK:
+        store = IMAGE_STORES.setdefault(key, store)
+        IMAGE_STORES.move_to_end(key)
+        total = sum(s.nbytes for s in IMAGE_STORES.values())
+        while len(IMAGE_STORES) > 1 and (
+            len(IMAGE_STORES) > IMAGE_STORE_MAX_DOCS or total > IMAGE_STORE_MAX_BYTES
+        ):
+            _, evicted = IMAGE_STORES.popitem(last=False)
+            total -= evicted.nbytes
+    return store
+
+
+def encoded_images(images) -> List[Any]:
+    """
+    JPEG payloads for a multimodal call: an EncodedImageStore is served
+    as-is (memoryviews), a list of PIL images is encoded here.
+    """
+    if isinstance(images, EncodedImageStore):
+        return images.payloads()
+    payloads = []
+    for img in images or []:
+        buf = BytesIO()
+        img.convert("RGB").save(buf, format="JPEG", quality=JPEG_QUALITY)
+        payloads.append(buf.getvalue())
+    return payloads
 
-Use cute nicknames (baby, angel, sweetheart, my love).
 
-COUNTRY-BASED ROMANCE:
-- Sometimes use small romantic phrases from her language ({country})
-  with English meaning in parentheses.
-"""
+# ======================================================
+# HF MULTIMODAL GENERATE
+# ======================================================
+def hf_generate(prompt: str, images=None, max_tokens=4096, temperature=0.7):
+    """
+    Sends multimodal messages to Qwen2-VL:
+      - images: EncodedImageStore (preferred), list of PIL Images, or None
+      - text prompt
+    """
+    messages = [{"type": "image", "image": payload} for payload in encoded_images(images)]
+    messages.append({"type": "text", "text": prompt})
 
-    return f"""
-You are speaking to a guy named {name} from {country}.
-You are his extremely sarcastic, annoyed ex-girlfriend.
+    response = get_hf_client().chat_completion(
+        messages=messages,
+        max_tokens=max_tokens,
+        temperature=temperature
+    )
 
-STYLE:
-- Savage, cold, sarcastic
-- Eye-rolling, rude but SAFE
-- No romance ever
-- Increasing irritation as question number increases
-"""
+    return response.choices[0].message["content"]
 
 
 # ======================================================
-# QUIZ GENERATION
+# GENERATORS (SHARED PROMPTS, HF BACKEND)
 # ======================================================
+# Prompts live in query_pdf; these wrappers only pin the backend to
+# Qwen2-VL so both bots share one set of generate_* functions.
 def generate_quiz_data(pdf_text: str, pdf_images, user_info: Dict[str, Any]):
-    print("🚀 ENTER generate_quiz_data")
-    print("PDF TEXT LENGTH:", len(pdf_text))
-    print("NUM IMAGES:", len(pdf_images))
-
-    persona_block = _build_persona_block(user_info)
-
-    prompt = f"""
-{persona_block}
-
-You are helping them study for an exam using the PDF content.
-
-PDF CONTENT:
---- START PDF ---
-{pdf_text}
---- END PDF ---
-
-You MUST output STRICT JSON with the following structure ONLY:
-
-{{
-  "sweet_summary": "...",
-  "study_guide": {{
-    "overall_advice": "...",
-    "exam_strategy": "...",
-    "key_topics": ["...", "...", "..."],
-    "topic_notes": [
-      {{
-        "topic": "...",
-        "nuance_note": "...",
-        "why_important": "..."
-      }}
-    ]
-  }},
-  "questions": [
-    {{
-      "introduction": "...",
-      "question_text": "...",
-      "options": {{
-        "A": "...",
-        "B": "...",
-        "C": "...",
-        "D": "...",
-        "E": "Pass"
-      }},
-      "correct_answer_key": "A",
-      "correct_feedback_script": "...",
-      "incorrect_feedback_script": "...",
-      "pass_feedback_script": "...",
-      "focus_if_wrong": "...",
-      "romance_level": 1
-    }}
-  ],
-  "daily_romantic_message_seed": "...",
-  "night_mode_message_seed": "..."
-}}
-
-RULES:
-- Generate EXACTLY 17 questions.
-- Valid JSON ONLY.
-- Romance_level increases from 1 → 17 for girls (more romantic).
-- Harshness increases 1 → 17 for boys.
-- Feedback scripts MUST mention what the learner chose + correct answer.
-"""
-
-    print("🚀 Sending to HF multimodal...")
-    raw = hf_generate(prompt, images=pdf_images)
-
-    print("RAW LEN:", len(raw))
-
-    # Clean accidental ```json wrappers
-    if raw.startswith("```"):
-        raw = raw.strip("`").strip()
-        if raw.lower().startswith("json"):
-            raw = raw[4:].strip()
-
-    try:
-        data = json.loads(raw)
-    except Exception as e:
-        print("❌ JSON ERROR:", e)
-        print("RAW OUTPUT:", raw)
-        raise e
-
-    print("✅ JSON parsed successfully")
-    return data
+    with llm.use_backend("hf"):
+        return query_pdf.generate_quiz_data(pdf_text, user_info, images=pdf_images)
 
 
-# ======================================================
-# POST QUIZ ADVICE
-# ======================================================
 def generate_post_quiz_focus_advice(user_info, wrong_focus_list):
-    if not wrong_focus_list:
-        wrong_focus_list = ["No major weak areas – amazing performance."]
-
-    persona = _build_persona_block(user_info)
-    topics = "\n".join(f"- {t}" for t in wrong_focus_list)
-
-    prompt = f"""
-{persona}
+    with llm.use_backend("hf"):
+        return query_pdf.generate_post_quiz_focus_advice(user_info, wrong_focus_list)
 
-These were the weak topics:
-{topics}
 
-Generate one short motivating paragraph:
-- Girl: romantic, gentle, emotional, motivating.
-- Boy: sarcastic roast but useful.
-"""
-
-    return hf_generate(prompt, max_tokens=700)
-
-
-# ======================================================
-# DAILY MESSAGE
-# ======================================================
 def generate_daily_romantic_message(user_info, quiz_data=None):
-    seed = quiz_data.get("daily_romantic_message_seed") if quiz_data else ""
-    persona = _build_persona_block(user_info)
-
-    prompt = f"""
-{persona}
-
-Create a short DAILY message based on seed: "{seed}".
-"""
-
-    return hf_generate(prompt, max_tokens=512)
+    with llm.use_backend("hf"):
+        return query_pdf.generate_daily_romantic_message(user_info, quiz_data)
 
 
-# ======================================================
-# NIGHT MESSAGE
-# ======================================================
 def generate_night_mode_message(user_info, quiz_data=None):
-    seed = quiz_data.get("night_mode_message_seed") if quiz_data else ""
-    persona = _build_persona_block(user_info)
-
-    prompt = f"""
-{persona}
-
-Create a NIGHT MODE message based on: "{seed}".
-"""
+    with llm.use_backend("hf"):
+        return query_pdf.generate_night_mode_message(user_info, quiz_data)
 
-    return hf_generate(prompt, max_tokens=512)
 
-
-# ======================================================
-# FEEDBACK GENERATION
-# ======================================================
 def generate_dynamic_feedback(payload):
-    user = payload["user_info"]
-    persona = _build_persona_block(user)
-
-    selected_key = payload["selected_key"]
-    selected_text = payload["selected_text"]
-    correct_key = payload["correct_key"]
-    correct_text = payload["correct_text"]
-
-    base = payload["base_correct"] if selected_key == correct_key else (
-        payload["base_pass"] if selected_key == "E" else payload["base_incorrect"]
-    )
-
-    prompt = f"""
-{persona}
-
-You MUST start EXACTLY with:
-
-"You selected: [{selected_key}] {selected_text}"
-"Correct answer: [{correct_key}] {correct_text}"
-
-THEN:
-- Explain WHY the correct answer is correct.
-- If wrong: explain WHY their answer was wrong.
-- THEN apply persona tone.
-- Output ONLY final message.
-
-BASE TONE REFERENCE:
-"{base}"
-"""
-
-    return hf_generate(prompt, max_tokens=700, temperature=0.85)
+    with llm.use_backend("hf"):
+        return query_pdf.generate_dynamic_feedback(payload)
@@ -0,0 +1,226 @@
+"""
+Persistent question bank (SQLite + FTS5).
+
+Persona-neutral questions are stored per document hash and deduplicated on
+a hash of the normalized question text, so every generation for a popular
+PDF grows one shared pool instead of being thrown away with the session.
+A quiz for a known document is then assembled locally (as many questions
+per difficulty tier as QUESTION_TIERS asks for, least-served first) with no
+LLM call. Each question's tier comes from its own "tier" tag.
+
+The full-text index covers question text and focus notes, for topic search
+(/search). The database is opened on first use; set
+STUDYBUDDY_QUESTION_BANK="" to disable the bank.
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, Any, Collection, List, Optional
+
+import metrics
+from answer_cache import normalize_question
+from answer_balance import balance_answer_keys
+from query_pdf import QUESTION_TIERS
+
+QUESTION_BANK_PATH = os.getenv("STUDYBUDDY_QUESTION_BANK", "question_bank.db")
+
+# Tier → how many questions a quiz takes from it
+TIER_SIZES = tuple((name, last - first + 1) for name, first, last, _ in QUESTION_TIERS)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    doc_hash    TEXT PRIMARY KEY,
+    summary     TEXT NOT NULL,
+    study_guide TEXT NOT NULL,
+    updated_at  REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS questions (
+    id          INTEGER PRIMARY KEY,
+    doc_hash    TEXT NOT NULL,
+    qhash       TEXT NOT NULL,
+    tier        TEXT NOT NULL,
+    question    TEXT NOT NULL,
+    served      INTEGER NOT NULL DEFAULT 0,
+    created_at  REAL NOT NULL,
+    UNIQUE (doc_hash, qhash)
+);
+CREATE INDEX IF NOT EXISTS questions_by_tier ON questions (doc_hash, tier, served);
+"""
+
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS questions_fts
+USING fts5(question_text, focus_if_wrong, tokenize = 'unicode61');
+"""
+
+
+def normalized_question_hash(question: Dict[str, Any]) -> str:
+    """Same question, different punctuation/case → same hash."""
+    text = normalize_question(question.get("question_text", ""))
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+class QuestionBank:
+    def __init__(self, path: str = QUESTION_BANK_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(_SCHEMA)
+        try:
+            self._db.executescript(_FTS_SCHEMA)
+            self.fts = True
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5: the bank still works, search doesn't.
+            print("⚠️ SQLite has no FTS5, question search disabled")
+            self.fts = False
+        self._db.commit()
+
+        self.hits = 0
+        self.misses = 0
+
+    def add(self, doc_hash: str, content: Dict[str, Any]) -> int:
+        """
+        Stores neutral content (summary, study_guide, questions) for a document.
+        Returns the number of new questions; duplicates and questions without
+        a known tier are skipped.
+        """
+        tiers = {name for name, _ in TIER_SIZES}
+        questions = [q for q in content["questions"] if q.get("tier") in tiers]
+        if len(questions) < len(content["questions"]):
+            metrics.incr("question_bank.untiered", len(content["questions"]) - len(questions))
+        now = time.time()
+        inserted = 0
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?)",
+                (doc_hash, content["summary"],
+                 json.dumps(content["study_guide"], ensure_ascii=False), now),
+            )
+            for q in questions:
+                cur = self._db.execute(
+                    "INSERT OR IGNORE INTO questions (doc_hash, qhash, tier, question, created_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (doc_hash, normalized_question_hash(q), q["tier"],
+                     json.dumps(q, ensure_ascii=False), now),
+                )
+                if not cur.rowcount:
+                    continue
+                inserted += 1
+                if self.fts:
+                    self._db.execute(
+                        "INSERT INTO questions_fts (rowid, question_text, focus_if_wrong) VALUES (?, ?, ?)",
+                        (cur.lastrowid, q.get("question_text", ""), q.get("focus_if_wrong", "")),
+                    )
+
+        metrics.incr("question_bank.inserted", inserted)
+        metrics.incr("question_bank.duplicate", len(questions) - inserted)
+        return inserted
+
+    def assemble(self, doc_hash: str, exclude: Collection[str] = ()) -> Optional[Dict[str, Any]]:
+        """
+        A full neutral quiz for a known document, or None if the bank
+        doesn't hold enough questions in every tier. Least-served first,
+        so repeat learners rotate through the pool. `exclude` holds
+        normalized_question_hash values to leave out (e.g. the questions
+        a learner just answered).
+        """
+        exclude = list(exclude)
+        skip = f" AND qhash NOT IN ({', '.join('?' * len(exclude))})" if exclude else ""
+        with self._lock, self._db:
+            doc = self._db.execute(
+                "SELECT summary, study_guide FROM documents WHERE doc_hash = ?", (doc_hash,)
+            ).fetchone()
+
+            rows = []
+            if doc is not None:
+                for tier, size in TIER_SIZES:
+                    picked = self._db.execute(
+                        "SELECT id, question FROM questions WHERE doc_hash = ? AND tier = ?"
+                        + skip + " ORDER BY served, RANDOM() LIMIT ?",
+                        (doc_hash, tier, *exclude, size),
+                    ).fetchall()
+                    if len(picked) < size:
+                        rows = []
+                        break
+                    rows.extend(picked)
+
+            if not rows:
+                self.misses += 1
+                metrics.incr("question_bank.miss")
+                return None
+
+            self._db.executemany(
+                "UPDATE questions SET served = served + 1 WHERE id = ?", [(r[0],) for r in rows]
+            )
+            self.hits += 1
+            metrics.incr("question_bank.hit")
+
+        questions = [json.loads(r[1]) for r in rows]
+        # Each generation was balanced as a whole, but a pick across several
+        # generations (and tiers) can break the rules again, e.g. three "C"
+        # answers in a row or no "D" at all, so the assembled set is balanced
+        # once more. Questions already in balance are left unchanged.
+        balance_answer_keys(questions)
+        return {"summary": doc[0], "study_guide": json.loads(doc[1]), "questions": questions}
+
+    def search(self, query: str, doc_hash: Optional[str] = None,
+               limit: int = 10) -> List[Dict[str, Any]]:
+        """Full-text search over question text and focus notes."""
+        if not self.fts or not query.strip():
+            return []
+        # Quote every term so user input can't break the FTS5 query syntax.
+        match = " ".join('"{}"'.format(t.replace('"', '""')) for t in query.split())
+        sql = ("SELECT q.question FROM questions_fts f JOIN questions q ON q.id = f.rowid "
+               "WHERE questions_fts MATCH ?")
+        args: List[Any] = [match]
+        if doc_hash:
+            sql += " AND q.doc_hash = ?"
+            args.append(doc_hash)
+        sql += " ORDER BY rank LIMIT ?"
+        args.append(limit)
+        with self._lock:
+            try:
+                rows = self._db.execute(sql, args).fetchall()
+            except sqlite3.OperationalError:
+                return []
+        return [json.loads(r[0]) for r in rows]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            docs = self._db.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+            questions = self._db.execute("SELECT COUNT(*) FROM questions").fetchone()[0]
+            page_count = self._db.execute("PRAGMA page_count").fetchone()[0]
+            page_size = self._db.execute("PRAGMA page_size").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "docs": docs,
+            "questions": questions,
+            "bytes": page_count * page_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+_BANK: Optional[QuestionBank] = None
+_BANK_FAILED = False
+_BANK_LOCK = threading.Lock()
+
+
+def get_question_bank() -> Optional[QuestionBank]:
+    """
+    The shared bank, opened on first use. None when it is disabled
+    (STUDYBUDDY_QUESTION_BANK="") or the database can't be opened.
+    """
+    global _BANK, _BANK_FAILED
+    if _BANK is None and not _BANK_FAILED and QUESTION_BANK_PATH:
+        with _BANK_LOCK:
+            if _BANK is None and not _BANK_FAILED:
+                try:
+                    _BANK = QuestionBank(QUESTION_BANK_PATH)
+                except sqlite3.Error as e:
+                    print("⚠️ Question bank unavailable:", e)
+                    _BANK_FAILED = True
+    return _BANK
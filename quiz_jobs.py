@@ -0,0 +1,152 @@
+"""
+Background job queue for quiz generation.
+
+Document work (extraction + quiz content) runs on its own worker pool, not
+inside the update handlers. Each job reports its stages — queued (with its
+position), extracted, N/17 questions ready — to an on_progress callback,
+and the time spent reaching each stage is recorded as quiz_job.<stage>.
+
+Admission control: at most QUIZ_WORKERS jobs run at once; the rest wait in
+FIFO order and hear their queue position whenever it changes. Beyond
+QUIZ_QUEUE_MAX waiting jobs, submit() raises QueueFull.
+"""
+import os
+import time
+import asyncio
+import itertools
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Optional
+
+import metrics
+from query_pdf import use_progress
+
+QUIZ_WORKERS = int(os.getenv("STUDYBUDDY_QUIZ_WORKERS", "4"))
+QUIZ_QUEUE_MAX = int(os.getenv("STUDYBUDDY_QUIZ_QUEUE_MAX", "50"))
+
+
+class QueueFull(RuntimeError):
+    pass
+
+
+class QuizJob:
+    def __init__(self, job_id: int, fn: Callable[..., Any], args: tuple,
+                 kwargs: Dict[str, Any], on_progress: Optional[Callable[..., None]]):
+        self.id = job_id
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.on_progress = on_progress
+        self.future: Future = Future()
+        # the submitter's context (backend / prompt overrides) goes with the job
+        self.context = contextvars.copy_context()
+
+        self.stage = "queued"
+        self.stage_started = time.perf_counter()
+        self.submitted = self.stage_started
+
+    def report(self, stage: str, **info):
+        """Records stage timing and forwards to on_progress (worker thread)."""
+        now = time.perf_counter()
+        if stage != self.stage:
+            metrics.observe(f"quiz_job.{stage}", now - self.stage_started)
+            self.stage = stage
+            self.stage_started = now
+        if self.on_progress is not None:
+            try:
+                self.on_progress(stage, **info)
+            except Exception as e:
+                print("⚠️ Job progress callback failed:", e)
+
+
+class QuizJobQueue:
+    def __init__(self, workers: int = QUIZ_WORKERS, max_queued: int = QUIZ_QUEUE_MAX):
+        self.workers = workers
+        self.max_queued = max_queued
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="quiz-job")
+        self._waiting: Deque[QuizJob] = deque()
+        self._running = 0
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+        self.rejected = 0
+
+    def submit(self, fn: Callable[..., Any], *args,
+               on_progress: Optional[Callable[..., None]] = None, **kwargs) -> QuizJob:
+        """Queues fn(*args, **kwargs); raises QueueFull when too many jobs are waiting."""
+        with self._lock:
+            if self._running >= self.workers and len(self._waiting) >= self.max_queued:
+                self.rejected += 1
+                metrics.incr("quiz_job.rejected")
+                raise QueueFull(f"{len(self._waiting)} quiz jobs already waiting")
+            job = QuizJob(next(self._ids), fn, args, kwargs, on_progress)
+            self._waiting.append(job)
+            position = len(self._waiting) if self._running >= self.workers else 0
+        metrics.incr("quiz_job.submitted")
+        if position:
+            job.report("queued", position=position)
+        self._dispatch()
+        return job
+
+    def as_task(self, job: QuizJob, name: str = "quiz_job") -> asyncio.Task:
+        """The job's result as an asyncio task. Cancelling it drops the job if it hasn't started."""
+        task = asyncio.create_task(self._wait(job), name=name)
+        task.add_done_callback(lambda t: t.cancelled() and job.future.cancel())
+        return task
+
+    @staticmethod
+    async def _wait(job: QuizJob) -> Any:
+        return await asyncio.wrap_future(job.future)
+
+    def _dispatch(self):
+        started = []
+        with self._lock:
+            while self._running < self.workers and self._waiting:
+                job = self._waiting.popleft()
+                if not job.future.set_running_or_notify_cancel():
+                    # cancelled while waiting — its work never runs
+                    metrics.incr("quiz_job.cancelled_queued")
+                    continue
+                self._running += 1
+                started.append(job)
+            waiting = list(self._waiting)
+
+        for job in started:
+            self._executor.submit(self._run, job)
+        if started:
+            for position, job in enumerate(waiting, start=1):
+                job.report("queued", position=position)
+
+    def _run(self, job: QuizJob):
+        job.report("started")
+        try:
+            result = job.context.run(self._call, job)
+            job.report("done")
+            job.future.set_result(result)
+        except BaseException as e:
+            metrics.incr("quiz_job.failed")
+            job.future.set_exception(e)
+        finally:
+            metrics.observe("quiz_job.total", time.perf_counter() - job.submitted)
+            with self._lock:
+                self._running -= 1
+            self._dispatch()
+
+    @staticmethod
+    def _call(job: QuizJob) -> Any:
+        with use_progress(job.report):
+            return job.fn(*job.args, **job.kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "running": self._running,
+                "queued": len(self._waiting),
+                "workers": self.workers,
+                "rejected": self.rejected,
+            }
+
+
+QUIZ_JOBS = QuizJobQueue()
@@ -0,0 +1,154 @@
+"""
+Two-stage quiz generation.
+
+  Stage 1 (expensive, reads the PDF): persona-neutral summary, study guide
+          and questions — cached per document hash and shared by everyone
+          who uploads the same document.
+  Stage 2 (cheap, no PDF): persona styling — summary tone, question intros,
+          message seeds — generated per learner.
+
+Stage 1 lookups go memory cache → persistent question bank → LLM; every
+generated set is added to the bank. A fresh set ("play again") comes from
+the bank too when it holds enough questions the learner hasn't just had. Identical concurrent extractions and
+generations (same document hash and parameters) are coalesced into one.
+
+Set STUDYBUDDY_TWO_STAGE=0 to go back to the single monolithic prompt.
+"""
+import os
+import json
+import threading
+from io import BytesIO
+from collections import OrderedDict
+from typing import Dict, Any, Iterable, Optional
+
+import metrics
+from query_pdf import (
+    extract_text_from_pdf,
+    generate_quiz_data,
+    generate_neutral_content,
+    generate_persona_styling,
+    merge_quiz_data,
+    report_progress,
+    with_local_fallback,
+)
+from question_bank import get_question_bank, normalized_question_hash
+from singleflight import SingleFlight
+
+TWO_STAGE = os.getenv("STUDYBUDDY_TWO_STAGE", "1") != "0"
+
+
+class NeutralContentCache:
+    def __init__(self, max_docs: int = 200):
+        """max_docs: LRU capacity (documents)"""
+        self.max_docs = max_docs
+        self._data: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, doc_hash: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            content = self._data.get(doc_hash)
+            if content is None:
+                self.misses += 1
+                metrics.incr("neutral_cache.miss")
+                return None
+            self._data.move_to_end(doc_hash)
+            self.hits += 1
+            metrics.incr("neutral_cache.hit")
+            return content
+
+    def put(self, doc_hash: str, content: Dict[str, Any]):
+        with self._lock:
+            self._data[doc_hash] = content
+            self._data.move_to_end(doc_hash)
+            while len(self._data) > self.max_docs:
+                self._data.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "docs": len(self._data),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+NEUTRAL_CACHE = NeutralContentCache(
+    max_docs=int(os.getenv("STUDYBUDDY_NEUTRAL_CACHE_DOCS", "200")),
+)
+
+
+EXTRACT_FLIGHT = SingleFlight("extract")
+NEUTRAL_FLIGHT = SingleFlight("neutral")
+QUIZ_FLIGHT = SingleFlight("quiz")
+
+
+def extract_document_text(doc_hash: str, pdf_bytes: bytes) -> str:
+    """extract_text_from_pdf, coalesced per document."""
+    return EXTRACT_FLIGHT.do(doc_hash, lambda: extract_text_from_pdf(BytesIO(pdf_bytes)))
+
+
+def get_neutral_content(doc_hash: str, pdf_text: str, images=None,
+                        fresh: bool = False, exclude: Iterable[Dict[str, Any]] = ()) -> Dict[str, Any]:
+    """
+    Stage 1, cached per document. fresh=True asks for a new question set
+    (e.g. "play again") without the `exclude` questions: assembled from the
+    bank when it has enough, generated otherwise. It replaces the cached one.
+    """
+    skip = tuple(sorted({normalized_question_hash(q) for q in exclude}))
+    key = (doc_hash, fresh, images is not None, skip)
+    return NEUTRAL_FLIGHT.do(key, _get_neutral_content, doc_hash, pdf_text, images, fresh, skip)
+
+
+def _get_neutral_content(doc_hash: str, pdf_text: str, images, fresh: bool,
+                         skip=()) -> Dict[str, Any]:
+    content = None if fresh else NEUTRAL_CACHE.get(doc_hash)
+    bank = get_question_bank() if content is None else None
+    if bank is not None:
+        content = bank.assemble(doc_hash, exclude=skip)
+        if content is not None:
+            NEUTRAL_CACHE.put(doc_hash, content)
+    if content is not None:
+        n = len(content["questions"])
+        report_progress("questions", ready=n, total=n)
+        return content
+
+    with metrics.timer("quiz.neutral"):
+        content = generate_neutral_content(pdf_text, images=images)
+    NEUTRAL_CACHE.put(doc_hash, content)
+    bank = get_question_bank()
+    if bank is not None:
+        bank.add(doc_hash, content)
+    return content
+
+
+def style_quiz(neutral: Dict[str, Any], user_info: Dict[str, Any]) -> Dict[str, Any]:
+    """Stage 2. Falls back to the neutral text if styling fails."""
+    with metrics.timer("quiz.style"):
+        styling = with_local_fallback(
+            "quiz_style",
+            lambda: generate_persona_styling(neutral, user_info),
+            lambda: None,
+        )
+    return merge_quiz_data(neutral, styling)
+
+
+def build_quiz(doc_hash: str, pdf_text: str, user_info: Dict[str, Any],
+               images=None, fresh: bool = False,
+               exclude: Iterable[Dict[str, Any]] = ()) -> Dict[str, Any]:
+    """
+    Returns quiz_data for this learner (same shape as generate_quiz_data).
+    fresh/exclude: see get_neutral_content.
+    """
+    if not TWO_STAGE:
+        # persona-specific, so only learners with identical settings coalesce;
+        # each gets its own copy of the shared result
+        key = (doc_hash, json.dumps(user_info, sort_keys=True, default=str), images is not None)
+        quiz_data = QUIZ_FLIGHT.do(key, generate_quiz_data, pdf_text, user_info, images=images)
+        return json.loads(json.dumps(quiz_data))
+    neutral = get_neutral_content(doc_hash, pdf_text, images=images, fresh=fresh, exclude=exclude)
+    return style_quiz(neutral, user_info)
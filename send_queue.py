@@ -0,0 +1,214 @@
+"""
+Rate-limit-aware outbound queue for Telegram sends.
+
+- per-chat and global token buckets (Telegram: ~1 msg/s per chat, ~30 msg/s overall)
+- automatic backoff on RetryAfter (flood control)
+- edits of sent messages (edit) draw from the same buckets
+- adjacent small plain-text messages to the same chat are coalesced into
+  one send, up to Telegram's 4096-character limit
+- long texts are split at line breaks where possible
+- a chat's queue and worker are dropped once it drains, its bucket once
+  it has refilled, so idle chats cost nothing
+"""
+import os
+import time
+import asyncio
+from collections import deque
+from datetime import timedelta
+from typing import Dict, Any, List
+
+from telegram.error import RetryAfter
+
+import metrics
+
+MAX_MESSAGE_CHARS = 4096
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = time.monotonic()
+
+    def reserve(self) -> float:
+        """Takes one token (possibly going into debt); returns seconds to wait."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def refill_seconds(self) -> float:
+        """Seconds until the bucket is full again (a fresh bucket is equivalent)."""
+        tokens = min(self.capacity, self.tokens + (time.monotonic() - self.last) * self.rate)
+        return (self.capacity - tokens) / self.rate
+
+
+def split_text(text: str, limit: int = MAX_MESSAGE_CHARS) -> List[str]:
+    """Splits text into <= limit chunks, preferring newline boundaries."""
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind("\n", limit // 2, limit)
+        if cut <= 0:
+            cut = limit
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    if text:
+        chunks.append(text)
+    return chunks
+
+
+class _Item:
+    __slots__ = ("text", "kwargs", "coalesce", "future")
+
+    def __init__(self, text, kwargs, coalesce, future):
+        self.text = text
+        self.kwargs = kwargs
+        self.coalesce = coalesce
+        self.future = future
+
+
+class Outbox:
+    def __init__(self, global_rate: float = 25.0, per_chat_rate: float = 1.0,
+                 per_chat_burst: float = 3.0, limit: int = MAX_MESSAGE_CHARS):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self.limit = limit
+
+        self._queues: Dict[int, deque] = {}
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+
+    # ---------- public API ----------
+    def post(self, bot, chat_id: int, text: str, coalesce: bool = True, **kwargs) -> asyncio.Future:
+        """
+        Enqueues a message and returns a future resolving to the last sent
+        Message. Plain messages may be merged with neighbours; pass
+        coalesce=False for messages you will edit later.
+        """
+        future = asyncio.get_running_loop().create_future()
+        can_merge = coalesce and not kwargs
+        self._queues.setdefault(chat_id, deque()).append(_Item(text, kwargs, can_merge, future))
+        metrics.incr("outbox.queued")
+
+        worker = self._workers.get(chat_id)
+        if worker is None or worker.done():
+            self._workers[chat_id] = asyncio.create_task(self._drain(bot, chat_id))
+        return future
+
+    async def send(self, bot, chat_id: int, text: str, coalesce: bool = True, **kwargs):
+        """Enqueue and wait until sent (keeps per-chat order)."""
+        return await self.post(bot, chat_id, text, coalesce=coalesce, **kwargs)
+
+    async def edit(self, message, text: str, **kwargs):
+        """
+        Edits a sent message in place. Not queued (a stale edit would only
+        be overwritten), but it takes a token from the chat's and the global
+        bucket and waits out RetryAfter like a send.
+        """
+        chat_id = message.chat_id
+        try:
+            return await self._with_retry(chat_id, lambda: message.edit_text(text, **kwargs))
+        finally:
+            metrics.incr("outbox.edited")
+            if chat_id not in self._queues:
+                self._forget_later(chat_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued_now": sum(len(q) for q in self._queues.values()),
+            "active_chats": sum(1 for w in self._workers.values() if not w.done()),
+            "tracked_chats": len(self._buckets),
+        }
+
+    # ---------- worker ----------
+    def _next_batch(self, queue: deque) -> List[_Item]:
+        batch = [queue.popleft()]
+        if not batch[0].coalesce:
+            return batch
+
+        size = len(batch[0].text)
+        while queue and queue[0].coalesce and size + 2 + len(queue[0].text) <= self.limit:
+            item = queue.popleft()
+            size += 2 + len(item.text)
+            batch.append(item)
+        return batch
+
+    async def _wait_for_slot(self, chat_id: int):
+        bucket = self._buckets.setdefault(
+            chat_id, TokenBucket(self.per_chat_rate, self.per_chat_burst)
+        )
+        delay = max(bucket.reserve(), self.global_bucket.reserve())
+        if delay > 0:
+            metrics.incr("outbox.throttled_ms", int(delay * 1000))
+            await asyncio.sleep(delay)
+
+    async def _send_with_retry(self, bot, chat_id: int, text: str, kwargs: Dict[str, Any]):
+        return await self._with_retry(
+            chat_id, lambda: bot.send_message(chat_id=chat_id, text=text, **kwargs)
+        )
+
+    async def _with_retry(self, chat_id: int, call):
+        while True:
+            await self._wait_for_slot(chat_id)
+            try:
+                return await call()
+            except RetryAfter as e:
+                wait = e.retry_after
+                wait = wait.total_seconds() if isinstance(wait, timedelta) else float(wait)
+                metrics.incr("outbox.retry_after")
+                metrics.incr("outbox.throttled_ms", int(wait * 1000))
+                await asyncio.sleep(wait)
+
+    async def _drain(self, bot, chat_id: int):
+        queue = self._queues[chat_id]
+        while queue:
+            batch = self._next_batch(queue)
+            text = "\n\n".join(item.text for item in batch)
+            if len(batch) > 1:
+                metrics.incr("outbox.coalesced", len(batch) - 1)
+
+            try:
+                message = None
+                chunks = split_text(text, self.limit)
+                for i, chunk in enumerate(chunks):
+                    # reply_markup etc. go on the last chunk only
+                    kwargs = batch[-1].kwargs if i == len(chunks) - 1 else {}
+                    message = await self._send_with_retry(bot, chat_id, chunk, kwargs)
+                    metrics.incr("outbox.sent")
+            except Exception as e:
+                for item in batch:
+                    if not item.future.done():
+                        item.future.set_exception(e)
+                continue
+
+            for item in batch:
+                if not item.future.done():
+                    item.future.set_result(message)
+
+        # Drained: nothing awaits between the empty check and here, so a new
+        # post() can't slip in and it will start a fresh worker.
+        del self._queues[chat_id]
+        del self._workers[chat_id]
+        self._forget_later(chat_id)
+
+    def _forget_later(self, chat_id: int):
+        bucket = self._buckets.get(chat_id)
+        if bucket is not None:
+            asyncio.get_running_loop().call_later(
+                bucket.refill_seconds(), self._forget_bucket, chat_id
+            )
+
+    def _forget_bucket(self, chat_id: int):
+        # a chat that sent again since keeps its bucket; its own drain reschedules this
+        bucket = self._buckets.get(chat_id)
+        if bucket is not None and chat_id not in self._queues and bucket.refill_seconds() < 0.01:
+            del self._buckets[chat_id]
+
+
+OUTBOX = Outbox(
+    global_rate=float(os.getenv("STUDYBUDDY_GLOBAL_SEND_RATE", "25")),
+    per_chat_rate=float(os.getenv("STUDYBUDDY_CHAT_SEND_RATE", "1")),
+)
@@ -0,0 +1,59 @@
+"""
+Singleflight: coalesces identical in-flight calls.
+
+When a class forwards the same PDF, dozens of uploads arrive before any
+cache is filled. The first caller for a key runs the work; callers that
+arrive while it is running wait for that result instead of starting their
+own (the exception too, if it fails). Nothing is kept after the call ends —
+caching is the job of the caches behind it.
+"""
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable
+
+import metrics
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        """name: metrics prefix (singleflight.<name>.*)"""
+        self.name = name
+        self._inflight: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Runs fn(*args, **kwargs) once per key at a time; blocks followers."""
+        with self._lock:
+            self.calls += 1
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+            else:
+                self.coalesced += 1
+        metrics.incr(f"singleflight.{self.name}.{'leader' if leader else 'coalesced'}")
+
+        if not leader:
+            return future.result()
+
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+        return future.result()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "coalesced": self.coalesced,
+                "inflight": len(self._inflight),
+                "coalesced_rate": self.coalesced / self.calls if self.calls else 0.0,
+            }
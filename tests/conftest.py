@@ -0,0 +1,9 @@
+import os
+import sys
+
+# Tests import the flat top-level modules and must never reach a real LLM
+# or write the question bank into the working directory.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("STUDYBUDDY_LLM_BACKEND", "fake")
+os.environ.setdefault("STUDYBUDDY_QUESTION_BANK", "")
+os.environ.setdefault("TELEGRAM_TOKEN", "test-token")
@@ -0,0 +1,86 @@
+import random
+from collections import Counter
+
+import pytest
+
+from answer_balance import (
+    LETTERS,
+    balance_answer_keys,
+    is_order_dependent,
+    remap_letter_refs,
+)
+
+SWAP_AC = {"A": "C", "C": "A"}
+
+
+def _question(i, key="A", **extra):
+    q = {
+        "question_text": f"Question {i}?",
+        "options": {"A": f"a{i}", "B": f"b{i}", "C": f"c{i}", "D": f"d{i}", "E": "Pass"},
+        "correct_answer_key": key,
+        "focus_if_wrong": f"Review topic {i}.",
+    }
+    q.update(extra)
+    return q
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Correct answer: C", "Correct answer: A"),
+    ("The answer is (A).", "The answer is (C)."),
+    ("option A is right", "option C is right"),
+    ("Choice [C] fits", "Choice [A] fits"),
+    ("(A)", "(C)"),
+    ("C", "A"),
+])
+def test_remaps_explicit_option_references(text, expected):
+    assert remap_letter_refs(text, SWAP_AC) == expected
+
+
+@pytest.mark.parametrize("text", [
+    "what is P(A)?",
+    "Hepatitis B or C",
+    "If A and B are independent",
+    "Vitamin A deficiency (A)nemia",
+    "A vitamin",
+])
+def test_leaves_subject_matter_letters_alone(text):
+    assert remap_letter_refs(text, SWAP_AC) == text
+
+
+def test_question_text_and_option_bodies_never_rewritten():
+    questions = [
+        _question(i, question_text="What is P(A) if A and C are independent?",
+                  incorrect_feedback_script="Not quite, the answer is A.")
+        for i in range(12)
+    ]
+    for q in questions:
+        q["options"]["A"] = "P(A) = 0.5, Hepatitis B or C"
+    balance_answer_keys(questions, rng=random.Random(1))
+
+    for q in questions:
+        assert q["question_text"] == "What is P(A) if A and C are independent?"
+        key = q["correct_answer_key"]
+        assert q["options"][key] == "P(A) = 0.5, Hepatitis B or C"
+        assert q["incorrect_feedback_script"] == f"Not quite, the answer is {key}."
+
+
+def test_options_naming_other_options_are_pinned():
+    q = _question(1, key="D")
+    q["options"]["D"] = "Both A and C"
+    assert is_order_dependent(q)
+    assert is_order_dependent(_question(2, question_text="Which of options A-C is wrong?"))
+    assert not is_order_dependent(_question(3))
+
+
+def test_balanced_distribution():
+    questions = [_question(i, key="A") for i in range(17)]
+    changed = balance_answer_keys(questions, rng=random.Random(0))
+
+    keys = [q["correct_answer_key"] for q in questions]
+    counts = Counter(keys)
+    assert changed > 0
+    assert all(counts[letter] >= 3 for letter in LETTERS)
+    assert all(not (keys[i] == keys[i + 1] == keys[i + 2]) for i in range(len(keys) - 2))
+    # the correct option text moved with the key
+    assert all(q["options"][q["correct_answer_key"]] == f"a{i}" for i, q in enumerate(questions))
+    assert all(q["options"]["E"] == "Pass" for q in questions)
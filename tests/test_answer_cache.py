@@ -0,0 +1,46 @@
+import pytest
+
+from answer_cache import AnswerCache
+
+USER = {"name": "Mia", "gender": "female"}
+
+
+@pytest.fixture
+def cache():
+    return AnswerCache()
+
+
+@pytest.mark.parametrize("cached, asked", [
+    ("What is the difference between mitosis and meiosis?",
+     "What is the difference between meiosis and mitosis?"),
+    ("What is a prime number?", "What are prime numbers?"),
+    ("Type 1 vs type 2 diabetes", "Type 2 vs type 1 diabetes"),
+    ("Type 1 diabetes causes", "Type 2 diabetes causes"),
+    ("Is glucose a lipid?", "Is glucose not a lipid?"),
+    ("Why is the sky blue?", "Why isn't the sky blue?"),
+])
+def test_near_misses_are_not_served(cache, cached, asked):
+    cache.add("doc", USER, cached, "cached answer")
+    assert cache.lookup("doc", USER, asked) is None
+
+
+@pytest.mark.parametrize("cached, asked", [
+    ("What does ATP do in the Calvin cycle?", "what does ATP do in Calvin cycle"),
+    ("Explain photosynthesis", "Explain photosynthesis, please!"),
+])
+def test_rephrasings_hit(cache, cached, asked):
+    cache.add("doc", USER, cached, "Mia, ATP powers it.")
+    assert cache.lookup("doc", {"name": "Lena", "gender": "female"}, asked) == "Lena, ATP powers it."
+
+
+def test_cache_is_per_document_and_gender(cache):
+    cache.add("doc-1", USER, "What is osmosis?", "answer")
+    assert cache.lookup("doc-2", USER, "What is osmosis?") is None
+    assert cache.lookup("doc-1", {"name": "Tom", "gender": "male"}, "What is osmosis?") is None
+
+
+@pytest.mark.parametrize("doc_hash", [None, ""])
+def test_missing_doc_hash_bypasses_cache(cache, doc_hash):
+    cache.add(doc_hash, USER, "What is osmosis?", "answer")
+    assert cache.lookup(doc_hash, USER, "What is osmosis?") is None
+    assert cache.stats()["entries"] == 0
@@ -0,0 +1,22 @@
+import bench
+
+ROWS = [  # importtime order: children before their parent
+    (1, 0.01, 0.01, "json"),
+    (0, 0.0, 0.02, "os_helpers"),
+    (2, 0.05, 0.05, "telegram._bot"),
+    (1, 0.02, 0.20, "telegram"),
+    (1, 0.01, 0.01, "query_pdf"),
+    (0, 0.01, 0.25, "bot"),
+]
+
+
+def test_entry_children_are_the_direct_imports():
+    assert [r[3] for r in bench.entry_children(ROWS, "bot")] == ["telegram", "query_pdf"]
+    assert bench.entry_children(ROWS, "app") == []
+
+
+def test_missing_framework_skips_the_entry_module(monkeypatch, capsys):
+    monkeypatch.setitem(bench.ENTRY_REQUIREMENTS, "app", "surely_not_installed_pkg")
+    monkeypatch.setattr(bench, "measure_import_time", lambda module: (_ for _ in ()).throw(AssertionError))
+    assert bench.bench_import_time("app", budget=1.0)
+    assert "surely_not_installed_pkg is not installed" in capsys.readouterr().out
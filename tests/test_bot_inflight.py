@@ -0,0 +1,140 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import bot
+from llm_backend import fake_quiz_data
+from quiz_jobs import QuizJobQueue
+
+
+class FakeMessage:
+    chat_id = 7
+
+    def __init__(self, sent):
+        self.sent = sent
+
+    async def edit_text(self, text, reply_markup=None):
+        self.sent.append(("edit", text))
+
+
+@pytest.fixture
+def session(monkeypatch):
+    sent = []
+    hooks = []  # (text suffix, callback) run once, right after that send
+
+    async def send(bot_, chat_id, text, coalesce=True, **kwargs):
+        sent.append(("send", text))
+        for hook in [h for h in hooks if text.endswith(h[0])]:
+            hooks.remove(hook)
+            hook[1]()
+        return FakeMessage(sent)
+
+    monkeypatch.setattr(bot.OUTBOX, "send", send)
+    state = bot._init_state(7)
+    state["user_info"].update(name="Mia", gender="female")
+    state["quiz_data"] = fake_quiz_data(3)
+    state["step"] = "in_quiz"
+    yield state, sent, hooks
+    bot.USER_STATE.pop(7, None)
+
+
+def answer(state, key="A"):
+    context = SimpleNamespace(bot=None)
+    asyncio.run(bot.handle_answer(context, 7, state, key))
+
+
+def test_answer_sends_feedback_and_next(session):
+    state, sent, _ = session
+    answer(state)
+    assert sent[-1] == ("send", "Next ➜")
+    result = bot.build_local_result_text(state["quiz_data"]["questions"][0], "A", state["user_info"])
+    assert sent[0] == ("send", result + "\n\n💭 …")
+    assert sent[-2][0] == "edit" and sent[-2][1].startswith(result + "\n\n")
+    assert sent[-2][1] == result + "\n\n" + state["dynamic_feedback"]
+
+
+def test_reset_while_grading_sends_nothing_more(session):
+    state, sent, hooks = session
+    # the restart lands while the instant result is being sent
+    hooks.append(("💭 …", lambda: bot.cancel_inflight(state, "reset")))
+    with pytest.raises(bot.SessionReset):
+        answer(state, "B")
+    assert len(sent) == 1
+    assert state["dynamic_feedback"] == ""
+
+
+def test_reset_before_next_button(session, monkeypatch):
+    state, sent, _ = session
+    real_edit = bot.edit_long_message
+
+    async def edit_then_reset(*args, **kwargs):
+        await real_edit(*args, **kwargs)
+        bot.cancel_inflight(state, "new_pdf")
+
+    monkeypatch.setattr(bot, "edit_long_message", edit_then_reset)
+    with pytest.raises(bot.SessionReset):
+        answer(state)
+    assert ("send", "Next ➜") not in sent
+
+
+def text_update(text):
+    return SimpleNamespace(
+        effective_chat=SimpleNamespace(id=7),
+        message=SimpleNamespace(text=text),
+    )
+
+
+def test_reset_during_results_advice(session):
+    state, sent, hooks = session
+    state["step"] = "ask_mood_after"
+    state["wrong_focus"] = ["Calvin cycle"]
+    hooks.append(("", lambda: bot.cancel_inflight(state, "reset")))  # right after the advice
+    with pytest.raises(bot.SessionReset):
+        asyncio.run(bot._handle_text(text_update("tired"), SimpleNamespace(bot=None)))
+    assert len(sent) == 1 and sent[0][1].startswith("📚")
+    assert state["step"] == "ask_mood_after"
+
+
+def test_reset_stops_a_streaming_chat_reply(session, monkeypatch):
+    state, sent, _ = session
+    state["chat_mode"] = True
+    closed = threading.Event()
+
+    def slow_stream(*args):
+        try:
+            for i in range(100):
+                yield f"part {i} "
+                time.sleep(0.02)
+        finally:
+            closed.set()
+
+    monkeypatch.setattr(bot, "STREAM_CHAT", True)
+    monkeypatch.setattr(bot, "stream_chat_from_pdf", slow_stream)
+
+    async def run():
+        reply = asyncio.create_task(bot._handle_text(text_update("why?"), SimpleNamespace(bot=None)))
+        await asyncio.sleep(0.1)
+        assert state["inflight"]  # the stream is tracked
+        bot.cancel_inflight(state, "reset")
+        with pytest.raises(bot.SessionReset):
+            await reply
+
+    asyncio.run(run())
+    assert closed.wait(1)
+    assert not any(text.startswith("You can start your quiz") for _, text in sent)
+
+
+def test_play_again_runs_on_the_quiz_job_queue(session, monkeypatch):
+    state, sent, _ = session
+    queue = QuizJobQueue(workers=1)
+    monkeypatch.setattr(bot, "QUIZ_JOBS", queue)
+    monkeypatch.setattr(bot, "build_quiz", lambda *args, fresh=False, exclude=(): fake_quiz_data(3, first=4 if fresh else 1))
+    state.update(step="quiz_done", doc_hash="doc", pdf_text="text")
+    bot.USER_STATE[7] = state
+    asyncio.run(bot._handle_button(SimpleNamespace(bot=None), 7, "play_again"))
+    assert ("send", "🔁 New quiz ready!") in sent
+    assert state["quiz_data"]["questions"][0]["question_text"] == "Fake question 4?"
+    assert queue.stats()["running"] == 0 and not state["inflight"]
@@ -0,0 +1,110 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import bot
+
+
+class Query:
+    def __init__(self, data, message_id=100):
+        self.data = data
+        self.message = SimpleNamespace(chat_id=7, message_id=message_id)
+        self.answers = []
+
+    async def answer(self, text=None):
+        self.answers.append(text)
+
+
+@pytest.fixture
+def handled(monkeypatch):
+    """Records _handle_button calls; a call for data in `gate` waits for that event."""
+    calls = []
+    gate = {}
+
+    async def handle_button(context, chat_id, data):
+        calls.append(data)
+        if data in gate:
+            await gate[data].wait()
+
+    monkeypatch.setattr(bot, "_handle_button", handle_button)
+    bot.CALLBACK_KEYS.pop(7, None)
+    yield calls, gate
+    bot.CALLBACK_KEYS.pop(7, None)
+
+
+def tap(query):
+    return bot.handle_buttons(SimpleNamespace(callback_query=query), SimpleNamespace(bot=None))
+
+
+def test_double_tap_while_in_flight_runs_once(handled):
+    calls, gate = handled
+
+    async def run():
+        gate["next_q"] = asyncio.Event()
+        first, second = Query("next_q"), Query("next_q")
+        task = asyncio.create_task(tap(first))
+        await asyncio.sleep(0)
+        await tap(second)  # lands while the first is still running
+        gate["next_q"].set()
+        await task
+        await tap(third := Query("next_q"))  # after it finished
+        return second, third
+
+    second, third = asyncio.run(run())
+    assert calls == ["next_q"]
+    assert second.answers == ["⏳ On it…"] and third.answers == ["Already done 💕"]
+
+
+def test_answers_on_different_messages_are_not_duplicates(handled):
+    calls, _ = handled
+
+    async def run():
+        await tap(Query("ans_A", message_id=1))
+        await tap(Query("ans_B", message_id=1))  # second answer to the same question
+        await tap(Query("ans_B", message_id=2))
+
+    asyncio.run(run())
+    assert calls == ["ans_A", "ans_B"]
+
+
+def test_non_idempotent_buttons_always_run(handled):
+    calls, _ = handled
+
+    async def run():
+        for _ in range(2):
+            await tap(Query("daily_msg"))
+
+    asyncio.run(run())
+    assert calls == ["daily_msg", "daily_msg"]
+
+
+def test_remembered_keys_are_bounded(handled, monkeypatch):
+    monkeypatch.setattr(bot, "MAX_CALLBACK_KEYS", 3)
+
+    async def run():
+        for message_id in range(5):
+            await tap(Query("next_q", message_id=message_id))
+
+    asyncio.run(run())
+    assert list(bot.CALLBACK_KEYS[7]) == ["2:next_q", "3:next_q", "4:next_q"]
+
+
+def test_failed_tap_releases_its_key(handled, monkeypatch):
+    attempts = []
+
+    async def flaky(context, chat_id, data):
+        attempts.append(data)
+        if len(attempts) == 1:
+            raise RuntimeError("handler failed")
+
+    monkeypatch.setattr(bot, "_handle_button", flaky)
+
+    async def run():
+        with pytest.raises(RuntimeError):
+            await tap(Query("play_again"))
+        await tap(retry := Query("play_again"))
+        return retry
+
+    retry = asyncio.run(run())
+    assert attempts == ["play_again", "play_again"] and retry.answers == [None]
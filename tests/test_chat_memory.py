@@ -0,0 +1,103 @@
+import asyncio
+
+import bot
+import metrics
+import chat_memory
+
+
+def long_turn(i):
+    return f"question {i}", "word " * 200  # ~250 tokens each
+
+
+def test_follow_up_needs_history_and_an_early_pronoun():
+    memory = chat_memory.new_memory()
+    assert not chat_memory.is_follow_up("and why is that?", memory)  # nothing to follow
+
+    chat_memory.add_turn(memory, "What is ATP?", "The cell's energy currency.")
+    assert chat_memory.is_follow_up("and why is that?", memory)
+    assert chat_memory.is_follow_up("What does it mean?", memory)
+    assert not chat_memory.is_follow_up("What is the role of this enzyme in glycolysis?", memory)
+    assert not chat_memory.is_follow_up("Explain mitosis", memory)
+
+
+def test_turns_the_summarizer_cannot_keep_up_with_are_compacted_not_lost(monkeypatch):
+    monkeypatch.setattr(chat_memory, "HISTORY_TOKENS", 600)
+    before = metrics.COUNTERS["chat.memory_compacted"]
+    memory = chat_memory.new_memory()
+    for i in range(8):  # no fold runs in between
+        chat_memory.add_turn(memory, *long_turn(i))
+
+    assert metrics.COUNTERS["chat.memory_compacted"] - before == 8 - len(memory["pending"]) - len(memory["turns"])
+    assert "- Student asked: question 0" in memory["summary"]
+    assert len(memory["summary"]) <= chat_memory.SUMMARY_TOKENS * 4
+
+
+def test_bot_keeps_the_fold_task_until_it_is_done(monkeypatch):
+    monkeypatch.setattr(chat_memory, "HISTORY_TOKENS", 300)
+    monkeypatch.setattr(bot, "summarize_chat_history", lambda summary, turns: f"{len(turns)} turns")
+    state = {"chat_memory": chat_memory.new_memory()}
+
+    async def run():
+        for i in range(2):
+            bot.remember_chat_turn(state, *long_turn(i))
+        task = state["chat_memory"]["fold_task"]
+        assert task is not None and not task.done()
+        await task
+
+    asyncio.run(run())
+    assert state["chat_memory"]["summary"] == "1 turns" and state["chat_memory"]["pending"] == []
+
+
+def test_recent_turns_stay_within_the_token_budget(monkeypatch):
+    monkeypatch.setattr(chat_memory, "HISTORY_TOKENS", 600)
+    memory = chat_memory.new_memory()
+    assert not chat_memory.add_turn(memory, "short?", "short.")
+    for i in range(3):
+        needs_fold = chat_memory.add_turn(memory, *long_turn(i))
+    assert needs_fold
+    assert sum(map(chat_memory._turn_tokens, memory["turns"])) <= 600
+    assert memory["pending"][0]["question"] == "short?"  # oldest moved out first
+
+
+def test_history_renders_summary_then_pending_then_recent():
+    memory = chat_memory.new_memory()
+    memory.update(
+        summary="Talked about ATP.",
+        pending=[{"question": "q1", "answer": "a1"}],
+        turns=[{"question": "q2", "answer": "a2"}],
+    )
+    assert chat_memory.render_history(memory) == (
+        "Summary of earlier conversation:\nTalked about ATP.\n\n"
+        "Student: q1\nYou: a1\n\nStudent: q2\nYou: a2"
+    )
+
+
+def test_fold_keeps_turns_added_while_summarizing(monkeypatch):
+    memory = chat_memory.new_memory()
+    memory["pending"] = [{"question": "q1", "answer": "a1"}]
+    late = {"question": "q2", "answer": "a2"}
+    batches = []
+
+    def summarize(summary, turns):
+        batches.append([t["question"] for t in turns])
+        if len(batches) == 1:
+            memory["pending"].append(late)  # arrives mid-summary
+        return "x" * 5000  # over budget
+
+    monkeypatch.setattr(bot, "summarize_chat_history", summarize)
+    asyncio.run(bot._fold_chat_memory(memory))
+    assert batches == [["q1"], ["q2"]] and memory["pending"] == []
+    assert len(memory["summary"]) == chat_memory.SUMMARY_TOKENS * 4
+
+
+def test_failed_fold_keeps_pending_turns(monkeypatch):
+    memory = chat_memory.new_memory()
+    memory["pending"] = [{"question": "q1", "answer": "a1"}]
+
+    def fail(summary, turns):
+        raise RuntimeError("LLM down")
+
+    monkeypatch.setattr(bot, "summarize_chat_history", fail)
+    asyncio.run(bot._fold_chat_memory(memory))
+    assert memory["pending"] == [{"question": "q1", "answer": "a1"}]
+    assert "Student: q1" in chat_memory.render_history(memory)
@@ -0,0 +1,79 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+import daily_delivery
+from daily_delivery import LocalBatchClient, SUBSCRIBERS
+
+USER = {"name": "Mia", "gender": "female", "country": "Italy"}
+
+
+class FakeJobQueue:
+    def __init__(self):
+        self.jobs = []
+
+    def run_once(self, callback, when, data=None, name=None):
+        self.jobs.append((when, data))
+
+
+@pytest.fixture(autouse=True)
+def subscribers(tmp_path, monkeypatch):
+    monkeypatch.setattr(daily_delivery, "SUBSCRIBERS_FILE", str(tmp_path / "subscribers.json"))
+    SUBSCRIBERS.clear()
+    daily_delivery.IN_FLIGHT.clear()
+    soon = (datetime.now(timezone.utc) + timedelta(minutes=30)).strftime("%H:%M")
+    daily_delivery.subscribe(1, soon, 0, USER, {"study_guide": {"key_topics": ["Cells"]}})
+    daily_delivery.subscribe(2, soon, 0, dict(USER, name="Ana"))
+    yield
+    SUBSCRIBERS.clear()
+
+
+def plan(monkeypatch, client):
+    monkeypatch.setattr(daily_delivery, "get_batch_client", lambda: client)
+    context = SimpleNamespace(job_queue=FakeJobQueue())
+    asyncio.run(daily_delivery.plan_deliveries(context))
+    return context.job_queue.jobs
+
+
+def test_batch_messages_are_scheduled_and_marked_planned(monkeypatch):
+    jobs = plan(monkeypatch, LocalBatchClient())
+    assert sorted(chat_id for _, (chat_id, _) in jobs) == [1, 2]
+    assert all(sub["planned_for"] for sub in SUBSCRIBERS.values())
+    # a second run in the same window plans nothing new
+    assert plan(monkeypatch, LocalBatchClient()) == []
+
+
+def test_batch_failure_falls_back_to_direct_messages(monkeypatch):
+    def broken(prompt):
+        raise TimeoutError("batch job still running")
+
+    jobs = plan(monkeypatch, LocalBatchClient(broken))
+    texts = {chat_id: text for _, (chat_id, text) in jobs}
+    assert set(texts) == {1, 2} and all(texts.values())
+    assert all(sub["planned_for"] for sub in SUBSCRIBERS.values())
+    assert not daily_delivery.IN_FLIGHT
+
+
+def test_unreadable_batch_output_falls_back(monkeypatch):
+    jobs = plan(monkeypatch, LocalBatchClient(lambda prompt: "not json"))
+    assert sorted(chat_id for _, (chat_id, _) in jobs) == [1, 2]
+
+
+def test_nothing_is_planned_when_generation_crashes(monkeypatch):
+    def crash(chat_id, sub):
+        raise RuntimeError("no messages at all")
+
+    monkeypatch.setattr(daily_delivery, "direct_daily_message", crash)
+    with pytest.raises(RuntimeError):
+        plan(monkeypatch, LocalBatchClient(lambda prompt: None))
+    assert not any(sub["planned_for"] for sub in SUBSCRIBERS.values())
+    assert not daily_delivery.IN_FLIGHT
+
+
+def test_in_flight_subscribers_are_not_due_again():
+    now = datetime.now(timezone.utc)
+    window = (now, timedelta(0), timedelta(hours=2))
+    daily_delivery.IN_FLIGHT.add(1)
+    assert [chat_id for chat_id, _, _ in daily_delivery.due_subscribers(*window)] == [2]
@@ -0,0 +1,90 @@
+import asyncio
+import uuid
+from types import SimpleNamespace
+
+import pytest
+
+import bot
+from llm_backend import fake_quiz_data
+from query_pdf import generate_feedback_batch, lookup_batch_feedback
+
+USER = {"name": "Mia", "gender": "female", "country": "Italy"}
+
+
+def test_one_request_covers_every_question_and_option():
+    bank = generate_feedback_batch(fake_quiz_data(3), USER)
+    assert sorted(bank) == ["1", "2", "3"]
+    assert all(sorted(choices) == list("ABCDE") for choices in bank.values())
+
+
+def test_lookup_adds_the_header_locally():
+    quiz = fake_quiz_data(2)
+    q = quiz["questions"][0]  # correct answer B
+    text = lookup_batch_feedback({"1": {"A": "  Nice try.  "}}, 0, q, "A")
+    assert text == "You selected: [A] Option A\nCorrect answer: [B] Option B\n\nNice try."
+
+
+@pytest.mark.parametrize("bank", [None, {}, {"2": {"A": "x"}}, {"1": {"B": "x"}}, {"1": {"A": ""}}])
+def test_missing_or_partial_batch_misses(bank):
+    q = fake_quiz_data(1)["questions"][0]
+    assert lookup_batch_feedback(bank, 0, q, "A") is None
+
+
+@pytest.fixture
+def session(monkeypatch):
+    sent = []
+
+    class Message:
+        chat_id = 7
+
+        async def edit_text(self, text, **kwargs):
+            sent.append(("edit", text))
+
+    async def send(bot_, chat_id, text, coalesce=True, **kwargs):
+        sent.append(("send", text))
+        return Message()
+
+    monkeypatch.setattr(bot.OUTBOX, "send", send)
+    state = bot._init_state(7)
+    state.update(step="in_quiz", quiz_data=fake_quiz_data(2), doc_hash=uuid.uuid4().hex)
+    state["user_info"].update(USER)
+    yield state, sent
+    bot.USER_STATE.pop(7, None)
+
+
+def answer(state, key):
+    asyncio.run(bot.handle_answer(SimpleNamespace(bot=None), 7, state, key))
+
+
+def test_partial_batch_falls_back_to_per_question_generation(session, monkeypatch):
+    state, sent = session
+    generated = []
+    monkeypatch.setattr(bot, "generate_dynamic_feedback",
+                        lambda payload: generated.append(payload["selected_key"]) or "Generated feedback.")
+    state["feedback_bank"] = {"1": {"B": "From the batch."}}  # nothing for option A
+
+    answer(state, "A")
+    assert generated == ["A"] and state["dynamic_feedback"] == "Generated feedback."
+
+    state.update(current_question=0, awaiting_next=False)
+    answer(state, "B")
+    assert generated == ["A"] and state["dynamic_feedback"].endswith("From the batch.")
+
+
+def test_failed_batch_leaves_no_bank(session, monkeypatch):
+    state, _ = session
+
+    def fail(quiz_data, user_info):
+        raise RuntimeError("batch down")
+
+    monkeypatch.setattr(bot, "generate_feedback_batch", fail)
+    asyncio.run(bot._prefetch_feedback_bank(state, state["quiz_data"]))
+    assert state["feedback_bank"] is None
+
+
+def test_batch_for_an_old_quiz_is_not_attached(session):
+    state, _ = session
+    old = state["quiz_data"]
+    state["quiz_data"] = fake_quiz_data(2, first=3)
+    asyncio.run(bot._prefetch_feedback_bank(state, old))
+    assert state["feedback_bank"] is None
@@ -0,0 +1,62 @@
+from feedback_cache import FeedbackCache, fill_name, strip_name
+
+MIA = {"name": "Mia", "gender": "female", "country": "Italy"}
+ANA = {"name": "Ana", "gender": "female", "country": "Italy"}
+LEO = {"name": "Leo", "gender": "male", "country": "Italy"}
+QUESTION = {"question_text": "What divides?", "options": {"A": "Cells", "B": "Rocks"}}
+
+
+def key(cache, user=MIA, doc="doc", selected="A"):
+    return cache.make_key(doc, QUESTION, selected, user)
+
+
+def test_variants_are_served_round_robin():
+    cache = FeedbackCache(max_variants=3, refresh_rate=0.0)
+    k = key(cache)
+    for text in ("One.", "Two.", "Three."):
+        cache.put(k, text, MIA)
+    assert [cache.get(k, MIA) for _ in range(4)] == ["One.", "Two.", "Three.", "One."]
+
+
+def test_only_the_newest_variants_are_kept():
+    cache = FeedbackCache(max_variants=2, refresh_rate=0.0)
+    k = key(cache)
+    for text in ("One.", "Two.", "Two.", "Three."):  # a repeat is not a new variant
+        cache.put(k, text, MIA)
+    assert [cache.get(k, MIA) for _ in range(2)] == ["Two.", "Three."]
+
+
+def test_incomplete_keys_are_sometimes_refreshed():
+    cache = FeedbackCache(max_variants=3, refresh_rate=1.0)
+    k = key(cache)
+    cache.put(k, "One.", MIA)
+    assert cache.get(k, MIA) is None and cache.stats()["refreshes"] == 1
+    for text in ("Two.", "Three."):
+        cache.put(k, text, MIA)
+    assert cache.get(k, MIA) == "One."  # full, so never refreshed
+
+
+def test_least_recently_used_key_is_evicted():
+    cache = FeedbackCache(max_keys=2, refresh_rate=0.0)
+    a, b, c = (key(cache, doc=d) for d in "abc")
+    cache.put(a, "A.", MIA)
+    cache.put(b, "B.", MIA)
+    cache.get(a, MIA)  # a is now the most recent
+    cache.put(c, "C.", MIA)
+    assert cache.get(b, MIA) is None
+    assert cache.get(a, MIA) == "A." and cache.get(c, MIA) == "C."
+    assert cache.stats()["evictions"] == 1
+
+
+def test_same_persona_variant_shares_feedback_with_its_own_name():
+    cache = FeedbackCache(refresh_rate=0.0)
+    cache.put(key(cache, MIA), "Well done Mia, cells divide.", MIA)
+    assert key(cache, MIA) == key(cache, ANA) != key(cache, LEO)
+    assert cache.get(key(cache, ANA), ANA) == "Well done Ana, cells divide."
+    assert cache.get(key(cache, LEO), LEO) is None
+
+
+def test_name_placeholder_round_trip():
+    stored = strip_name("Mia, Mia! Miami is not you.", MIA)
+    assert "Miami" in stored and "Mia" not in stored.replace("Miami", "")
+    assert fill_name(stored, ANA) == "Ana, Ana! Miami is not you."
@@ -0,0 +1,103 @@
+import sys
+import types
+
+import pytest
+from PIL import Image
+
+import query_telegram
+from query_telegram import EncodedImageStore, encoded_images, get_image_store
+
+
+def _pages(n, size=(40, 30)):
+    return [Image.new("RGB", size, (i * 40 % 255, 80, 120)) for i in range(n)]
+
+
+@pytest.fixture
+def renders(monkeypatch):
+    """Counts pdf2image renders; every 'PDF' has three pages."""
+    calls = []
+
+    def convert_from_bytes(data, dpi):
+        calls.append((data, dpi))
+        return _pages(3)
+
+    monkeypatch.setitem(sys.modules, "pdf2image", types.SimpleNamespace(convert_from_bytes=convert_from_bytes))
+    monkeypatch.setattr(query_telegram, "IMAGE_STORES", type(query_telegram.IMAGE_STORES)())
+    return calls
+
+
+def test_store_serves_views_without_copying():
+    store = EncodedImageStore(dpi=100, quality=70)
+    store.add_pages(_pages(2))
+    first = store.get(0)
+    store.add_pages(_pages(4))  # pages 2-3 appended as a new chunk
+
+    assert len(store) == 4
+    assert bytes(first).startswith(b"\xff\xd8")  # still a valid JPEG view
+    assert all(isinstance(p, memoryview) for p in store.payloads())
+    assert store.nbytes == sum(len(p) for p in store.payloads())
+
+
+def test_store_keeps_its_render_settings(renders):
+    store = get_image_store(b"pdf", dpi=100, quality=60)
+    assert (store.dpi, store.quality) == (100, 60)
+    assert len(store.payloads()) == 3
+
+
+def test_document_rendered_once_per_setting(renders):
+    a = get_image_store(b"pdf")
+    b = get_image_store(b"pdf")
+    c = get_image_store(b"pdf", dpi=100)
+
+    assert a is b and c is not a
+    assert len(renders) == 2
+
+
+def test_lru_eviction_by_document_count(renders, monkeypatch):
+    monkeypatch.setattr(query_telegram, "IMAGE_STORE_MAX_DOCS", 2)
+    get_image_store(b"one")
+    get_image_store(b"two")
+    get_image_store(b"one")  # most recent again
+    get_image_store(b"three")
+
+    docs = {key[0] for key in query_telegram.IMAGE_STORES}
+    assert len(docs) == 2
+    assert query_telegram.hashlib.sha256(b"two").hexdigest() not in docs
+
+
+def test_lru_eviction_by_size(renders, monkeypatch):
+    monkeypatch.setattr(query_telegram, "IMAGE_STORE_MAX_BYTES", 1)
+    get_image_store(b"one")
+    get_image_store(b"two")
+    assert len(query_telegram.IMAGE_STORES) == 1  # the newest is always kept
+
+
+def test_extraction_uses_the_store(renders, monkeypatch):
+    class Reader:
+        def __init__(self, _):
+            self.pages = [types.SimpleNamespace(extract_text=lambda: "page text")]
+
+    monkeypatch.setitem(sys.modules, "PyPDF2", types.SimpleNamespace(PdfReader=Reader))
+    text, images = query_telegram.extract_pdf_text_and_images(b"pdf")
+    _, again = query_telegram.extract_pdf_text_and_images(b"pdf")
+
+    assert text == "page text"
+    assert images is again and len(renders) == 1
+    assert encoded_images(images) == images.payloads()
+
+
+def test_hf_generate_sends_store_payloads(renders, monkeypatch):
+    sent = {}
+
+    class Client:
+        def chat_completion(self, messages, max_tokens, temperature):
+            sent["messages"] = messages
+            message = types.SimpleNamespace(message={"content": "ok"})
+            return types.SimpleNamespace(choices=[message])
+
+    monkeypatch.setattr(query_telegram, "get_hf_client", lambda: Client())
+    store = get_image_store(b"pdf")
+    assert query_telegram.hf_generate("hi", images=store) == "ok"
+
+    images = [m["image"] for m in sent["messages"] if m["type"] == "image"]
+    assert [bytes(i) for i in images] == [bytes(p) for p in store.payloads()]
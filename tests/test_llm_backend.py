@@ -0,0 +1,119 @@
+import time
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import llm_backend
+from llm_backend import CircuitBreaker, LLMBackend, LLMUnavailable
+
+
+class ScriptedBackend(LLMBackend):
+    """Call n sleeps delays[n] and then replies (or raises) as scripted."""
+    name = "scripted"
+
+    def __init__(self, delays, fail=()):
+        self.delays = list(delays)
+        self.fail = set(fail)
+        self.calls = 0
+        self.closed = []
+        self._lock = threading.Lock()
+
+    def _next_call(self) -> int:
+        with self._lock:
+            self.calls += 1
+            return self.calls - 1
+
+    def generate(self, prompt, model, task, images=None):
+        n = self._next_call()
+        time.sleep(self.delays[n])
+        if n in self.fail:
+            raise RuntimeError(f"attempt {n} failed")
+        return f"reply {n}"
+
+    def stream(self, prompt, model, task):
+        n = self._next_call()
+        try:
+            time.sleep(self.delays[n])
+            yield f"{n}a"
+            if n in self.fail:
+                time.sleep(1.0)  # stalls mid-stream
+            yield f"{n}b"
+        finally:
+            self.closed.append(n)
+
+
+@pytest.fixture
+def scripted(monkeypatch):
+    def install(delays, fail=(), failure_threshold=3):
+        backend = ScriptedBackend(delays, fail)
+        monkeypatch.setitem(llm_backend.BACKENDS, backend.name, backend)
+        monkeypatch.setitem(llm_backend.MODEL_TIERS, backend.name, {"large": "m", "small": "m"})
+        monkeypatch.setitem(llm_backend.BREAKERS, backend.name,
+                            CircuitBreaker(backend, failure_threshold=failure_threshold, cooldown=60))
+        monkeypatch.setattr(llm_backend, "DEFAULT_BACKEND", backend.name)
+        return backend
+
+    monkeypatch.setattr(llm_backend, "hedge_deadline", lambda task, series="attempt": 0.05)
+    monkeypatch.setitem(llm_backend.TIMEOUTS, "feedback", 0.5)
+    return install
+
+
+def test_slow_attempt_is_hedged_and_hedge_wins(scripted):
+    backend = scripted([1.0, 0.0])
+    assert llm_backend.generate("feedback", "p") == "reply 1"
+    assert backend.calls == 2
+
+
+def test_no_hedge_when_pool_is_saturated(scripted, monkeypatch):
+    backend = scripted([0.2, 0.0])
+    monkeypatch.setattr(llm_backend, "HEDGE_WORKERS", 1)
+    assert llm_backend.generate("feedback", "p") == "reply 0"
+    assert backend.calls == 1
+
+
+def test_no_hedge_when_breaker_is_open(scripted):
+    backend = scripted([0.2, 0.0])
+    open_breaker = SimpleNamespace(is_open=True)
+    submit = lambda: llm_backend._submit(backend.generate, "p", "m", "feedback")
+    future, index = llm_backend._hedged("feedback", submit, breaker=open_breaker)
+    assert (future.result(), index) == ("reply 0", 0)
+    assert backend.calls == 1
+
+
+def test_hard_timeout(scripted):
+    scripted([2.0, 2.0])
+    start = time.perf_counter()
+    with pytest.raises(TimeoutError):
+        llm_backend.generate("feedback", "p")
+    assert time.perf_counter() - start < 1.0
+
+
+def test_breaker_opens_and_fails_fast(scripted):
+    scripted([0.0] * 5, fail=range(5), failure_threshold=2)
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            llm_backend.generate("advice", "p")
+    with pytest.raises(LLMUnavailable):
+        llm_backend.generate("advice", "p")
+    assert llm_backend.is_degraded("advice")
+
+
+def test_stream_follows_the_first_to_answer_and_closes_the_other(scripted):
+    backend = scripted([0.3, 0.0])
+    assert list(llm_backend.stream("feedback", "p")) == ["1a", "1b"]
+    deadline = time.time() + 2
+    while sorted(backend.closed) != [0, 1] and time.time() < deadline:
+        time.sleep(0.02)
+    assert sorted(backend.closed) == [0, 1]
+
+
+def test_stalled_stream_times_out(scripted, monkeypatch):
+    scripted([0.0], fail={0})
+    monkeypatch.setattr(llm_backend, "STREAM_CHUNK_TIMEOUT", 0.1)
+    chunks = llm_backend.stream("feedback", "p")
+    assert next(chunks) == "0a"
+    start = time.perf_counter()
+    with pytest.raises(TimeoutError):
+        next(chunks)
+    assert time.perf_counter() - start < 0.5
@@ -0,0 +1,85 @@
+import pytest
+
+import message_pool
+from message_pool import MessagePool, pool_key, pool_seed, seed_quiz
+
+USER = {"name": "Mia", "gender": "female", "country": "Italy"}
+SEED = "cells"
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    pool = MessagePool(max_size=4, max_pools=2, max_seen=3)
+    refills = []
+    monkeypatch.setattr(pool, "refill_async", lambda *args: refills.append(args[0]) or True)
+    pool.refills = refills
+    return pool
+
+
+def fill(pool, kind="daily", seed=SEED, n=4):
+    key = pool_key(kind, USER, seed)
+    pool.add(key, [f"[NAME], {kind} message {i}" for i in range(n)])
+    return key
+
+
+def test_user_never_gets_the_same_message_twice(pool):
+    fill(pool)
+    got = [pool.get("daily", USER, SEED, user_id=1) for _ in range(5)]
+    assert got[:4] == [f"Mia, daily message {i}" for i in range(4)]
+    assert got[4] is None
+    assert pool.refills  # ran low → refill requested
+    # another user starts from the top
+    assert pool.get("daily", USER, SEED, user_id=2) == "Mia, daily message 0"
+
+
+def test_seen_sets_are_lru_bounded(pool):
+    fill(pool)
+    for user_id in range(10):
+        pool.get("daily", USER, SEED, user_id)
+    assert pool.stats()["seen_entries"] == 3
+    # the oldest users were forgotten, the latest still remembered
+    assert pool.get("daily", USER, SEED, user_id=9) == "Mia, daily message 1"
+
+
+def test_seen_set_only_keeps_messages_still_in_the_pool(pool):
+    key = fill(pool)
+    for _ in range(4):
+        pool.get("daily", USER, SEED, user_id=1)
+    pool.add(key, ["[NAME], fresh 1", "[NAME], fresh 2"])  # pushes out two old ones
+    assert pool.get("daily", USER, SEED, user_id=1) == "Mia, fresh 1"
+    assert len(pool._seen[(1, key)]) == 3
+
+
+def test_pools_are_lru_bounded(pool):
+    fill(pool, seed="a")
+    fill(pool, seed="b")
+    pool.get("daily", USER, "a", user_id=1)  # "a" is recent
+    fill(pool, seed="c")
+    assert pool.stats()["pools"] == 2
+    assert pool.get("daily", USER, "b", user_id=1) is None
+    assert pool.get("daily", USER, "a", user_id=1)
+
+
+def test_learners_of_one_document_share_a_pool():
+    guide = {"key_topics": ["Cells", "Mitosis", "DNA", "Enzymes"]}
+    mia = {"study_guide": guide, "daily_romantic_message_seed": "Mia, my love, cells…"}
+    ana = {"study_guide": guide, "daily_romantic_message_seed": "Ana, darling, mitosis…"}
+    assert pool_seed(mia) == pool_seed(ana) == "cells, mitosis, dna"
+    assert pool_key("daily", USER, pool_seed(mia)) == pool_key("daily", dict(USER, name="Ana"), pool_seed(ana))
+    assert seed_quiz("daily", "cells") == {"daily_romantic_message_seed": "Today's study topics: cells"}
+    assert seed_quiz("gods", "cells") is None and pool_seed(None) == ""
+
+
+def test_prewarm_only_records_and_warm_fills_later(monkeypatch):
+    pool = MessagePool(batch_size=2)
+    calls = []
+    monkeypatch.setattr(message_pool, "generate_message_batch",
+                        lambda kind, user, quiz, n: calls.append((kind, quiz)) or [f"[NAME] {kind} {i}" for i in range(n)])
+    pool.prewarm(USER, SEED)
+    assert calls == [] and pool.stats()["wanted"] == 3
+
+    assert pool.warm(limit=2) == 2
+    pool._executor.shutdown(wait=True)
+    # most recently wanted first; the daily pool is still waiting
+    assert calls == [("gods", None), ("night", {"night_mode_message_seed": "Today's study topics: cells"})]
+    assert pool.stats()["wanted"] == 1
@@ -0,0 +1,27 @@
+import threading
+
+import metrics
+
+
+def test_snapshot_while_observing():
+    stop = threading.Event()
+
+    def writer(n):
+        i = 0
+        while not stop.is_set():
+            metrics.observe(f"test.metrics.{n}.{i % 50}", 0.01 * (i % 7))
+            i += 1
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(4)]
+    for t in threads:
+        t.start()
+    try:
+        for _ in range(50):
+            snap = metrics.snapshot()
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
+
+    timing = snap["timings"]["test.metrics.0.0"]
+    assert timing["count"] >= 1 and timing["p50"] <= timing["p95"]
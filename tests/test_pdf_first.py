@@ -0,0 +1,96 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import bot
+from llm_backend import fake_quiz_data
+from quiz_jobs import QuizJobQueue
+from send_queue import Outbox
+
+
+class SentMessage:
+    def __init__(self, log, chat_id):
+        self.log = log
+        self.chat_id = chat_id
+
+    async def edit_text(self, text, **kwargs):
+        self.log.append(("edit", text))
+
+
+class FakeBot:
+    def __init__(self):
+        self.log = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.log.append(("send", text))
+        return SentMessage(self.log, chat_id)
+
+
+def neutral_content():
+    data = fake_quiz_data(3)
+    return {"summary": "Neutral summary.", "study_guide": data["study_guide"], "questions": data["questions"]}
+
+
+@pytest.fixture
+def chat(monkeypatch):
+    calls = []
+    monkeypatch.setattr(bot, "OUTBOX", Outbox(global_rate=1000, per_chat_rate=1000))
+    monkeypatch.setattr(bot, "QUIZ_JOBS", QuizJobQueue(workers=1))
+    monkeypatch.setattr(bot, "extract_document_text", lambda doc_hash, data: "Cells divide.")
+    monkeypatch.setattr(bot, "get_neutral_content",
+                        lambda doc_hash, text: calls.append(("neutral", text)) or neutral_content())
+    monkeypatch.setattr(bot, "style_quiz", lambda neutral, user: calls.append(("style", user["name"])) or dict(
+        fake_quiz_data(3), sweet_summary=f"For {user['name']}."))
+    monkeypatch.setattr(bot, "start_feedback_prefetch", lambda state: None)
+    bot._init_state(7)
+    yield SimpleNamespace(bot=FakeBot(), args=None), calls
+    bot.USER_STATE.pop(7, None)
+
+
+def pdf_update():
+    async def download_as_bytearray():
+        return bytearray(b"%PDF-1.4 fake")
+
+    async def get_file():
+        return SimpleNamespace(download_as_bytearray=download_as_bytearray)
+
+    document = SimpleNamespace(mime_type="application/pdf", get_file=get_file)
+    return SimpleNamespace(effective_chat=SimpleNamespace(id=7), message=SimpleNamespace(document=document))
+
+
+def text_update(text):
+    return SimpleNamespace(effective_chat=SimpleNamespace(id=7), message=SimpleNamespace(text=text))
+
+
+def test_pdf_sent_before_onboarding_is_ready_when_it_ends(chat):
+    context, calls = chat
+
+    async def run():
+        await bot.handle_pdf(pdf_update(), context)
+        state = bot.USER_STATE[7]
+        assert state["step"] == "ask_name" and state.get("pdf_task")
+        # the document is read and the neutral quiz generated during onboarding
+        await asyncio.wait_for(asyncio.shield(state["pdf_task"]), 2)
+        assert calls == [("neutral", "Cells divide.")]
+
+        for answer in ("Mia", "1", "Italy", "curious"):
+            await bot.handle_text(text_update(answer), context)
+        return state
+
+    state = asyncio.run(run())
+    assert calls == [("neutral", "Cells divide."), ("style", "Mia")]
+    assert state["step"] == "ready_for_quiz" and state["pdf_text"] == "Cells divide."
+    assert state["quiz_data"]["sweet_summary"] == "For Mia."
+    sent = [text for kind, text in context.bot.log if kind == "send"]
+    assert "📘 Finishing your study guide… ❤️" in sent
+    assert "📄 Now send your study PDF… ❤️" not in sent
+    assert sent[-1] == "What would you like to do next?"
+
+
+def test_pdf_after_onboarding_finishes_right_away(chat):
+    context, calls = chat
+    bot.USER_STATE[7].update(step="await_pdf", user_info={"name": "Leo", "gender": "male", "country": "Spain"})
+    asyncio.run(bot.handle_pdf(pdf_update(), context))
+    assert calls == [("neutral", "Cells divide."), ("style", "Leo")]
+    assert bot.USER_STATE[7]["step"] == "ready_for_quiz"
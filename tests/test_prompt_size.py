@@ -0,0 +1,10 @@
+import bench
+
+
+def test_prompt_sizes_are_deterministic():
+    for variant in ("verbose", "compact"):
+        assert bench.render_prompt_tokens(variant) == bench.render_prompt_tokens(variant)
+
+
+def test_no_prompt_size_regression():
+    assert bench.bench_prompt_size()
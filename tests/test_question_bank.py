@@ -0,0 +1,126 @@
+import pytest
+
+import question_bank
+import quiz_pipeline
+from question_bank import QuestionBank, TIER_SIZES
+
+
+def make_question(text, tier, key="A"):
+    return {
+        "question_text": text,
+        "options": {"A": "one", "B": "two", "C": "three", "D": "four", "E": "Pass"},
+        "correct_answer_key": key,
+        "focus_if_wrong": f"Review {text.lower()}",
+        "tier": tier,
+    }
+
+
+def make_content(prefix="Q", extra=0):
+    questions = [
+        make_question(f"{prefix} {tier} question {i} about topic{i}", tier, "ABCD"[i % 4])
+        for tier, size in TIER_SIZES
+        for i in range(size + extra)
+    ]
+    return {"summary": "A summary.", "study_guide": {"overall_advice": "Study."}, "questions": questions}
+
+
+@pytest.fixture
+def bank(tmp_path):
+    return QuestionBank(str(tmp_path / "bank.db"))
+
+
+def test_tier_sizes_follow_the_generation_tiers():
+    assert [size for _, size in TIER_SIZES] == [5, 5, 7]
+
+
+def test_duplicates_are_skipped(bank):
+    content = make_content()
+    assert bank.add("doc", content) == 17
+    # same questions, different case/punctuation
+    for q in content["questions"]:
+        q["question_text"] = q["question_text"].upper() + "?!"
+    assert bank.add("doc", content) == 0
+    assert bank.stats()["questions"] == 17
+
+
+def test_assemble_uses_each_questions_own_tier(bank):
+    content = make_content()
+    content["questions"].reverse()  # position no longer says anything about the tier
+    bank.add("doc", content)
+
+    quiz = bank.assemble("doc")
+    tiers = [q["tier"] for q in quiz["questions"]]
+    assert tiers == [name for name, size in TIER_SIZES for _ in range(size)]
+    assert quiz["summary"] == "A summary."
+
+
+def test_untagged_questions_are_not_stored(bank):
+    content = make_content()
+    del content["questions"][0]["tier"]
+    assert bank.add("doc", content) == 16
+    assert bank.assemble("doc") is None  # EASY is one short
+
+
+def test_unknown_document_misses(bank):
+    assert bank.assemble("nope") is None
+    assert bank.stats()["misses"] == 1
+
+
+def test_least_served_questions_rotate(bank):
+    bank.add("doc", make_content(extra=2))
+    first = {q["question_text"] for q in bank.assemble("doc")["questions"]}
+    second = {q["question_text"] for q in bank.assemble("doc")["questions"]}
+    assert len(first & second) < 17
+    assert bank.stats()["hits"] == 2
+
+
+def test_search_is_scoped_to_the_document(bank):
+    if not bank.fts:
+        pytest.skip("SQLite built without FTS5")
+    bank.add("doc", make_content())
+    bank.add("other", make_content(prefix="Other"))
+
+    found = bank.search("topic3", doc_hash="doc")
+    assert found and all(q["question_text"].startswith("Q ") for q in found)
+    assert bank.search('"unbalanced', doc_hash="doc") == []
+    assert bank.search("   ") == []
+
+
+def test_bank_is_opened_lazily(tmp_path, monkeypatch):
+    path = tmp_path / "lazy.db"
+    monkeypatch.setattr(question_bank, "QUESTION_BANK_PATH", str(path))
+    monkeypatch.setattr(question_bank, "_BANK", None)
+    assert not path.exists()
+    bank = question_bank.get_question_bank()
+    assert bank is question_bank.get_question_bank()
+    assert path.exists()
+
+
+def test_disabled_bank(monkeypatch):
+    monkeypatch.setattr(question_bank, "QUESTION_BANK_PATH", "")
+    monkeypatch.setattr(question_bank, "_BANK", None)
+    assert question_bank.get_question_bank() is None
+
+
+def test_assemble_leaves_out_excluded_questions(bank):
+    bank.add("doc", make_content())
+    bank.add("doc", make_content(prefix="New"))
+    played = bank.assemble("doc")["questions"]
+    exclude = {question_bank.normalized_question_hash(q) for q in played}
+
+    again = bank.assemble("doc", exclude=exclude)["questions"]
+    assert not exclude & {question_bank.normalized_question_hash(q) for q in again}
+    # nothing left that wasn't played: a miss, so the caller generates
+    assert bank.assemble("doc", exclude=exclude | {question_bank.normalized_question_hash(q) for q in again}) is None
+
+
+def test_play_again_is_assembled_from_the_bank(bank, monkeypatch):
+    bank.add("doc", make_content())
+    bank.add("doc", make_content(prefix="New"))
+    monkeypatch.setattr(quiz_pipeline, "get_question_bank", lambda: bank)
+    monkeypatch.setattr(quiz_pipeline, "generate_neutral_content",
+                        lambda *args, **kwargs: pytest.fail("generated despite a bank hit"))
+    played = bank.assemble("doc")["questions"]
+
+    fresh = quiz_pipeline.get_neutral_content("doc", "text", fresh=True, exclude=played)
+    assert not {q["question_text"] for q in played} & {q["question_text"] for q in fresh["questions"]}
@@ -0,0 +1,116 @@
+import json
+import re
+import time
+
+import pytest
+
+import llm_backend
+import query_pdf
+
+
+def scripted_generate(tier_reply):
+    """llm.generate stand-in: the guide is instant, tiers answer via tier_reply(name, first, n)."""
+    def generate(task, prompt, images=None):
+        if task == "quiz_guide":
+            return json.dumps({"summary": "S", "study_guide": {"overall_advice": "A"}})
+        name = re.search(r"Write the (\w+) questions", prompt).group(1)
+        first = int(re.search(r"\(questions (\d+)", prompt).group(1))
+        n = int(re.search(r"Generate EXACTLY (\d+)", prompt).group(1))
+        return json.dumps({"questions": tier_reply(name, first, n)})
+    return generate
+
+
+def questions(first, n, text="Question {}?"):
+    return [
+        {"question_text": text.format(i), "options": {"A": "a", "B": "b", "C": "c", "D": "d", "E": "Pass"},
+         "correct_answer_key": "A", "focus_if_wrong": "x"}
+        for i in range(first, first + n)
+    ]
+
+
+def test_fake_backend_fans_out_to_a_full_tagged_quiz():
+    content = query_pdf.generate_neutral_content_fanout("text")
+    assert len(content["questions"]) == 17
+    assert [q["tier"] for q in content["questions"]] == ["EASY"] * 5 + ["MEDIUM"] * 5 + ["HARD"] * 7
+
+
+def test_repeated_questions_are_replaced_by_a_top_up(monkeypatch):
+    calls = []
+
+    def reply(name, first, n):
+        calls.append(n)
+        if n == 1:  # the top-up, for whichever tier lost the race
+            return questions(100 + first, 1, "Extra {}?")
+        qs = questions(first, n)
+        if name == "HARD":
+            qs[0]["question_text"] = "question 1"  # repeats EASY's first, modulo case/punctuation
+        return qs
+
+    monkeypatch.setattr(llm_backend, "generate", scripted_generate(reply))
+    content = query_pdf.generate_neutral_content_fanout("text")
+    texts = [query_pdf.normalize_question(q["question_text"]) for q in content["questions"]]
+    assert len(texts) == 17 and len(set(texts)) == 17
+    assert [q["tier"] for q in content["questions"]] == ["EASY"] * 5 + ["MEDIUM"] * 5 + ["HARD"] * 7
+    assert calls.count(1) == 1
+
+
+def test_top_up_asks_for_the_missing_count_and_lists_existing_questions(monkeypatch):
+    prompts = []
+
+    def reply(name, first, n):
+        if name != "MEDIUM":
+            return questions(first, n)
+        if n == 5:
+            return questions(first, 3)  # short reply
+        return questions(100, n, "Extra {}?")
+
+    base = scripted_generate(reply)
+
+    def generate(task, prompt, images=None):
+        prompts.append(prompt)
+        return base(task, prompt, images)
+
+    monkeypatch.setattr(llm_backend, "generate", generate)
+    content = query_pdf.generate_neutral_content_fanout("text")
+    assert len(content["questions"]) == 17
+    top_up = [p for p in prompts if "Do NOT repeat" in p]
+    assert len(top_up) == 1 and "Generate EXACTLY 2 " in top_up[0] and "- Question 6?" in top_up[0]
+
+
+def test_progress_counts_accepted_questions(monkeypatch):
+    reports = []
+    monkeypatch.setattr(llm_backend, "generate", scripted_generate(
+        lambda name, first, n: questions(1, n)  # every tier repeats EASY's texts at first
+    ))
+    with pytest.raises(ValueError):
+        with query_pdf.use_progress(lambda stage, **info: reports.append(info["ready"])):
+            query_pdf.generate_neutral_content_fanout("text")
+    assert reports and max(reports) < 17
+
+
+def test_extra_questions_are_clipped(monkeypatch):
+    monkeypatch.setattr(llm_backend, "generate", scripted_generate(lambda name, first, n: questions(first, n + 2)))
+    content = query_pdf.generate_neutral_content_fanout("text")
+    assert len(content["questions"]) == 17
+
+
+def test_tier_that_stays_short_fails(monkeypatch):
+    monkeypatch.setattr(llm_backend, "generate", scripted_generate(
+        lambda name, first, n: questions(first, n - 1 if name == "MEDIUM" else n)
+    ))
+    with pytest.raises(ValueError, match="MEDIUM"):
+        query_pdf.generate_neutral_content_fanout("text")
+
+
+def test_first_failure_does_not_wait_for_slow_tiers(monkeypatch):
+    def reply(name, first, n):
+        if name == "EASY":
+            raise RuntimeError("EASY failed")
+        time.sleep(1.0)
+        return questions(first, n)
+
+    monkeypatch.setattr(llm_backend, "generate", scripted_generate(reply))
+    start = time.perf_counter()
+    with pytest.raises(RuntimeError, match="EASY failed"):
+        query_pdf.generate_neutral_content_fanout("text")
+    assert time.perf_counter() - start < 0.5
@@ -0,0 +1,102 @@
+import asyncio
+import contextvars
+import threading
+
+import pytest
+
+from query_pdf import report_progress
+from quiz_jobs import QueueFull, QuizJobQueue
+
+
+class Recorder:
+    def __init__(self):
+        self.events = []
+
+    def __call__(self, stage, **info):
+        self.events.append((stage, info))
+
+
+def blocked_queue(workers=1, max_queued=2):
+    """A queue and an unset event; a job submitted as release.wait occupies its worker until release.set()."""
+    release = threading.Event()
+    queue = QuizJobQueue(workers=workers, max_queued=max_queued)
+    return queue, release
+
+
+def test_job_reports_its_stages():
+    queue = QuizJobQueue(workers=1)
+    progress = Recorder()
+
+    def work():
+        report_progress("questions", ready=5, total=17)
+        return "quiz"
+
+    job = queue.submit(work, on_progress=progress)
+    assert job.future.result(timeout=2) == "quiz"
+    assert [stage for stage, _ in progress.events] == ["started", "questions", "done"]
+    assert progress.events[1][1] == {"ready": 5, "total": 17}
+
+
+def test_waiting_jobs_hear_their_position_and_full_queue_rejects():
+    queue, release = blocked_queue()
+    first = queue.submit(release.wait)
+    waiting = [Recorder(), Recorder()]
+    jobs = [queue.submit(lambda: "ok", on_progress=p) for p in waiting]
+    with pytest.raises(QueueFull):
+        queue.submit(lambda: "too many")
+    assert queue.stats() == {"running": 1, "queued": 2, "workers": 1, "rejected": 1}
+    assert waiting[1].events[0] == ("queued", {"position": 2})
+
+    release.set()
+    assert [job.future.result(timeout=2) for job in jobs] == ["ok", "ok"]
+    first.future.result(timeout=2)
+    # moved up to position 1 once the first job finished
+    assert ("queued", {"position": 1}) in waiting[1].events
+
+
+def test_errors_reach_the_submitter():
+    queue = QuizJobQueue(workers=1)
+
+    def fail():
+        raise RuntimeError("bad PDF")
+
+    job = queue.submit(fail)
+    with pytest.raises(RuntimeError, match="bad PDF"):
+        job.future.result(timeout=2)
+    assert queue.stats()["running"] == 0
+
+
+def test_submitters_context_goes_with_the_job():
+    var = contextvars.ContextVar("backend", default="gemini")
+    queue = QuizJobQueue(workers=1)
+    token = var.set("fake")
+    try:
+        job = queue.submit(var.get)
+    finally:
+        var.reset(token)
+    assert job.future.result(timeout=2) == "fake"
+
+
+def test_cancelled_task_drops_a_queued_job():
+    async def run():
+        queue, release = blocked_queue()
+        first = queue.submit(release.wait)
+        ran = []
+        job = queue.submit(lambda: ran.append(1))
+        task = queue.as_task(job)
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        release.set()
+        await asyncio.wrap_future(first.future)
+        return job, ran
+
+    job, ran = asyncio.run(run())
+    assert job.future.cancelled() and ran == []
+
+
+def test_keyword_arguments_reach_the_job():
+    queue = QuizJobQueue(workers=1)
+    job = queue.submit(lambda text, fresh=False: (text, fresh), "doc", fresh=True)
+    assert job.future.result(timeout=2) == ("doc", True)
@@ -0,0 +1,77 @@
+import pytest
+
+import quiz_pipeline
+from llm_backend import fake_quiz_data
+from quiz_pipeline import NeutralContentCache, build_quiz, get_neutral_content, style_quiz
+
+MIA = {"name": "Mia", "gender": "female", "country": "Italy"}
+LEO = {"name": "Leo", "gender": "male", "country": "Spain"}
+
+
+@pytest.fixture
+def generations(monkeypatch):
+    """Fresh neutral cache; counts stage 1 generations."""
+    calls = []
+
+    def generate(text, images=None):
+        calls.append(text)
+        data = fake_quiz_data(3)
+        for q in data["questions"]:
+            del q["introduction"], q["romance_level"]
+        return {"summary": f"Summary of {text}.", "study_guide": data["study_guide"],
+                "questions": data["questions"]}
+
+    monkeypatch.setattr(quiz_pipeline, "NEUTRAL_CACHE", NeutralContentCache(max_docs=2))
+    monkeypatch.setattr(quiz_pipeline, "generate_neutral_content", generate)
+    return calls
+
+
+def test_learners_of_one_document_share_stage_one(generations):
+    mia = build_quiz("doc", "text", MIA)
+    leo = build_quiz("doc", "text", LEO)
+    assert generations == ["text"]
+    assert [q["question_text"] for q in mia["questions"]] == [q["question_text"] for q in leo["questions"]]
+    assert quiz_pipeline.NEUTRAL_CACHE.stats()["hits"] == 1
+
+
+def test_styling_never_mutates_the_shared_content(generations):
+    neutral = get_neutral_content("doc", "text")
+    quiz = build_quiz("doc", "text", MIA)
+    quiz["questions"][0]["question_text"] = "changed"
+    assert "introduction" not in neutral["questions"][0]
+    assert get_neutral_content("doc", "text")["questions"][0]["question_text"] != "changed"
+
+
+def test_fresh_generates_and_replaces_the_cached_set(generations):
+    first = get_neutral_content("doc", "text")
+    again = get_neutral_content("doc", "text", fresh=True)
+    assert len(generations) == 2
+    assert get_neutral_content("doc", "text") is again is not first
+
+
+def test_cache_is_lru_bounded(generations):
+    for doc in ("a", "b", "a", "c"):  # "a" was used again, so "b" is evicted
+        get_neutral_content(doc, doc)
+    get_neutral_content("a", "a")
+    get_neutral_content("b", "b")
+    assert generations == ["a", "b", "c", "b"]
+
+
+def test_styling_is_applied_per_learner(generations):
+    quiz = build_quiz("doc", "text", MIA)
+    assert quiz["sweet_summary"] == "Fake persona summary."
+    assert quiz["questions"][0]["introduction"] == "Fake intro 1."
+
+
+def test_failed_styling_falls_back_to_the_neutral_text(generations, monkeypatch):
+    neutral = get_neutral_content("doc", "text")
+
+    def fail(neutral, user_info):
+        raise RuntimeError("quota exceeded")
+
+    monkeypatch.setattr(quiz_pipeline, "generate_persona_styling", fail)
+    quiz = style_quiz(neutral, MIA)
+    assert quiz["sweet_summary"] == neutral["summary"]
+    assert all(q["introduction"] == "" for q in quiz["questions"])
+    assert quiz["daily_romantic_message_seed"] == ""
+    assert len(quiz["questions"]) == len(neutral["questions"])
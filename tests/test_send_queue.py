@@ -0,0 +1,125 @@
+import asyncio
+import time
+
+import pytest
+from telegram.error import RetryAfter
+
+from send_queue import Outbox, TokenBucket, split_text
+
+
+class FakeBot:
+    def __init__(self, fail_first=None):
+        self.sent = []
+        self.fail_first = fail_first
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if self.fail_first is not None:
+            error, self.fail_first = self.fail_first, None
+            raise error
+        self.sent.append((chat_id, text, kwargs))
+        return len(self.sent)
+
+
+def test_token_bucket_burst_then_wait():
+    bucket = TokenBucket(rate=10.0, capacity=2.0)
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.01)
+    assert bucket.refill_seconds() == pytest.approx(0.3, abs=0.02)
+
+
+def test_split_text_prefers_newlines():
+    chunks = split_text("a" * 6 + "\n" + "b" * 6, limit=10)
+    assert chunks == ["a" * 6, "b" * 6]
+
+
+def test_small_messages_are_coalesced_in_order():
+    async def run():
+        bot, outbox = FakeBot(), Outbox(global_rate=1000, per_chat_rate=1000)
+        futures = [outbox.post(bot, 1, f"part {i}") for i in range(3)]
+        futures.append(outbox.post(bot, 1, "pick one", reply_markup="kb"))
+        await asyncio.gather(*futures)
+        return bot.sent
+
+    sent = asyncio.run(run())
+    assert sent == [(1, "part 0\n\npart 1\n\npart 2", {}), (1, "pick one", {"reply_markup": "kb"})]
+
+
+def test_per_chat_rate_is_enforced():
+    async def run():
+        bot, outbox = FakeBot(), Outbox(global_rate=1000, per_chat_rate=20, per_chat_burst=1)
+        start = time.monotonic()
+        await asyncio.gather(*(outbox.post(bot, 1, str(i), coalesce=False) for i in range(4)))
+        return time.monotonic() - start
+
+    assert asyncio.run(run()) >= 0.14
+
+
+def test_retry_after_is_honoured():
+    async def run():
+        bot = FakeBot(fail_first=RetryAfter(0.05))
+        outbox = Outbox(global_rate=1000, per_chat_rate=1000)
+        start = time.monotonic()
+        await outbox.send(bot, 1, "hi")
+        return bot.sent, time.monotonic() - start
+
+    sent, elapsed = asyncio.run(run())
+    assert sent == [(1, "hi", {})] and elapsed >= 0.05
+
+
+def test_failed_send_reaches_the_caller():
+    async def run():
+        bot = FakeBot(fail_first=RuntimeError("chat not found"))
+        outbox = Outbox(global_rate=1000, per_chat_rate=1000)
+        with pytest.raises(RuntimeError):
+            await outbox.send(bot, 1, "lost", coalesce=False)
+        # the chat still works afterwards
+        await outbox.send(bot, 1, "next")
+        return bot.sent
+
+    assert asyncio.run(run()) == [(1, "next", {})]
+
+
+def test_idle_chats_are_forgotten():
+    async def run():
+        bot, outbox = FakeBot(), Outbox(global_rate=1000, per_chat_rate=50, per_chat_burst=1)
+        await asyncio.gather(*(outbox.post(bot, chat_id, "hi") for chat_id in range(5)))
+        drained = (dict(outbox._queues), dict(outbox._workers), len(outbox._buckets))
+        await asyncio.sleep(0.1)  # every bucket has refilled
+        return drained, outbox.stats()
+
+    (queues, workers, buckets), stats = asyncio.run(run())
+    assert queues == {} and workers == {} and buckets == 5
+    assert stats == {"queued_now": 0, "active_chats": 0, "tracked_chats": 0}
+
+
+class FakeSentMessage:
+    chat_id = 1
+
+    def __init__(self, fail_first=None):
+        self.edits = []
+        self.fail_first = fail_first
+
+    async def edit_text(self, text, **kwargs):
+        if self.fail_first is not None:
+            error, self.fail_first = self.fail_first, None
+            raise error
+        self.edits.append(text)
+        return self
+
+
+def test_edits_share_the_chat_bucket_and_honour_retry_after():
+    async def run():
+        bot, outbox = FakeBot(), Outbox(global_rate=1000, per_chat_rate=20, per_chat_burst=1)
+        message = FakeSentMessage(fail_first=RetryAfter(0.05))
+        start = time.monotonic()
+        await outbox.send(bot, 1, "placeholder", coalesce=False)
+        await outbox.edit(message, "final")
+        elapsed = time.monotonic() - start
+        await asyncio.sleep(0.1)  # bucket refilled
+        return message.edits, elapsed, outbox.stats()
+
+    edits, elapsed, stats = asyncio.run(run())
+    # one token after the send, one more after the RetryAfter
+    assert edits == ["final"] and elapsed >= 0.05 + 0.05
+    assert stats["tracked_chats"] == 0
@@ -0,0 +1,72 @@
+import threading
+import time
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def run_together(n, fn):
+    results, threads = [None] * n, []
+    for i in range(n):
+        def target(i=i):
+            try:
+                results[i] = fn()
+            except Exception as e:
+                results[i] = e
+        threads.append(threading.Thread(target=target))
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def test_concurrent_calls_share_one_run():
+    flight = SingleFlight("test")
+    calls = []
+
+    def work():
+        calls.append(1)
+        deadline = time.time() + 2
+        while flight.stats()["calls"] < 8 and time.time() < deadline:
+            time.sleep(0.01)  # hold the flight open until every caller has joined
+        return "result"
+
+    results = run_together(8, lambda: flight.do("doc", work))
+    assert results == ["result"] * 8
+    assert len(calls) == 1
+    stats = flight.stats()
+    assert (stats["calls"], stats["coalesced"], stats["inflight"]) == (8, 7, 0)
+
+
+def test_followers_get_the_leaders_exception():
+    flight = SingleFlight("test")
+
+    def fail():
+        deadline = time.time() + 2
+        while flight.stats()["calls"] < 4 and time.time() < deadline:
+            time.sleep(0.01)
+        raise ValueError("unreadable PDF")
+
+    results = run_together(4, lambda: flight.do("doc", fail))
+    assert all(isinstance(r, ValueError) for r in results)
+    assert len({id(r) for r in results}) == 1
+
+
+def test_different_keys_run_separately():
+    flight = SingleFlight("test")
+    assert flight.do("a", lambda: 1) == 1
+    assert flight.do("b", lambda: 2) == 2
+    assert flight.stats()["coalesced"] == 0
+
+
+def test_nothing_is_kept_after_the_call():
+    flight = SingleFlight("test")
+    calls = []
+    for _ in range(3):
+        flight.do("doc", lambda: calls.append(1))
+    assert len(calls) == 3
+    with pytest.raises(KeyError):
+        flight.do("doc", lambda: {}["missing"])
+    assert flight.do("doc", lambda: "recovered") == "recovered"
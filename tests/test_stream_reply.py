@@ -0,0 +1,66 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import bot
+
+
+class Placeholder:
+    chat_id = 7
+
+
+@pytest.fixture
+def outbox(monkeypatch):
+    log = []
+
+    async def send(bot_, chat_id, text, coalesce=True, **kwargs):
+        log.append(("send", text))
+        return Placeholder()
+
+    async def edit(message, text, **kwargs):
+        log.append(("edit", text))
+
+    monkeypatch.setattr(bot.OUTBOX, "send", send)
+    monkeypatch.setattr(bot.OUTBOX, "edit", edit)
+    monkeypatch.setattr(bot, "STREAM_EDIT_INTERVAL", 0.05)
+    return log
+
+
+async def chunks(parts, delay=0.0):
+    for part in parts:
+        await asyncio.sleep(delay)
+        yield part
+
+
+def stream(parts, delay=0.0, limit=3500):
+    return asyncio.run(bot.stream_reply(SimpleNamespace(bot=None), 7, chunks(parts, delay), limit))
+
+
+def test_edits_are_throttled_and_the_last_one_is_complete(outbox):
+    start = time.perf_counter()
+    text = stream([f"w{i} " for i in range(20)], delay=0.01)  # ~0.2s of chunks
+    elapsed = time.perf_counter() - start
+    edits = [t for kind, t in outbox if kind == "edit"]
+    assert outbox[0] == ("send", "💭 …")
+    # at most one progress edit per interval, plus the final one
+    assert 2 <= len(edits) <= elapsed / 0.05 + 1 and len(edits) < 20
+    assert all(t.endswith(" ▌") for t in edits[:-1])
+    assert edits[-1] == text == "".join(f"w{i} " for i in range(20))
+
+
+def test_overflow_is_sent_as_new_messages(outbox):
+    text = stream(["a" * 30, "b" * 30], limit=40)
+    assert text == "a" * 30 + "b" * 30
+    assert outbox[1:] == [("edit", "a" * 30 + "b" * 10), ("send", "b" * 20)]
+
+
+def test_a_failing_stream_keeps_what_arrived(outbox):
+    async def broken():
+        yield "Partial answer"
+        raise RuntimeError("connection reset")
+
+    text = asyncio.run(bot.stream_reply(SimpleNamespace(bot=None), 7, broken()))
+    assert text == ""  # nothing to cache or remember
+    assert outbox[-1][1].startswith("Partial answer\n\n😢")